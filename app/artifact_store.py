@@ -0,0 +1,96 @@
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from file_store import atomic_write, purge_dir
+
+ARTIFACT_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class ArtifactStore:
+    """
+    Short-lived store for response images fetched by ID after a /predict call.
+    Entries expire after `ttl` seconds; the oldest ones are dropped when the
+    total size exceeds `max_bytes`. Entries live in memory, or as one file each
+    in `directory`, shared by every process using it (several HTTP workers).
+    The directory is scanned every `purge_interval` seconds, or sooner once
+    this process alone has written past `max_bytes` since the last scan.
+    """
+
+    def __init__(self, ttl: float = 300, max_bytes: int = 256 * 1024 * 1024, directory: str = None,
+                 purge_interval: float = 10):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.purge_interval = purge_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._items = OrderedDict()  # id -> (expires_at, media_type, data)
+        self._bytes = 0  # In memory, or in the directory as of the last scan plus this process's writes
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    def _drop(self, artifact_id):
+        _, _, data = self._items.pop(artifact_id)
+        self._bytes -= len(data)
+
+    def _purge(self, now):
+        # Items are kept in insertion order, so expired ones are at the front
+        while self._items:
+            artifact_id, (expires_at, _, _) = next(iter(self._items.items()))
+            if expires_at > now and self._bytes <= self.max_bytes:
+                break
+            self._drop(artifact_id)
+
+    def _path(self, artifact_id):
+        return os.path.join(self.directory, f"{artifact_id}.pkl")
+
+    def put(self, data: bytes, media_type: str) -> str:
+        """
+        Store `data` and return its (unguessable) ID. Raises ValueError if
+        `data` alone is larger than the store.
+        """
+        if len(data) > self.max_bytes:
+            raise ValueError(f"Artifact of {len(data)} bytes exceeds the store size ({self.max_bytes} bytes)")
+        artifact_id = uuid.uuid4().hex
+        now = time.time()
+        if self.directory:
+            atomic_write(self._path(artifact_id), (now + self.ttl, media_type, bytes(data)))
+            with self._lock:
+                self._bytes += len(data)
+                if now >= self._next_purge or self._bytes > self.max_bytes:
+                    # Same rules as _purge on the files of the directory, oldest first by mtime
+                    self._bytes = purge_dir(self.directory, self.ttl, self.max_bytes, now=now, suffix=".pkl")
+                    self._next_purge = now + self.purge_interval
+            return artifact_id
+
+        with self._lock:
+            self._items[artifact_id] = (now + self.ttl, media_type, bytes(data))
+            self._bytes += len(data)
+            self._purge(now)
+        return artifact_id
+
+    def get(self, artifact_id: str):
+        """Return (media_type, data) or None if unknown or expired."""
+        if self.directory:
+            if not ARTIFACT_ID_PATTERN.fullmatch(artifact_id):
+                return None
+            try:
+                with open(self._path(artifact_id), "rb") as f:
+                    item = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                return None
+            if item[0] <= time.time():
+                return None
+            return item[1], item[2]
+
+        with self._lock:
+            self._purge(time.time())
+            item = self._items.get(artifact_id)
+        if item is None:
+            return None
+        return item[1], item[2]
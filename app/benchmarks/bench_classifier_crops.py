@@ -0,0 +1,106 @@
+"""
+Microbenchmark: classifier_crops in "direct" mode (windows of the decoded
+image resized straight to 224x224) against "legacy" mode (whole image resized
+to the classifier frame, then smart_crop_from_box per box), on synthetic
+mammograms with random boxes. Also prints how much the direct patches differ
+from the legacy ones; their parity is checked by tests/test_classifier_crops.py.
+--features also compares the deep features and the classifier labels
+(random weights unless --models real).
+
+Run from the app directory:
+    python benchmarks/bench_classifier_crops.py --detections 1 5 20
+    python benchmarks/bench_classifier_crops.py --features --models real
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_merge_masks import time_call
+from bench_pipeline import install_random_models, planted_lesions, synthetic_mammogram
+import classifier_utils
+import pipeline
+from classifier_utils import CLASSIFIER_FRAME, classifier_crops, set_crop_mode
+from image_processing import load_rgb_image
+from model_utils import Detections
+
+
+def synthetic_image(height, width, seed=0):
+    """Synthetic mammogram as the RGB array the pipeline passes to the classifier."""
+    pixels = synthetic_mammogram(height, width, planted_lesions(4, seed), seed)
+    return load_rgb_image((pixels >> 4).astype(np.uint8))
+
+
+def synthetic_boxes(n, height, width, seed=0):
+    """Boxes from a few pixels to most of the image, some against the borders, some below the score cut."""
+    rng = np.random.default_rng(seed)
+    sides = rng.uniform(0.01, 0.6, (n, 2)) * [width, height]
+    x1 = rng.uniform(-0.05, 1.0, n) * (width - sides[:, 0])
+    y1 = rng.uniform(-0.05, 1.0, n) * (height - sides[:, 1])
+    boxes = np.stack([x1, y1, x1 + sides[:, 0], y1 + sides[:, 1]], axis=1)
+    boxes = np.clip(boxes, 0, [width - 1, height - 1, width - 1, height - 1]).astype(np.int64)
+    scores = rng.uniform(0.3, 1.0, n).astype(np.float32)
+    return Detections(boxes, np.ones(n, dtype=np.int64), scores, [], (height, width))
+
+
+def crops(mode, image, detections):
+    set_crop_mode(mode)
+    return np.array(classifier_crops(image, detections)).reshape(-1, 224, 224, 3)
+
+
+def compare_features(image, detections, models):
+    """Deep features and classifier labels of both modes on the same detections."""
+    if models == "real":
+        pipeline.init_models()
+    else:
+        install_random_models([])
+    features, labels = {}, {}
+    for mode in ("legacy", "direct"):
+        features[mode] = classifier_utils.extract_deep_features(crops(mode, image, detections))
+        labels[mode] = classifier_utils.predict_labels(pipeline.classifier, features[mode])
+    legacy, direct = features["legacy"], features["direct"]
+    cosine = np.sum(legacy * direct, axis=1) / (np.linalg.norm(legacy, axis=1) * np.linalg.norm(direct, axis=1))
+    agreement = float(np.mean(labels["legacy"] == labels["direct"]))
+    print(f"features: min cosine similarity {cosine.min():.5f}, label agreement {agreement:.0%} "
+          f"({len(direct)} crops, {models} models)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--detections", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--sizes", nargs="+", default=["3328x2560", "2294x1914", "1147x957", "800x600"],
+                        help="HEIGHTxWIDTH of the test images")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--features", action="store_true", help="Also compare deep features and labels")
+    parser.add_argument("--models", choices=["random", "real"], default="random")
+    args = parser.parse_args()
+
+    print(f"classifier frame {CLASSIFIER_FRAME[0]}x{CLASSIFIER_FRAME[1]}")
+    print(f"{'image':>10} {'n':>4} {'legacy ms':>10} {'direct ms':>10} {'speedup':>8} {'mean diff':>10} {'max diff':>9}")
+    for size in args.sizes:
+        height, width = map(int, size.split("x"))
+        image = synthetic_image(height, width, seed=height)
+        for n in args.detections:
+            detections = synthetic_boxes(n, height, width, seed=n)
+            legacy_time, legacy = time_call(crops, "legacy", image, detections, repeat=args.repeat)
+            direct_time, direct = time_call(crops, "direct", image, detections, repeat=args.repeat)
+
+
+            difference = np.abs(legacy.astype(np.int16) - direct.astype(np.int16))
+            mean_difference = difference.reshape(len(difference), -1).mean(axis=1).max() if len(difference) else 0.0
+            max_difference = int(difference.max()) if len(difference) else 0
+            print(f"{size:>10} {n:>4} {legacy_time * 1000:>10.2f} {direct_time * 1000:>10.2f} "
+                  f"{legacy_time / direct_time:>7.1f}x {mean_difference:>10.3f} {max_difference:>9}")
+
+    if args.features:
+        height, width = map(int, args.sizes[0].split("x"))
+        detections = synthetic_boxes(max(args.detections), height, width)
+        compare_features(synthetic_image(height, width), detections, args.models)
+
+    set_crop_mode("direct")
+
+
+if __name__ == "__main__":
+    main()
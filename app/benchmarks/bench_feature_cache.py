@@ -0,0 +1,72 @@
+"""
+Microbenchmark: deep features of the classifier crops with the feature cache
+cold, warm in memory, and warm from its memory-mapped store after a restart
+(a new FeatureCache on the same file), against no cache. Checks that cached
+vectors give the same features and labels. Backbones have random weights.
+
+Run from the app directory:
+    python benchmarks/bench_feature_cache.py --crops 1 5 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_merge_masks import time_call
+from bench_pipeline import install_random_models
+import classifier_utils
+import pipeline
+from classifier_utils import cached_deep_features, predict_labels, set_feature_cache
+from feature_cache import FeatureCache
+
+
+def synthetic_crops(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (n, 224, 224, 3), dtype=np.uint8)
+
+
+def labels(features):
+    return predict_labels(pipeline.classifier, features)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--crops", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    install_random_models([])
+    dimension = classifier_utils.extract_deep_features(synthetic_crops(1)).shape[1]
+    print(f"{dimension} features per crop ({dimension * 4 / 1024:.0f} KiB)")
+    print(f"{'n':>4} {'uncached ms':>12} {'cold ms':>9} {'memory ms':>10} {'store ms':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.crops:
+            crops = synthetic_crops(n, seed=n)
+            set_feature_cache(None)
+            uncached_time, expected = time_call(cached_deep_features, crops, repeat=args.repeat)
+
+            path = os.path.join(tmp, f"features{n}.npy")
+            cache = FeatureCache(dimension, path=path, namespace="bench")
+            set_feature_cache(cache)
+            cold_time, cold = time_call(cached_deep_features, crops, repeat=1)
+            memory_time, warm = time_call(cached_deep_features, crops, repeat=args.repeat)
+            cache.store.flush()
+            cache.store._lock_file.close()  # As if the process had exited
+
+            set_feature_cache(FeatureCache(dimension, path=path, namespace="bench"))
+            store_time, stored = time_call(cached_deep_features, crops, repeat=1)
+
+            for features in (cold, warm, stored):
+                assert np.allclose(features, expected, rtol=1e-4, atol=1e-5), "cached features differ"
+                assert np.array_equal(labels(features), labels(expected)), "labels differ"
+            assert np.array_equal(stored, cold), "the store did not return the written vectors"
+            print(f"{n:>4} {uncached_time * 1000:>12.1f} {cold_time * 1000:>9.1f} {memory_time * 1000:>10.2f} "
+                  f"{store_time * 1000:>9.2f} {uncached_time / memory_time:>7.0f}x")
+    set_feature_cache(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Latency of the classifier feature-extraction backends (keras predict per
+backbone, fused tf.function, ONNX Runtime) on random ROI batches.
+Their parity with the Keras features is checked by tests/test_feature_extractor.py.
+
+Run from the app directory:
+    python benchmarks/bench_feature_extractor.py --backends keras fused onnx
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import classifier_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", default=["keras", "fused"], choices=classifier_utils.FEATURE_BACKENDS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 3, 8])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--onnx-path", default=os.path.join("models", "feature_extractor.onnx"))
+    args = parser.parse_args()
+
+    classifier_utils.load_feature_extractors()
+    rng = np.random.default_rng(0)
+    batches = {n: rng.integers(0, 256, size=(n, 224, 224, 3), dtype=np.uint8) for n in args.batch_sizes}
+
+    print(f"{'backend':>8} {'batch':>6} {'mean ms':>9}")
+    for backend in args.backends:
+        classifier_utils.set_feature_backend(backend, args.onnx_path)
+        for n, batch in batches.items():
+            classifier_utils.extract_deep_features(batch)  # Warm-up / tracing
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                classifier_utils.extract_deep_features(batch)
+            mean_ms = (time.perf_counter() - start) / args.repeat * 1000
+            print(f"{backend:>8} {n:>6} {mean_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Microbenchmark: crop-based calculate_lesion_features with the vectorized GLCM
+homogeneity against the previous full-image scikit-image implementation.
+Their features are compared by tests/test_lesion_features.py.
+
+Run from the app directory:
+    python benchmarks/bench_lesion_features.py --detections 1 5 10 20
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from skimage import feature, measure, morphology
+from skimage.color import rgb2gray
+from skimage.measure import perimeter_crofton
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_merge_masks import time_call
+from bench_render import synthetic_case
+from image_processing import calculate_lesion_features
+
+
+def calculate_lesion_features_reference(mask, image, pixel_spacing, min_area_px=10):
+    """The full-image implementation this benchmark compares against."""
+    if image.ndim == 3 and image.shape[2] == 3:
+        image = rgb2gray(image)
+    bin_mask = morphology.remove_small_objects(mask.astype(bool), min_size=min_area_px)
+    region = measure.regionprops(measure.label(bin_mask), intensity_image=image)[0]
+
+    area_mm2 = region.area * (pixel_spacing ** 2)
+    perim_mm = perimeter_crofton(region.image, directions=4) * pixel_spacing
+    circularity = (4 * np.pi * area_mm2) / (perim_mm ** 2) if perim_mm > 0 else 0.0
+
+    minr, minc, maxr, maxc = region.bbox
+    patch = image[minr:maxr, minc:maxc]
+    homogeneity = np.nan
+    if patch.size >= 4:
+        patch_normalized = ((patch - patch.min()) / (patch.max() - patch.min() + 1e-7) * 255).astype(np.uint8)
+        quant = np.digitize(patch_normalized, np.linspace(0, 256, 17)) - 1
+        quant = np.where(region.image, quant, 16).astype(np.uint8)
+        glcm = feature.graycomatrix(quant, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4],
+                                    levels=17, symmetric=True, normed=True)
+        glcm_lesion = glcm[:16, :16, :, :]
+        if glcm_lesion.size and np.any(glcm_lesion):
+            homogeneity = float(np.mean(feature.graycoprops(glcm_lesion, 'homogeneity')))
+
+    return {
+        'morphology': {'area_mm2': area_mm2, 'perimeter_mm': perim_mm, 'circularity': circularity,
+                       'eccentricity': region.eccentricity},
+        'intensity': {'mean': region.mean_intensity, 'std_dev': region.intensity_std},
+        'texture': {'glcm_homogeneity': homogeneity}
+    }
+
+
+def reference_run(image, detections, pixel_spacing):
+    return [calculate_lesion_features_reference(detections.full_mask(i), image, pixel_spacing)
+            for i in range(len(detections))]
+
+
+def crop_run(image, detections, pixel_spacing, pool=None):
+    def lesion_features(i):
+        return calculate_lesion_features(detections.masks[i], image, pixel_spacing, box=detections.boxes[i])
+
+    if pool is not None:
+        return list(pool.map(lesion_features, range(len(detections))))
+    return [lesion_features(i) for i in range(len(detections))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--detections", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--height", type=int, default=3328)
+    parser.add_argument("--width", type=int, default=2560)
+    parser.add_argument("--pixel-spacing", type=float, default=0.07)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    print(f"{'n':>4} {'reference ms':>13} {'crop ms':>8} {'pool ms':>8} {'speedup':>8}")
+    for n in args.detections:
+        image, detections = synthetic_case(n, args.height, args.width, seed=n)
+        ref_time, _ = time_call(reference_run, image, detections, args.pixel_spacing, repeat=args.repeat)
+        crop_time, _ = time_call(crop_run, image, detections, args.pixel_spacing, repeat=args.repeat)
+        pool_time, _ = time_call(crop_run, image, detections, args.pixel_spacing, pool, repeat=args.repeat)
+
+        print(f"{len(detections):>4} {ref_time * 1000:>13.1f} {crop_time * 1000:>8.1f} {pool_time * 1000:>8.1f} "
+              f"{ref_time / crop_time:>7.1f}x")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Microbenchmark: vectorized merge_overlapping_masks against the previous
+nested-loop implementation, on synthetic detector outputs. Their outputs
+are compared by tests/test_merge_masks.py.
+
+Run from the app directory:
+    python benchmarks/bench_merge_masks.py --detections 5 20 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_utils import merge_overlapping_masks
+
+
+def calculate_iou_reference(mask1, mask2):
+    intersection = np.logical_and(mask1, mask2)
+    union = np.logical_or(mask1, mask2)
+    return np.sum(intersection) / np.sum(union)
+
+def mask_to_box_reference(mask):
+    pos = np.where(mask)
+    if pos[0].size == 0 or pos[1].size == 0:
+        return [0, 0, 0, 0]
+    return [np.min(pos[1]), np.min(pos[0]), np.max(pos[1]), np.max(pos[0])]
+
+def merge_overlapping_masks_reference(masks, labels, scores, iou_threshold=0.0):
+    """The O(n²) full-resolution implementation this benchmark compares against."""
+    if len(masks) == 0:
+        return np.array([]), np.array([]), np.array([]), np.array([])
+
+    binary_masks = np.stack([(mask.squeeze() > 0.5).astype(np.float32) for mask in masks])
+    merged_masks, merged_labels, merged_scores, merged_boxes = [], [], [], []
+    used_indices = set()
+
+    for i in range(len(binary_masks)):
+        if i in used_indices:
+            continue
+        merge_candidates = [i]
+        for j in range(i + 1, len(binary_masks)):
+            if (j not in used_indices and
+                labels[j] == labels[i] and
+                calculate_iou_reference(binary_masks[i], binary_masks[j]) > iou_threshold):
+                merge_candidates.append(j)
+
+        if len(merge_candidates) > 1:
+            combined_mask = np.max(binary_masks[merge_candidates], axis=0)
+            max_score = max(scores[merge_candidates])
+        else:
+            combined_mask = binary_masks[i]
+            max_score = scores[i]
+
+        merged_masks.append(combined_mask)
+        merged_labels.append(labels[i])
+        merged_scores.append(max_score)
+        merged_boxes.append(mask_to_box_reference(combined_mask))
+        used_indices.update(merge_candidates)
+
+    return np.stack(merged_masks), np.array(merged_labels), np.array(merged_scores), np.array(merged_boxes)
+
+
+def synthetic_detections(n, height=1147, width=957, seed=0):
+    """Soft elliptical blobs shaped like Mask R-CNN outputs (N, 1, H, W)."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width]
+    masks = np.zeros((n, 1, height, width), dtype=np.float32)
+    for k in range(n):
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        ry, rx = rng.uniform(10, 120, size=2)
+        dist = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2
+        masks[k, 0] = np.clip(1.5 - dist, 0, 1)
+    labels = rng.integers(1, 3, size=n)
+    scores = rng.uniform(0.5, 1.0, size=n).astype(np.float32)
+    return masks, labels, scores
+
+
+def time_call(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--detections", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'n':>4} {'reference ms':>14} {'vectorized ms':>14} {'speedup':>8}")
+    for n in args.detections:
+        masks, labels, scores = synthetic_detections(n, seed=n)
+        ref_time, _ = time_call(merge_overlapping_masks_reference, masks, labels, scores, repeat=args.repeat)
+        new_time, _ = time_call(merge_overlapping_masks, masks, labels, scores, repeat=args.repeat)
+        print(f"{n:>4} {ref_time * 1000:>14.1f} {new_time * 1000:>14.1f} {ref_time / new_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
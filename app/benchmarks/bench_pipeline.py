@@ -0,0 +1,333 @@
+"""
+End-to-end benchmark: every pipeline stage in isolation and the full /predict
+path, on synthetic mammograms (PNG, JPEG, DICOM) with planted lesions.
+
+By default the models have random weights (no checkpoint needed): the
+detector runs its real forward pass but reports the planted lesions, so the
+stages after it see realistic detections. --models real loads models/.
+The JSON report (latency percentiles, throughput, peak RSS) can be compared
+with a previous one.
+
+Run from the app directory:
+    python benchmarks/bench_pipeline.py --output report.json
+    python benchmarks/bench_pipeline.py --baseline report.json --tolerance 1.2
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+# Same import order as the app: torchvision must load before Keras
+import model_utils
+import pipeline
+import classifier_utils
+from classifier_utils import classify
+from dicom_utils import dicom_to_png, read_dicom
+from image_processing import calculate_lesion_features, load_rgb_image, process_predictions
+from model_utils import merge_overlapping_masks, predict
+
+# Digital Mammography X-Ray Image Storage - For Presentation
+MAMMOGRAPHY_SOP_CLASS = "1.2.840.10008.5.1.4.1.1.1.2"
+
+
+def planted_lesions(count, seed=0):
+    """
+    Lesions as (cy, cx, ry, rx, label, score) relative to the image size,
+    inside the breast: masses (label 2) and small calcifications (label 1).
+    """
+    rng = np.random.default_rng(seed)
+    lesions = []
+    for k in range(count):
+        label = 2 if k % 2 == 0 else 1
+        radius = rng.uniform(0.02, 0.05) if label == 2 else rng.uniform(0.004, 0.01)
+        lesions.append((rng.uniform(0.25, 0.75), rng.uniform(0.1, 0.45), radius, radius * rng.uniform(0.7, 1.3),
+                        label, rng.uniform(0.6, 0.99)))
+    return lesions
+
+
+def lesion_masks(lesions, height, width):
+    """Soft (N, 1, H, W) masks of the lesions, shaped like Mask R-CNN outputs."""
+    masks = np.zeros((len(lesions), 1, height, width), dtype=np.float32)
+    for k, (cy, cx, ry, rx, _, _) in enumerate(lesions):
+        # Only the lesion's neighbourhood is evaluated
+        y1, y2 = max(0, int((cy - 2 * ry) * height)), min(height, int((cy + 2 * ry) * height) + 1)
+        x1, x2 = max(0, int((cx - 2 * rx) * width)), min(width, int((cx + 2 * rx) * width) + 1)
+        yy, xx = np.mgrid[y1:y2, x1:x2]
+        dist = ((yy / height - cy) / ry) ** 2 + ((xx / width - cx) / rx) ** 2
+        masks[k, 0, y1:y2, x1:x2] = np.clip(1.5 - dist, 0, 1)
+    return masks
+
+
+def synthetic_mammogram(height, width, lesions, seed=0):
+    """12-bit left-facing breast: tissue falling off towards the skin line, noise, brighter lesions."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width].astype(np.float32)
+    # Half ellipse attached to the chest wall (left edge)
+    radius = ((yy / height - 0.5) / 0.45) ** 2 + (xx / width / 0.6) ** 2
+    tissue = np.clip(1 - radius, 0, 1) ** 0.5
+    image = 600 + 2200 * tissue + rng.normal(0, 60, size=(height, width)).astype(np.float32) * (tissue > 0)
+    masks = lesion_masks(lesions, height, width)
+    for mask, (_, _, _, _, label, _) in zip(masks, lesions):
+        image += (900 if label == 2 else 1200) * mask[0]
+    return np.clip(image, 0, 4095).astype(np.uint16)
+
+
+def encode_dicom(pixels, pixel_spacing):
+    """Bytes of a MONOCHROME2 12-bit mammography DICOM with spacing and window tags."""
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MAMMOGRAPHY_SOP_CLASS
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = MAMMOGRAPHY_SOP_CLASS
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = "MG"
+    ds.Rows, ds.Columns = pixels.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    ds.PixelSpacing = [pixel_spacing, pixel_spacing]
+    ds.WindowCenter, ds.WindowWidth = 2048, 4096
+    ds.PixelData = pixels.tobytes()
+
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def synthetic_inputs(height, width, lesions, pixel_spacing, seed=0):
+    """The same synthetic image as PNG, JPEG and DICOM bytes, and as the decoded RGB array."""
+    pixels = synthetic_mammogram(height, width, lesions, seed)
+    gray = (pixels >> 4).astype(np.uint8)
+    return {
+        ".png": cv2.imencode(".png", gray)[1].tobytes(),
+        ".jpg": cv2.imencode(".jpg", gray, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes(),
+        ".dcm": encode_dicom(pixels, pixel_spacing),
+    }, load_rgb_image(gray)
+
+
+class PlantedDetector:
+    """
+    Runs the wrapped detector's forward pass (its cost is what is measured)
+    but returns the planted lesions, scaled to each input tensor.
+    """
+
+    def __init__(self, model, lesions):
+        self.model = model
+        self.lesions = lesions
+
+    def eval(self):
+        self.model.eval()
+        return self
+
+    def __call__(self, images):
+        self.model(images)
+        outputs = []
+        for image in images:
+            masks = torch.from_numpy(lesion_masks(self.lesions, *image.shape[-2:]))
+            boxes, _ = model_utils.masks_to_boxes(masks[:, 0].numpy() > 0.5)
+            outputs.append({
+                "boxes": torch.from_numpy(boxes).float(),
+                "labels": torch.tensor([lesion[4] for lesion in self.lesions]),
+                "scores": torch.tensor([lesion[5] for lesion in self.lesions], dtype=torch.float32),
+                "masks": masks,
+            })
+        return outputs
+
+
+def install_random_models(lesions, seed=0):
+    """Random-weight detector, feature extractors, scaler and SVM in the pipeline globals."""
+    from keras.applications.convnext import ConvNeXtTiny
+    from keras.applications.densenet import DenseNet121
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    torch.manual_seed(seed)
+    rng = np.random.default_rng(seed)
+    detector = PlantedDetector(model_utils.build_model(checkpoint=None).eval(), lesions)
+
+    classifier_utils.model_densenet = DenseNet121(weights=None, include_top=False, input_shape=(224, 224, 3))
+    classifier_utils.model_convnext = ConvNeXtTiny(weights=None, include_top=False, input_shape=(224, 224, 3))
+    classifier_utils._fused_model = None
+    classifier_utils.set_feature_backend("fused")
+    dimension = classifier_utils.extract_deep_features(np.zeros((1, 224, 224, 3), dtype=np.uint8)).shape[1]
+
+    classifier_utils.scaler = StandardScaler().fit(rng.normal(size=(8, dimension)))
+    classifier = SVC(kernel="sigmoid", C=6).fit(rng.normal(size=(16, dimension)), [0, 1] * 8)
+    pipeline.model, pipeline.classifier = detector, classifier
+
+
+def summarize(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(samples.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p90_ms": round(float(np.percentile(samples, 90)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "min_ms": round(float(samples.min()), 3),
+        "max_ms": round(float(samples.max()), 3),
+        "throughput_per_s": round(1000 / float(samples.mean()), 3),
+        # Process high-water mark once the stage has run (monotonic across stages)
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    """Latencies (ms) of `repeat` calls of fn after `warmup` untimed calls."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def bench_stages(inputs, image, lesions, pixel_spacing, repeat):
+    """Each pipeline stage on its own, with the outputs of the previous one as input."""
+    height, width = image.shape[:2]
+    masks = lesion_masks(lesions, height, width)
+    labels = np.array([lesion[4] for lesion in lesions])
+    scores = np.array([lesion[5] for lesion in lesions], dtype=np.float32)
+    detections = predict(image, pipeline.model)
+    classify(image, detections, pipeline.classifier)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        dicom_path, png_path = os.path.join(tmp, "image.dcm"), os.path.join(tmp, "image.png")
+        with open(dicom_path, "wb") as f:
+            f.write(inputs[".dcm"])
+        # dicom_to_png logs its paths, keep them out of a report printed to stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["dicom_to_png"] = measure(lambda: dicom_to_png(dicom_path, png_path), repeat)
+    results["read_dicom"] = measure(lambda: read_dicom(inputs[".dcm"]), repeat)
+    results["predict"] = measure(lambda: predict(image, pipeline.model), repeat)
+    results["merge_overlapping_masks"] = measure(lambda: merge_overlapping_masks(masks, labels, scores), repeat)
+    results["classify"] = measure(lambda: classify(image, detections, pipeline.classifier), repeat)
+    results["process_predictions"] = measure(lambda: process_predictions(image, detections, pixel_spacing), repeat)
+    results["calculate_lesion_features"] = measure(lambda: [
+        calculate_lesion_features(mask, image, pixel_spacing, box=box)
+        for mask, box in zip(detections.masks, detections.boxes)
+    ], repeat)
+    return results
+
+
+def bench_endpoint(inputs, pixel_spacing, repeat, response_format):
+    """The full /predict path (upload, pool, pipeline, response) through the TestClient."""
+    from fastapi.testclient import TestClient
+    from unittest import mock
+
+    # Settings of the app under test, read when main is imported: the models of this
+    # process in a thread pool, no result cache, outbox or job files
+    with mock.patch.dict(os.environ, INFERENCE_EXECUTOR="thread", RESULT_CACHE_MAX_MB="0", OUTBOX_PATH="",
+                         JOB_STORE_DIR=""):
+        import main
+
+    results = {}
+    with TestClient(main.app) as client:
+        while client.get("/readyz").status_code != 200:
+            time.sleep(0.2)
+        for ext, content in inputs.items():
+            def call():
+                response = client.post(
+                    "/predict", params={"format": response_format},
+                    files={"file": (f"image{ext}", content, "application/octet-stream")},
+                    data={"pixel_spacing": str(pixel_spacing)}
+                )
+                assert response.status_code == 200, response.text[:200]
+            results[f"predict_endpoint{ext}"] = measure(call, repeat)
+    return results
+
+
+def compare(report, baseline, tolerance):
+    """Print mean latency ratios against a previous report; returns the stages slower than `tolerance`."""
+    regressions = []
+    print(f"{'stage':>28} {'baseline ms':>12} {'current ms':>11} {'ratio':>6}")
+    for stage, current in report["stages"].items():
+        previous = baseline["stages"].get(stage)
+        if previous is None:
+            continue
+        ratio = current["mean_ms"] / previous["mean_ms"]
+        flag = " !" if ratio > tolerance else ""
+        print(f"{stage:>28} {previous['mean_ms']:>12.1f} {current['mean_ms']:>11.1f} {ratio:>6.2f}{flag}")
+        if ratio > tolerance:
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, nargs=2, default=[2294, 1914], metavar=("HEIGHT", "WIDTH"),
+                        help="Synthetic image size (default: a CMMD mammogram)")
+    parser.add_argument("--lesions", type=int, default=4)
+    parser.add_argument("--pixel-spacing", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--models", choices=["random", "real"], default="random")
+    parser.add_argument("--format", default="json", help="Response format of the /predict calls")
+    parser.add_argument("--skip-endpoint", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="Previous report to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    lesions = planted_lesions(args.lesions, args.seed)
+    inputs, image = synthetic_inputs(*args.size, lesions, args.pixel_spacing, args.seed)
+    if args.models == "random":
+        install_random_models(lesions, args.seed)
+    else:
+        pipeline.init_models()
+
+    stages = bench_stages(inputs, image, lesions, args.pixel_spacing, args.repeat)
+    if not args.skip_endpoint:
+        stages.update(bench_endpoint(inputs, args.pixel_spacing, args.repeat, args.format))
+
+    report = {
+        "config": {
+            "size": args.size, "lesions": args.lesions, "pixel_spacing": args.pixel_spacing,
+            "repeat": args.repeat, "models": args.models, "format": args.format, "seed": args.seed,
+            "input_bytes": {ext: len(content) for ext, content in inputs.items()},
+        },
+        "environment": {
+            "python": platform.python_version(), "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(), "cpu_count": os.cpu_count(), "machine": platform.machine(),
+        },
+        "stages": stages,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Slower than {args.tolerance}x the baseline: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Microbenchmark: ROI-based render_predictions against the previous
+implementation that blended and copied the whole image per detection
+(their outputs are compared by tests/test_render.py).
+
+Run from the app directory:
+    python benchmarks/bench_render.py --detections 1 5 10 20
+"""
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_merge_masks import synthetic_detections, time_call
+from image_processing import CONTOUR_COLOR, COLOR, CUSTOM_CLASSES, render_predictions, set_render_options
+from model_utils import Detections, merge_overlapping_masks
+
+
+def draw_rounded_rectangle_reference(img, top_left, bottom_right, color, corner_radius=10, thickness=-1, alpha=0.6):
+    overlay = img.copy()
+    x1, y1 = top_left
+    x2, y2 = bottom_right
+    cv2.rectangle(overlay, (x1 + corner_radius, y1), (x2 - corner_radius, y2), color, thickness)
+    cv2.rectangle(overlay, (x1, y1 + corner_radius), (x2, y2 - corner_radius), color, thickness)
+    cv2.circle(overlay, (x1 + corner_radius, y1 + corner_radius), corner_radius, color, thickness)
+    cv2.circle(overlay, (x2 - corner_radius, y1 + corner_radius), corner_radius, color, thickness)
+    cv2.circle(overlay, (x1 + corner_radius, y2 - corner_radius), corner_radius, color, thickness)
+    cv2.circle(overlay, (x2 - corner_radius, y2 - corner_radius), corner_radius, color, thickness)
+    cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, img)
+    return img
+
+
+def render_predictions_reference(image_np, predictions):
+    """The full-image implementation render_predictions replaced."""
+    boxes, labels, scores = predictions.boxes, predictions.labels, predictions.scores
+    output = []
+    full_image = image_np.copy()
+    _, normal = cv2.imencode('.jpg', cv2.cvtColor(full_image, cv2.COLOR_RGB2BGR))
+    image_height, image_width = image_np.shape[:2]
+    colored_mask = np.zeros_like(image_np)
+
+    for i, (box, label, cls_result) in enumerate(zip(boxes, labels, predictions.classification)):
+        xmin, ymin, xmax, ymax = map(int, box)
+        mask = predictions.full_mask(i)
+        if CUSTOM_CLASSES[label - 1] == 'mass':
+            color_tbm, color_c = COLOR[0], CONTOUR_COLOR[0]
+        else:
+            color_tbm, color_c = COLOR[1], CONTOUR_COLOR[1]
+        colored_mask[:] = color_tbm
+
+        label_text = f"{int(scores[i] * 100)}% {CUSTOM_CLASSES[label - 1]}"
+        font = cv2.FONT_HERSHEY_DUPLEX
+        (text_w, text_h), baseline = cv2.getTextSize(label_text, font, 1.6, 2)
+        box_center = (xmin + xmax) // 2
+        text_x = max(0, min(box_center - text_w // 2, image_width - text_w))
+        text_y = ymin - 10
+        if text_y - text_h < 0:
+            text_y = ymax + text_h + 10
+            if text_y + baseline > image_height:
+                text_y = ymin + (ymax - ymin) // 2
+
+        cv2.rectangle(full_image, (xmin, ymin), (xmax, ymax), color_tbm, 2)
+        bg_top_left = (max(0, text_x - 5), max(0, text_y - text_h - 5))
+        bg_bottom_right = (min(image_width, text_x + text_w + 5), min(image_height, text_y + 5))
+        draw_rounded_rectangle_reference(full_image, bg_top_left, bg_bottom_right, color_tbm, 8, alpha=0.6)
+        cv2.putText(full_image, label_text, (text_x, text_y), font, 1.6, (255, 255, 255), 2)
+        full_image = np.where(mask[..., None], cv2.addWeighted(full_image, 1, colored_mask, 0.3, 0), full_image)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cv2.drawContours(full_image, contours, -1, color_c, 2)
+
+        single_pred = image_np.copy()
+        cv2.rectangle(single_pred, (xmin, ymin), (xmax, ymax), color_tbm, 2)
+        draw_rounded_rectangle_reference(single_pred, bg_top_left, bg_bottom_right, color_tbm, 8, alpha=0.6)
+        cv2.putText(single_pred, label_text, (text_x, text_y), font, 1.6, (255, 255, 255), 2)
+        single_pred = np.where(mask[..., None], cv2.addWeighted(single_pred, 1, colored_mask, 0.3, 0), single_pred)
+        cv2.drawContours(single_pred, contours, -1, color_c, 2)
+        _, buffer = cv2.imencode('.jpg', cv2.cvtColor(single_pred, cv2.COLOR_RGB2BGR))
+
+        x1, y1 = max(0, xmin - 100), max(0, ymin - 100)
+        x2, y2 = min(image_width, xmax + 100), min(image_height, ymax + 100)
+        _, buf = cv2.imencode('.jpg', cv2.cvtColor(image_np[y1:y2, x1:x2], cv2.COLOR_RGB2BGR))
+        output.append({'image': buffer.tobytes(), 'label': CUSTOM_CLASSES[label - 1], 'classification': cls_result,
+                       'score': float(scores[i]), 'features': None, 'crop': buf.tobytes()})
+
+    _, buffer = cv2.imencode('.jpg', cv2.cvtColor(full_image, cv2.COLOR_RGB2BGR))
+    return {"full_image": buffer.tobytes(), "detections": True, "full_Normal_image": normal.tobytes(),
+            "individual_predictions": output}
+
+
+def synthetic_case(n, height, width, seed):
+    rng = np.random.default_rng(seed)
+    image = cv2.GaussianBlur((rng.random((height, width)) * 255).astype(np.uint8), (0, 0), 3)
+    image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    masks, labels, scores = synthetic_detections(n, height, width, seed=seed)
+    merged = merge_overlapping_masks(masks, labels, scores)
+    detections = Detections.from_full_masks(*merged)
+    detections.classification = [{"label": "benign"}] * len(detections)
+    return image, detections
+
+
+def payload_size(result):
+    return len(result["full_image"]) + len(result["full_Normal_image"]) + sum(
+        len(p["image"]) + len(p["crop"]) for p in result["individual_predictions"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--detections", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--height", type=int, default=3328)
+    parser.add_argument("--width", type=int, default=2560)
+    parser.add_argument("--quality", type=int, default=80, help="JPEG quality of the lighter configuration")
+    parser.add_argument("--max-side", type=int, default=1600, help="Longest side of the lighter configuration")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'n':>4} {'reference ms':>13} {'roi ms':>8} {'crop ms':>8} {'light ms':>9} "
+          f"{'reference KB':>13} {'crop KB':>8} {'light KB':>9}")
+    for n in args.detections:
+        image, detections = synthetic_case(n, args.height, args.width, seed=n)
+        ref_time, ref = time_call(render_predictions_reference, image, detections, repeat=args.repeat)
+
+        set_render_options("full")
+        roi_time, roi = time_call(render_predictions, image, detections, repeat=args.repeat)
+
+        set_render_options("crop")
+        crop_time, crop = time_call(render_predictions, image, detections, repeat=args.repeat)
+        set_render_options("crop", jpeg_quality=args.quality, max_side=args.max_side)
+        light_time, light = time_call(render_predictions, image, detections, repeat=args.repeat)
+        set_render_options()
+
+        print(f"{len(detections):>4} {ref_time * 1000:>13.1f} {roi_time * 1000:>8.1f} {crop_time * 1000:>8.1f} "
+              f"{light_time * 1000:>9.1f} {payload_size(ref) / 1024:>13.0f} {payload_size(crop) / 1024:>8.0f} "
+              f"{payload_size(light) / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
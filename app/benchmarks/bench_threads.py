@@ -0,0 +1,138 @@
+"""
+Throughput of the full prediction pipeline for different splits of the cores
+between concurrent inference workers and library threads (runtime.py).
+
+Each split runs in its own process, since TensorFlow and torch inter-op
+pools cannot be resized once used: WORKERSxTHREADS gives every worker
+THREADS threads in torch, TensorFlow and OpenCV, WORKERSxdefault keeps the
+library defaults (every library sized to all the cores). Models have random
+weights and report planted lesions, as in bench_pipeline.py.
+
+Run from the app directory:
+    python benchmarks/bench_threads.py --splits 1x8 2x4 4x2 4xdefault --output threads.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from runtime import available_cpus
+
+
+def default_splits(cpus):
+    """Every power-of-two worker count up to `cpus`, with its even share and with the library defaults."""
+    splits = []
+    workers = 1
+    while workers <= cpus:
+        splits += [f"{workers}x{cpus // workers}", f"{workers}xdefault"]
+        workers *= 2
+    return splits
+
+
+def run_split(split, size, lesions, pixel_spacing, images_per_worker, seed):
+    """Run in the child process: apply the split, then time `workers` threads calling run_prediction."""
+    workers, threads = split.split("x")
+    workers = int(workers)
+    auto = threads != "default"
+    budget_threads = int(threads) if auto else 0
+
+    from bench_pipeline import install_random_models, planted_lesions, synthetic_inputs
+    import pipeline
+    from runtime import apply_thread_budget, plan_thread_budget, thread_allocation
+
+    apply_thread_budget(plan_thread_budget(
+        workers, auto=auto, torch_threads=budget_threads, tf_intra_op_threads=budget_threads,
+        cv2_threads=budget_threads
+    ))
+    planted = planted_lesions(lesions, seed)
+    inputs, _ = synthetic_inputs(*size, planted, pixel_spacing, seed)
+    install_random_models(planted, seed)
+    content = inputs[".png"]
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(images_per_worker):
+            start = time.perf_counter()
+            payload, _, _ = pipeline.run_prediction(content, ".png", pixel_spacing)
+            assert isinstance(payload, dict), payload
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    # One untimed run per worker initializes the graphs and thread pools
+    with contextlib.redirect_stdout(io.StringIO()):
+        pipeline.run_prediction(content, ".png", pixel_spacing)
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "split": split,
+        "workers": workers,
+        "allocation": thread_allocation()["threads"],
+        "images": len(latencies),
+        "throughput_per_s": round(len(latencies) / elapsed, 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p90_ms": round(float(np.percentile(latencies, 90)), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--splits", nargs="+", help="WORKERSxTHREADS or WORKERSxdefault (default: powers of two)")
+    parser.add_argument("--size", type=int, nargs=2, default=[2294, 1914], metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--lesions", type=int, default=4)
+    parser.add_argument("--pixel-spacing", type=float, default=0.1)
+    parser.add_argument("--images-per-worker", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_split(args.child, args.size, args.lesions, args.pixel_spacing,
+                               args.images_per_worker, args.seed)
+        print(json.dumps(result))
+        return
+
+    cpus = available_cpus()
+    results = []
+    print(f"{'split':>12} {'torch':>6} {'tf':>4} {'cv2':>4} {'img/s':>7} {'p50 ms':>8} {'p90 ms':>8}", file=sys.stderr)
+    for split in args.splits or default_splits(cpus):
+        command = [
+            sys.executable, os.path.abspath(__file__), "--child", split,
+            "--size", *map(str, args.size), "--lesions", str(args.lesions),
+            "--pixel-spacing", str(args.pixel_spacing), "--images-per-worker", str(args.images_per_worker),
+            "--seed", str(args.seed)
+        ]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        threads = result["allocation"]
+        print(f"{split:>12} {threads['torch']:>6} {threads['tf_intra_op']:>4} {threads['cv2']:>4} "
+              f"{result['throughput_per_s']:>7.2f} {result['p50_ms']:>8.0f} {result['p90_ms']:>8.0f}", file=sys.stderr)
+        results.append(result)
+
+    text = json.dumps({"cpus": cpus, "size": args.size, "lesions": args.lesions, "splits": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,25 +6,80 @@ from sklearn.preprocessing import StandardScaler
 from keras.applications.densenet import DenseNet121, preprocess_input as dpi
 from keras.applications.convnext import ConvNeXtTiny, preprocess_input as cpi
 import matplotlib.pyplot as plt
+import keras
+import tensorflow as tf
 import torch
+from feature_cache import crop_key
+from image_processing import load_rgb_image
+from metrics import CLASSIFIER_BATCH_SIZE, FEATURE_CACHE_LOOKUPS, timed
+from reduced_classifier import ReducedClassifier
 
 # Force CPU if no CUDA available
 if not torch.cuda.is_available():
     os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 
-# Load models and scaler at startup
-print("Loading models and scaler...")
-model_densenet = DenseNet121(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
-model_convnext = ConvNeXtTiny(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
-scaler = joblib.load(os.path.join("models", "scaler.joblib"))
+# Feature extractors and scaler, loaded by load_feature_extractors() / load_scaler() at startup
+model_densenet = None
+model_convnext = None
+scaler = None
 
-# Predefined crop sizes for dynamic ROI cropping
+# Local copies of the ImageNet backbone weights (see export_models.py keras-weights)
+DENSENET_WEIGHTS = os.path.join("models", "densenet121_notop.weights.h5")
+CONVNEXT_WEIGHTS = os.path.join("models", "convnext_tiny_notop.weights.h5")
+
+# Classifier on the deep features: "svm" (scaler + SVM of the training notebook) or
+# "reduced" (projection fused with the scaler + light classifier, train_reduced_classifier.py)
+CLASSIFIER_RUNTIMES = ("svm", "reduced")
+REDUCED_CLASSIFIER_PATH = os.path.join("models", "reduced_classifier.joblib")
+SVM_PATH = os.path.join("models", "svm+lgbmdensenet+convnexttiny+9720+c=6+k=sigmoid+augmentation.pkl")
+SCALER_PATH = os.path.join("models", "scaler.joblib")
+
+# Predefined crop sizes for dynamic ROI cropping, in pixels of the classifier frame
 CROP_SIZES = [112, 224, 512, 750, 1024, 1500]
+# (width, height) the training images were resized to before cropping
+CLASSIFIER_FRAME = (957, 1147)
+CROP_TARGET_SIZE = 224
+
+# How classifier_crops cuts the ROIs: "direct" resizes windows of the decoded
+# image straight to the patches, "legacy" resizes the whole image to the
+# classifier frame first and crops box by box (same windows, slower)
+CROP_MODES = ("direct", "legacy")
+crop_mode = "direct"
+
+def load_feature_extractors(densenet_weights=DENSENET_WEIGHTS, convnext_weights=CONVNEXT_WEIGHTS):
+    """Build DenseNet121 and ConvNeXtTiny from local weight files (no network fetch)."""
+    global model_densenet, model_convnext, _fused_model
+    print("Loading feature extractors...")
+    for path in (densenet_weights, convnext_weights):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing backbone weights {path}, run 'python export_models.py keras-weights'")
+    model_densenet = DenseNet121(weights=densenet_weights, include_top=False, input_shape=(224, 224, 3))
+    model_convnext = ConvNeXtTiny(weights=convnext_weights, include_top=False, input_shape=(224, 224, 3))
+    _fused_model = None
 
-def load_classifier():
-    """Load the trained classification model."""
+def load_scaler():
+    """Load the StandardScaler fitted on the training features."""
+    global scaler
+    scaler = joblib.load(SCALER_PATH)
+
+def load_classifier(runtime="svm", reduced_path=REDUCED_CLASSIFIER_PATH):
+    """
+    Load the trained classification model: the SVM of the training notebook
+    ("svm", used with the scaler) or a ReducedClassifier ("reduced").
+    """
+    if runtime == "reduced":
+        print('Loading reduced classifier...')
+        return joblib.load(reduced_path)
+    if runtime != "svm":
+        raise ValueError(f"Unknown classifier runtime: {runtime} (expected one of {CLASSIFIER_RUNTIMES})")
     print('Loading classifier model...')
-    return joblib.load(os.path.join("models", "svm+lgbmdensenet+convnexttiny+9720+c=6+k=sigmoid+augmentation.pkl"))
+    return joblib.load(SVM_PATH)
+
+def predict_labels(classifier, features):
+    """Class ids (0 benign, 1 malignant) of raw deep features, for either classifier runtime."""
+    if isinstance(classifier, ReducedClassifier):
+        return classifier.predict(features)  # The scaler is fused into its projection
+    return classifier.predict(scaler.transform(features))
 
 def smart_crop_from_box(orig_cv, box, target_size=224):
     """
@@ -62,11 +117,8 @@ def smart_crop_from_box(orig_cv, box, target_size=224):
     # If all else fails, resize full image
     return cv2.resize(orig_cv, (target_size, target_size), interpolation=cv2.INTER_LINEAR)
 
-def extract_deep_features(image_batch):
-    """
-    Extract features using DenseNet121 and ConvNeXtTiny,
-    then concatenate their flattened outputs.
-    """
+def _keras_features(image_batch):
+    """Reference path: one Keras predict() call per backbone."""
     features_dense = model_densenet.predict(dpi(image_batch.copy()), verbose=0)
     features_conv = model_convnext.predict(cpi(image_batch.copy()), verbose=0)
 
@@ -75,45 +127,228 @@ def extract_deep_features(image_batch):
         features_conv.reshape(features_conv.shape[0], -1)
     ])
 
-def classify(image_path, results, classifier):
+def build_fused_model():
+    """Single Keras graph: shared input, both preprocessings and backbones, concatenated flat features."""
+    inputs = keras.Input((224, 224, 3), name="images")
+    features_dense = keras.layers.Flatten()(model_densenet(dpi(inputs)))
+    features_conv = keras.layers.Flatten()(model_convnext(cpi(inputs)))
+    return keras.Model(inputs, keras.layers.Concatenate(axis=1)([features_dense, features_conv]))
+
+_fused_model = None
+
+@tf.function(input_signature=[tf.TensorSpec((None, 224, 224, 3), tf.float32)])
+def _fused_graph(image_batch):
+    return _fused_model(image_batch, training=False)
+
+def _fused_features(image_batch):
+    global _fused_model
+    if _fused_model is None:
+        _fused_model = build_fused_model()
+    return _fused_graph(tf.convert_to_tensor(image_batch, dtype=tf.float32)).numpy()
+
+def _onnx_features_runner(onnx_path):
+    """Build a feature function running the exported fused graph with ONNX Runtime on CPU."""
+    import onnxruntime as ort  # Optional dependency, only needed for this backend
+
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    def _onnx_features(image_batch):
+        return session.run(None, {input_name: np.asarray(image_batch, dtype=np.float32)})[0]
+    return _onnx_features
+
+def export_feature_extractor_onnx(output_path):
+    """Export the fused DenseNet121 + ConvNeXtTiny graph to ONNX (requires tf2onnx)."""
+    fused_model = build_fused_model()
+    fused_model(np.zeros((1, 224, 224, 3), dtype=np.float32))  # Build the graph before export
+    fused_model.export(output_path, format="onnx")
+    print(f"Feature extractor exported to {output_path}")
+
+FEATURE_BACKENDS = ("keras", "fused", "onnx")
+_feature_extractor = _keras_features
+
+def set_feature_backend(backend="fused", onnx_path=os.path.join("models", "feature_extractor.onnx")):
+    """Select how extract_deep_features runs: 'keras', 'fused' (tf.function) or 'onnx'."""
+    global _feature_extractor
+    if backend == "keras":
+        _feature_extractor = _keras_features
+    elif backend == "fused":
+        _feature_extractor = _fused_features
+    elif backend == "onnx":
+        _feature_extractor = _onnx_features_runner(onnx_path)
+    else:
+        raise ValueError(f"Unknown feature backend: {backend} (expected one of {FEATURE_BACKENDS})")
+    print(f"Feature extraction backend: {backend}")
+
+def extract_deep_features(image_batch):
+    """
+    Extract features using DenseNet121 and ConvNeXtTiny,
+    then concatenate their flattened outputs.
+    """
+    return _feature_extractor(image_batch)
+
+# Optional feature_cache.FeatureCache of the deep features of each crop (set_feature_cache)
+feature_cache = None
+
+def set_feature_cache(cache=None):
+    """Reuse the deep features of crops already seen (None disables the cache)."""
+    global feature_cache
+    feature_cache = cache
+
+def cached_deep_features(image_batch):
+    """
+    extract_deep_features, with the vectors of crops already in feature_cache
+    taken from it: only the new crops go through the backbones.
+    """
+    if feature_cache is None:
+        return extract_deep_features(image_batch)
+    keys = [crop_key(crop) for crop in image_batch]
+    vectors = [feature_cache.get(key) for key in keys]
+    missing = {}  # key -> index of its first crop (a crop can appear twice in a batch)
+    for index, (key, vector) in enumerate(zip(keys, vectors)):
+        if vector is None:
+            missing.setdefault(key, index)
+    misses = sum(vector is None for vector in vectors)
+    FEATURE_CACHE_LOOKUPS.labels("hit").inc(len(keys) - misses)
+    FEATURE_CACHE_LOOKUPS.labels("miss").inc(misses)
+    if missing:
+        computed = extract_deep_features(image_batch[list(missing.values())])
+        feature_cache.put_many(list(missing), computed)
+        computed = dict(zip(missing, computed))
+        vectors = [computed[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+    return np.stack(vectors)
+
+def classify(image, results, classifier):
     """
     Classify lesions (Benign/Malignant) based on cropped regions from detection boxes.
+    `image` is a path or a decoded RGB array, `results` is the Detections object
+    returned by model_utils.predict.
     """
-    try:
-        orig_cv = cv2.imread(image_path)
-        if orig_cv is None:
-            raise ValueError(f"Could not read image at {image_path}")
+    return classify_batch([image], [results], classifier)[0]
+
+
+def set_crop_mode(mode="direct"):
+    """Select how classifier_crops cuts the ROIs: 'direct' or 'legacy'."""
+    global crop_mode
+    if mode not in CROP_MODES:
+        raise ValueError(f"Unknown crop mode: {mode} (expected one of {CROP_MODES})")
+    crop_mode = mode
+
+
+def frame_crop_windows(boxes, image_size):
+    """
+    The windows smart_crop_from_box picks for `boxes` (N, 4) of an image of
+    `image_size` (height, width), computed for every box and crop size at once.
+    Returns (N, 4) windows x1, y1, x2, y2 in pixels of the classifier frame.
+    """
+    frame_width, frame_height = CLASSIFIER_FRAME
+    scale = np.array([frame_width / image_size[1], frame_height / image_size[0]] * 2)
+    x1, y1, x2, y2 = (np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * scale).astype(int).T[:, :, None]
+    sizes = np.array(CROP_SIZES)[None, :]
+
+    # One candidate window per box (rows) and crop size (columns), shifted inside the frame
+    center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+    crop_x1 = np.maximum(0, center_x - sizes // 2)
+    crop_y1 = np.maximum(0, center_y - sizes // 2)
+    crop_x2 = np.minimum(frame_width, crop_x1 + sizes)
+    crop_y2 = np.minimum(frame_height, crop_y1 + sizes)
+    crop_x1 = np.where(crop_x2 - crop_x1 < sizes, np.maximum(0, crop_x2 - sizes), crop_x1)
+    crop_y1 = np.where(crop_y2 - crop_y1 < sizes, np.maximum(0, crop_y2 - sizes), crop_y1)
 
-        # Resize input image to expected dimension
-        resized_cv = cv2.resize(orig_cv, (957, 1147))
-        scale_x = 957 / orig_cv.shape[1]
-        scale_y = 1147 / orig_cv.shape[0]
-        resized_rgb = cv2.cvtColor(resized_cv, cv2.COLOR_BGR2RGB)
+    # The smallest size at least as large as the box whose window contains it
+    fits = ((sizes >= np.maximum(x2 - x1, y2 - y1)) & (x1 >= crop_x1) & (y1 >= crop_y1)
+            & (x2 <= crop_x2) & (y2 <= crop_y2))
+    rows, first = np.arange(len(fits)), fits.argmax(axis=1)
+    windows = np.stack([crop_x1[rows, first], crop_y1[rows, first], crop_x2[rows, first], crop_y2[rows, first]], axis=1)
+    windows[~fits.any(axis=1)] = [0, 0, frame_width, frame_height]  # Whole image, as smart_crop_from_box
+    return windows
 
-        cropped_images = []
-        for box, score in zip(results['boxes'], results['scores']):
-            if score < 0.5:
-                continue  # Ignore low-confidence detections
 
-            # Scale box to resized image
-            scaled_box = (np.array(box) * [scale_x, scale_y, scale_x, scale_y]).astype(int)
+def crop_windows(boxes, image_size):
+    """frame_crop_windows mapped back to (N, 4) pixel windows of the original image."""
+    height, width = image_size
+    scale = np.array([width / CLASSIFIER_FRAME[0], height / CLASSIFIER_FRAME[1]] * 2)
+    windows = np.rint(frame_crop_windows(boxes, image_size) * scale).astype(np.int64)
+    # At least one pixel, for boxes on a frame smaller than the image
+    windows[:, 2:] = np.maximum(windows[:, 2:], windows[:, :2] + 1)
+    return windows
 
-            # Crop region and resize
-            cropped_img = smart_crop_from_box(resized_rgb, scaled_box)
-            cropped_images.append(cropped_img)
+
+def classifier_crops(image, results):
+    """224x224 crops of the detections of one image, in the classifier's input layout."""
+    if crop_mode == "legacy":
+        return legacy_classifier_crops(image, results)
+    if not isinstance(image, np.ndarray):
+        image = load_rgb_image(image)
+    keep = np.asarray(results.scores) >= 0.5  # Ignore low-confidence detections
+    # Windows are views of the decoded image: only the patches are resized
+    size = (CROP_TARGET_SIZE, CROP_TARGET_SIZE)
+    crops = [
+        cv2.resize(image[y1:y2, x1:x2], size, interpolation=cv2.INTER_LINEAR)
+        for x1, y1, x2, y2 in crop_windows(np.asarray(results.boxes)[keep], image.shape[:2])
+    ]
+    if image.ndim == 2:
+        # Grayscale upload: expand the patches rather than the whole image
+        crops = [cv2.cvtColor(crop, cv2.COLOR_GRAY2RGB) for crop in crops]
+    return crops
+
+
+def legacy_classifier_crops(image, results):
+    """classifier_crops as first implemented: resize the whole image, then smart_crop_from_box per box."""
+    orig_rgb = load_rgb_image(image)
+
+    # Resize input image to expected dimension
+    resized_rgb = cv2.resize(orig_rgb, CLASSIFIER_FRAME)
+    scale_x = CLASSIFIER_FRAME[0] / orig_rgb.shape[1]
+    scale_y = CLASSIFIER_FRAME[1] / orig_rgb.shape[0]
+
+    cropped_images = []
+    for box, score in zip(results.boxes, results.scores):
+        if score < 0.5:
+            continue  # Ignore low-confidence detections
+
+        # Scale box to resized image
+        scaled_box = (np.array(box) * [scale_x, scale_y, scale_x, scale_y]).astype(int)
+
+        # Crop region and resize
+        cropped_img = smart_crop_from_box(resized_rgb, scaled_box)
+        cropped_images.append(cropped_img)
+    return cropped_images
+
+
+def classify_batch(images, results_list, classifier, timings: dict = None):
+    """
+    classify() for several images at once: the crops of every image go through
+    the feature extractors and the classifier as a single batch.
+    Stage times (ms) are added to `timings` if given.
+    """
+    try:
+        with timed(timings, "roi_crop"):
+            crops_per_image = [classifier_crops(image, results) for image, results in zip(images, results_list)]
+            cropped_images = [crop for crops in crops_per_image for crop in crops]
 
         if cropped_images:
             # Create batch of cropped inputs
             batch_images = np.array(cropped_images)
+            CLASSIFIER_BATCH_SIZE.observe(len(batch_images))
 
             # Extract features and classify
-            features = extract_deep_features(batch_images)
-            predictions = classifier.predict(scaler.transform(features))
-            results['classification'] = ['Benign' if p == 0 else 'Malignant' for p in predictions]
+            with timed(timings, "deep_features"):
+                features = cached_deep_features(batch_images)
+            with timed(timings, "svm_predict"):
+                predictions = predict_labels(classifier, features)
+            labels = ['Benign' if p == 0 else 'Malignant' for p in predictions]
+
+            start = 0
+            for results, crops in zip(results_list, crops_per_image):
+                if crops:
+                    results.classification = labels[start:start + len(crops)]
+                start += len(crops)
 
-        return results
+        return results_list
 
     except Exception as e:
         print(f"Error in classification: {str(e)}")
-        results['classification'] = []
-        return results
+        for results in results_list:
+            results.classification = []
+        return results_list
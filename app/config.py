@@ -1,8 +1,116 @@
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
-    email: str  #Don't forget to add ur email and password to a .env file
-    password: str  
+    # SMTP account of /send-email: don't forget to add ur email and password to a .env file.
+    # Inference runs without them, /send-email answers 503 until they are set
+    email: str = ""
+    password: str = ""
+
+    # Inference worker pool: "thread", "process", or "remote" (the inference_server.py
+    # process shared by several HTTP workers, see serve.py)
+    inference_executor: str = "thread"
+    inference_workers: int = 1  # Number of concurrent inference jobs
+    inference_queue_size: int = 4  # Jobs allowed to wait for a free worker
+    inference_retry_after: int = 5  # Seconds advertised in Retry-After when the queue is full
+    inference_address: str = "inference.sock"  # Unix socket path, or host:port, of the inference server
+    # The inference server runs the pickled calls it receives: host:port addresses must be
+    # loopback ones unless this is set, and it must never be reachable from an untrusted network
+    inference_allow_remote: bool = False
+    inference_authkey: str = ""  # Shared secret of the inference server connections (set by serve.py)
+    http_workers: int = 1  # uvicorn workers started by serve.py
+
+    # CPU threads of the inference workers: with thread_budget, torch, TensorFlow and
+    # OpenCV each get cores // inference_workers threads per worker (see runtime.py).
+    # A value set below overrides its share; without thread_budget, 0 keeps the library default
+    thread_budget: bool = True
+    torch_threads: int = 0
+    torch_interop_threads: int = 0
+    tf_intra_op_threads: int = 0
+    tf_inter_op_threads: int = 0
+    cv2_threads: int = 0
+
+    # Detector runtime: "eager", "torchscript" or "onnx" (exported with export_models.py detector)
+    detector_backend: str = "eager"
+    detector_quantize: bool = False  # int8 dynamic quantization of the ConvNeXt backbone (CPU)
+    detector_path: str = ""  # Exported artifact, defaults to models/MaskRcnn[.int8].<format>
+
+    # Working resolution: uploads are resized once so their longest side is at most
+    # this, and detection, rendering and lesion features all run on that image (0 keeps full resolution)
+    working_max_side: int = 0
+    # Optional high-resolution pass for calcifications on tiles of the full image (0 disables it)
+    detector_tile_size: int = 0
+    detector_tile_overlap: int = 128
+
+    # Detector micro-batching (only useful with several thread workers)
+    detector_max_batch_size: int = 1  # 1 disables batching
+    detector_max_wait_ms: float = 10  # How long to wait for more requests to fill a batch
+
+    # Classifier feature extraction: "keras", "fused" (single tf.function) or "onnx"
+    feature_backend: str = "fused"
+    feature_onnx_path: str = "models/feature_extractor.onnx"  # Created with export_models.py features
+    # Classifier on the deep features: "svm" (scaler + SVM) or "reduced" (PCA fused with the
+    # scaler + light classifier, trained with train_reduced_classifier.py)
+    classifier_runtime: str = "svm"
+    reduced_classifier_path: str = "models/reduced_classifier.joblib"
+    # Deep features of each classifier crop, reused when the same crop comes back
+    feature_cache_max_mb: int = 256  # In-memory bound, 0 disables the memory tier
+    feature_cache_path: str = ""  # Optional persistent store (e.g. "cache/features.npy"), memory-mapped
+    feature_cache_disk_mb: int = 2048  # Size of the persistent store
+    # ROI crops of the classifier: "direct" (patches sampled from the decoded image) or
+    # "legacy" (whole image resized to 957x1147 first, then cropped box by box)
+    classifier_crop_mode: str = "direct"
+
+    # Local ImageNet backbone weights (created with export_models.py keras-weights)
+    densenet_weights: str = "models/densenet121_notop.weights.h5"
+    convnext_weights: str = "models/convnext_tiny_notop.weights.h5"
+
+    # /predict result cache, keyed by a hash of the uploaded bytes, their extension
+    # and the models / options in use (pipeline.result_cache_namespace)
+    result_cache_max_mb: int = 512  # In-memory bound, 0 disables the cache
+    result_cache_ttl: int = 3600  # Seconds before an entry expires
+    result_cache_dir: str = ""  # Optional on-disk tier (e.g. "cache/results")
+    result_cache_disk_mb: int = 2048  # Bound of the on-disk tier, oldest files removed first
+
+    # DICOM uploads: "max" scales by the image maximum (the scaling the models were
+    # served with), "voi" applies the header's rescale, window / VOI LUT and MONOCHROME1 inversion
+    dicom_windowing: str = "max"
+
+    # Rendering of the /predict images
+    render_detection_view: str = "full"  # "full" image or padded "crop" per detection
+    render_jpeg_quality: int = 95
+    render_max_side: int = 0  # Downscale encoded images to this longest side, 0 keeps full resolution
+
+    lesion_feature_workers: int = 1  # Threads computing lesion features, 1 computes them inline
+
+    # Images of /predict?format=refs responses, fetched from /artifacts/{id}
+    artifact_ttl: int = 300  # Seconds an image stays available
+    artifact_store_max_mb: int = 256  # Oldest images are dropped beyond this
+    artifact_store_dir: str = ""  # Shared by every HTTP worker (e.g. "cache/artifacts"), in memory if empty
+
+    # Outgoing email (/send-email), sent in the background from a persisted outbox
+    smtp_host: str = "smtp.gmail.com"
+    smtp_port: int = 465
+    smtp_ssl: bool = True  # Implicit TLS (SMTP_SSL); set false for STARTTLS or a local test server
+    smtp_starttls: bool = False
+    smtp_timeout: float = 30
+    # Pending messages (recipient addresses and bodies) survive restarts in this file,
+    # e.g. "data/outbox.json" in a directory only the server can read; empty keeps them in memory
+    outbox_path: str = ""
+    outbox_max_attempts: int = 5
+    outbox_backoff: float = 2  # Seconds before the first retry, doubled on each failure
+
+    # Asynchronous /jobs predictions
+    job_workers: int = 1  # Jobs processed concurrently (they still share the inference pool)
+    job_queue_size: int = 32  # Queued jobs before POST /jobs answers 503
+    job_ttl: int = 3600  # Seconds a job and its result are kept
+    job_store_dir: str = ""  # File-backed store (e.g. "cache/jobs"), in memory if empty
+    # Comma-separated hosts callback_url may use; when empty any host resolving only to
+    # public addresses is accepted (never loopback, private or link-local ones)
+    job_callback_hosts: str = ""
+
+    # Add an X-Trace header (trace ID and stage timings) to every prediction response,
+    # not only to requests sent with "X-Trace: 1"
+    trace_requests: bool = False
 
     class Config:
         env_file = ".env"  # Name of the environment file to load
@@ -1,20 +1,141 @@
+import io
 from pydicom import dcmread
+from pydicom.pixels import apply_voi_lut
 from PIL import Image
 import numpy as np
 
+# Tags needed to decode the pixels, window them and read the pixel spacing;
+# everything else in the header is skipped
+DICOM_TAGS = [
+    "SamplesPerPixel", "PhotometricInterpretation", "PlanarConfiguration", "NumberOfFrames",
+    "Rows", "Columns", "BitsAllocated", "BitsStored", "HighBit", "PixelRepresentation",
+    "RescaleSlope", "RescaleIntercept", "WindowCenter", "WindowWidth", "VOILUTFunction", "VOILUTSequence",
+    "PixelSpacing", "ImagerPixelSpacing", "EstimatedRadiographicMagnificationFactor",
+    "PixelData",
+]
+DICOM_WINDOWING = ("max", "voi")
+
+
+def _first(value):
+    """First value of a possibly multi-valued element."""
+    try:
+        return float(value[0])
+    except TypeError:
+        return float(value)
+
+
+def _voi_lut(ds, values: np.ndarray, max_value: float) -> np.ndarray:
+    """
+    Map stored pixel values to 0-255 floats: modality rescale, then the VOI LUT
+    or window of the dataset. Without either, values are scaled by the image
+    maximum (the previous conversion).
+    """
+    x = values * float(ds.get("RescaleSlope", 1)) + float(ds.get("RescaleIntercept", 0))
+    if "VOILUTSequence" in ds:
+        lut = apply_voi_lut(np.round(x).astype(np.int64), ds, prefer_lut=True)
+        bits = int(ds.VOILUTSequence[0].LUTDescriptor[2])
+        return lut * (255.0 / (2 ** bits - 1))
+
+    if "WindowCenter" in ds and "WindowWidth" in ds:
+        center, width = _first(ds.WindowCenter), max(_first(ds.WindowWidth), 1.0)
+        function = str(ds.get("VOILUTFunction", "LINEAR")).upper()
+        if function == "SIGMOID":
+            y = 1.0 / (1.0 + np.exp(-4.0 * (x - center) / width))
+        elif function == "LINEAR_EXACT":
+            y = (x - center) / width + 0.5
+        else:
+            # DICOM PS3.3 C.11.2.1.2.1
+            y = (x - (center - 0.5)) / max(width - 1.0, 1.0) + 0.5
+        return np.clip(y, 0.0, 1.0) * 255.0
+
+    return np.maximum(values, 0) / max(max_value, 1) * 255.0
+
+
+def _to_uint8(ds, pixels: np.ndarray, windowing: str) -> np.ndarray:
+    """Window an integer pixel array to uint8 through a lookup table over its value range."""
+    if windowing == "max" or ds.get("SamplesPerPixel", 1) != 1:
+        # Default conversion: scale by the image maximum, no window, no inversion
+        lut_fn = lambda values: np.maximum(values, 0) / max(float(pixels.max()), 1) * 255.0
+    else:
+        lut_fn = lambda values: _voi_lut(ds, values, float(pixels.max()))
+
+    if pixels.dtype.itemsize > 2:
+        # 32-bit data: no table over the value range, compute directly
+        out = lut_fn(pixels.astype(np.float32))
+    else:
+        # One entry per possible stored value; signed data is indexed through its
+        # unsigned view so the lookup never allocates more than the output
+        unsigned = pixels.view(np.uint8 if pixels.itemsize == 1 else np.uint16)
+        domain = np.arange(2 ** (8 * pixels.itemsize), dtype=np.int64)
+        if pixels.dtype.kind == "i":
+            domain = domain.astype(unsigned.dtype).view(pixels.dtype).astype(np.int64)
+        lut = lut_fn(domain.astype(np.float64))
+        if ds.get("PhotometricInterpretation") == "MONOCHROME1" and windowing != "max":
+            lut = 255.0 - lut
+        return lut.astype(np.uint8)[unsigned]
+
+    if ds.get("PhotometricInterpretation") == "MONOCHROME1" and windowing != "max":
+        out = 255.0 - out
+    return out.astype(np.uint8)
+
+
+def pixel_spacing_mm(ds):
+    """
+    Pixel spacing in mm from PixelSpacing, else ImagerPixelSpacing corrected for
+    the radiographic magnification; the mean of the row and column spacing.
+    None if the header has neither.
+    """
+    if "PixelSpacing" in ds:
+        spacing = ds.PixelSpacing
+        magnification = 1.0
+    elif "ImagerPixelSpacing" in ds:
+        spacing = ds.ImagerPixelSpacing
+        magnification = float(ds.get("EstimatedRadiographicMagnificationFactor", 1) or 1)
+    else:
+        return None
+    try:
+        values = [float(value) for value in spacing]
+    except (TypeError, ValueError):
+        return None
+    if not values or min(values) <= 0:
+        return None
+    return sum(values) / len(values) / magnification
+
+
+def read_dicom(dicom_source, windowing: str = "max"):
+    """
+    Read a DICOM (path or raw bytes of the upload) to an 8bit array and its
+    pixel spacing in mm (None if absent), without going through a file on disk.
+    windowing="max" scales by the image maximum only; "voi" applies the
+    rescale, VOI LUT or window and MONOCHROME1 inversion of the header.
+    """
+    if windowing not in DICOM_WINDOWING:
+        raise ValueError(f"Unknown DICOM windowing: {windowing} (expected one of {DICOM_WINDOWING})")
+    if isinstance(dicom_source, (bytes, bytearray, memoryview)):
+        dicom_source = io.BytesIO(dicom_source)
+    ds = dcmread(dicom_source, specific_tags=DICOM_TAGS)
+
+    pixels = ds.pixel_array
+    if int(ds.get("NumberOfFrames", 1) or 1) > 1:
+        pixels = pixels[0]  # First frame only
+    return _to_uint8(ds, pixels, windowing), pixel_spacing_mm(ds)
+
+
+def dicom_to_array(dicom_source, windowing: str = "max") -> np.ndarray:
+    """
+    Read a DICOM (path or raw bytes of the upload) and window it to an 8bit array,
+    without going through a file on disk.
+    """
+    return read_dicom(dicom_source, windowing)[0]
+
 def dicom_to_png(dicom_path: str, output_path: str) -> None:
     """Convert DICOM to PNG and normalization: convertion to 8bit images."""
-    print("dicom {dicom_path}")
-    ds = dcmread(dicom_path)
-    img_array = ds.pixel_array.astype(float)
-    
-    # Corrected normalization line
-    img_array = (np.maximum(img_array, 0) / img_array.max()) * 255.0  # Fixed
-    img_array = np.uint8(img_array)
-    
+    print(f"dicom {dicom_path}")
+    img_array = dicom_to_array(dicom_path)
+
     if len(img_array.shape) == 2:
         img = Image.fromarray(img_array, mode='L')
     else:
         img = Image.fromarray(img_array, mode='RGB')
     print(output_path)
-    img.save(output_path)
\ No newline at end of file
+    img.save(output_path)
@@ -0,0 +1,166 @@
+"""
+Offline export of the serving models.
+
+    python export_models.py keras-weights
+    python export_models.py features [--output models/feature_extractor.onnx]
+    python export_models.py detector --format torchscript|onnx [--quantize]
+    python export_models.py check-detector --images samples/ --backend torchscript [--quantize]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+
+def export_features(args):
+    from classifier_utils import export_feature_extractor_onnx, load_feature_extractors
+    load_feature_extractors()
+    export_feature_extractor_onnx(args.output)
+
+
+def export_keras_weights(args):
+    """Download the ImageNet backbones once and keep their weights next to the other models."""
+    from keras.applications.densenet import DenseNet121
+    from keras.applications.convnext import ConvNeXtTiny
+    from classifier_utils import CONVNEXT_WEIGHTS, DENSENET_WEIGHTS
+
+    os.makedirs("models", exist_ok=True)
+    for build, path in ((DenseNet121, DENSENET_WEIGHTS), (ConvNeXtTiny, CONVNEXT_WEIGHTS)):
+        build(weights='imagenet', include_top=False, input_shape=(224, 224, 3)).save_weights(path)
+        print(f"Saved {path}")
+
+
+def export_detector(args):
+    """Export the Mask R-CNN (custom anchors included) to TorchScript or ONNX, optionally int8."""
+    import torch
+    from model_utils import build_model, detector_export_path, quantize_backbone
+
+    model = build_model().cpu().eval()
+    if args.quantize:
+        if args.format == "onnx":
+            raise SystemExit("The quantized detector can only be exported to TorchScript")
+        model = quantize_backbone(model)
+
+    output = args.output or detector_export_path(args.format, args.quantize)
+    if args.format == "torchscript":
+        torch.jit.save(torch.jit.script(model), output)
+    else:
+        sample = torch.rand(3, 1147, 957)
+        torch.onnx.export(
+            model, ([sample],), output,
+            opset_version=args.opset,
+            input_names=["image"],
+            output_names=["boxes", "labels", "scores", "masks"],
+            dynamic_axes={
+                "image": {1: "height", 2: "width"},
+                "boxes": {0: "detections"},
+                "labels": {0: "detections"},
+                "scores": {0: "detections"},
+                "masks": {0: "detections"},
+            },
+            dynamo=False
+        )
+    print(f"Detector exported to {output}")
+
+
+def match_detections(reference, candidate, iou_threshold=0.5):
+    """Greedy same-label matching of candidate boxes to reference boxes. Returns (IoU, score diff) pairs."""
+    import torch
+    from torchvision.ops import box_iou
+
+    if len(reference) == 0 or len(candidate) == 0:
+        return []
+    iou = box_iou(torch.as_tensor(reference.boxes, dtype=torch.float32),
+                  torch.as_tensor(candidate.boxes, dtype=torch.float32)).numpy()
+    iou[reference.labels[:, None] != candidate.labels[None, :]] = 0
+
+    matches = []
+    for i in np.argsort(-reference.scores):
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= iou_threshold:
+            matches.append((iou[i, j], abs(float(reference.scores[i]) - float(candidate.scores[j]))))
+            iou[:, j] = 0
+    return matches
+
+
+def check_detector(args):
+    """Compare an optimized detector with the eager fp32 one on a folder of sample images."""
+    from dicom_utils import dicom_to_array
+    from image_processing import load_rgb_image
+    from model_utils import load_model, predict
+
+    paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if os.path.splitext(name)[1].lower() in {".dcm", ".dicom", ".png", ".jpg", ".jpeg"}
+    )
+    if not paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    reference_model = load_model("eager")
+    candidate_model = load_model(args.backend, args.quantize, args.path)
+
+    reference_count = candidate_count = 0
+    matches = []
+    reference_ms, candidate_ms = [], []
+    for path in paths:
+        if os.path.splitext(path)[1].lower() in {".dcm", ".dicom"}:
+            image = load_rgb_image(dicom_to_array(path))
+        else:
+            image = load_rgb_image(path)
+
+        start = time.perf_counter()
+        reference = predict(image, reference_model)
+        reference_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        candidate = predict(image, candidate_model)
+        candidate_ms.append((time.perf_counter() - start) * 1000)
+
+        reference_count += len(reference)
+        candidate_count += len(candidate)
+        matches += match_detections(reference, candidate)
+
+    name = f"{args.backend}{' int8' if args.quantize else ''}"
+    print(f"Images: {len(paths)}, detections eager: {reference_count}, {name}: {candidate_count}")
+    if reference_count and candidate_count:
+        print(f"Recall vs eager: {len(matches) / reference_count:.3f}, "
+              f"precision vs eager: {len(matches) / candidate_count:.3f}")
+    if matches:
+        print(f"Mean matched box IoU: {np.mean([m[0] for m in matches]):.3f}, "
+              f"mean |score diff|: {np.mean([m[1] for m in matches]):.4f}")
+    print(f"Latency eager: {np.mean(reference_ms):.0f} ms (p95 {np.percentile(reference_ms, 95):.0f}), "
+          f"{name}: {np.mean(candidate_ms):.0f} ms (p95 {np.percentile(candidate_ms, 95):.0f}), "
+          f"speedup {np.mean(reference_ms) / np.mean(candidate_ms):.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export SafeScan models for optimized inference.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    keras_weights = subparsers.add_parser("keras-weights", help="Save the ImageNet DenseNet121/ConvNeXtTiny weights to models/")
+    keras_weights.set_defaults(func=export_keras_weights)
+
+    features = subparsers.add_parser("features", help="Fused DenseNet121 + ConvNeXtTiny feature extractor to ONNX")
+    features.add_argument("--output", default=os.path.join("models", "feature_extractor.onnx"))
+    features.set_defaults(func=export_features)
+
+    detector = subparsers.add_parser("detector", help="Mask R-CNN to TorchScript or ONNX, optionally int8 quantized")
+    detector.add_argument("--format", choices=["torchscript", "onnx"], default="torchscript")
+    detector.add_argument("--quantize", action="store_true", help="Dynamic int8 quantization of the ConvNeXt backbone")
+    detector.add_argument("--output", default=None, help="Defaults to models/MaskRcnn[.int8].<format>")
+    detector.add_argument("--opset", type=int, default=17)
+    detector.set_defaults(func=export_detector)
+
+    check = subparsers.add_parser("check-detector", help="Accuracy and latency of an exported detector against eager fp32")
+    check.add_argument("--images", required=True, help="Folder of sample mammograms (DICOM, PNG, JPG)")
+    check.add_argument("--backend", choices=["eager", "torchscript", "onnx"], default="torchscript")
+    check.add_argument("--quantize", action="store_true")
+    check.add_argument("--path", default=None, help="Exported artifact, defaults to the export location")
+    check.set_defaults(func=check_detector)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from file_store import atomic_write, try_lock
+
+KEY_LENGTH = 32  # Hex digits
+
+
+def crop_key(crop: np.ndarray) -> str:
+    """Cache key of a classifier crop: BLAKE2b of its exact pixels and shape."""
+    digest = hashlib.blake2b(digest_size=KEY_LENGTH // 2)
+    digest.update(str(crop.shape).encode())
+    digest.update(np.ascontiguousarray(crop, dtype=np.uint8).data)
+    return digest.hexdigest()
+
+
+def weights_fingerprint(*paths) -> str:
+    """Identifies the feature extractor weights, so cached vectors of other weights are not reused."""
+    digest = hashlib.sha256()
+    for path in paths:
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+class FeatureStore:
+    """
+    Persistent ring of feature vectors in a memory-mapped .npy file (`path`)
+    with the key of each row in `<name>.keys.npy` and its layout in
+    `<name>.json`. A store written for other weights or another vector size
+    is started over. Only one process may write it: the others run without.
+    """
+
+    def __init__(self, path: str, dimension: int, max_bytes: int, namespace: str = ""):
+        self.path = path
+        root, _ = os.path.splitext(path)
+        self.keys_path = root + ".keys.npy"
+        self.meta_path = root + ".json"
+        self.capacity = max(1, max_bytes // (dimension * 4))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock_file = try_lock(path + ".lock")
+        if self._lock_file is None:
+            raise OSError(f"{path} is used by another process")
+
+        meta = {"namespace": namespace, "dimension": dimension, "capacity": self.capacity}
+        reuse = False
+        if os.path.exists(self.meta_path) and os.path.exists(path) and os.path.exists(self.keys_path):
+            try:
+                with open(self.meta_path, encoding="utf-8") as f:
+                    previous = json.load(f)
+                reuse = all(previous.get(name) == value for name, value in meta.items())
+                meta["next_row"] = previous.get("next_row", 0)
+            except (OSError, ValueError):
+                pass
+        mode = "r+" if reuse else "w+"
+        self.vectors = np.lib.format.open_memmap(path, mode=mode, dtype=np.float32, shape=(self.capacity, dimension))
+        self.keys = np.lib.format.open_memmap(self.keys_path, mode=mode, dtype=f"S{KEY_LENGTH}", shape=(self.capacity,))
+        self.meta = meta
+        self.next_row = meta.get("next_row", 0) if reuse else 0
+        self.rows = {key.decode(): row for row, key in enumerate(self.keys) if key}
+        self._save_meta()
+
+    def _save_meta(self):
+        self.meta["next_row"] = self.next_row
+        atomic_write(self.meta_path, self.meta, format="json")
+
+    def get(self, key: str):
+        row = self.rows.get(key)
+        return None if row is None else np.array(self.vectors[row])
+
+    def put(self, key: str, vector: np.ndarray):
+        """Write `vector` over the oldest row."""
+        if key in self.rows:
+            return
+        row = self.next_row
+        old_key = self.keys[row]
+        if old_key:
+            self.rows.pop(old_key.decode(), None)
+        self.vectors[row] = vector
+        self.keys[row] = key.encode()
+        self.rows[key] = row
+        self.next_row = (row + 1) % self.capacity
+
+    def flush(self):
+        self.vectors.flush()
+        self.keys.flush()
+        self._save_meta()
+
+    def close(self):
+        """Flush and release the lock, so the file can be opened again."""
+        self.flush()
+        self._lock_file.close()
+
+
+class FeatureCache:
+    """
+    LRU cache of deep feature vectors (of `dimension` values) keyed by
+    crop_key, bounded by their total size (`max_bytes`). With `path` set,
+    vectors also go to a FeatureStore of up to `disk_bytes` that survives
+    restarts. `namespace` is the weights_fingerprint of the feature extractors.
+    """
+
+    def __init__(self, dimension: int, max_bytes: int = 256 * 1024 * 1024, path: str = None,
+                 disk_bytes: int = 2 * 1024 ** 3, namespace: str = ""):
+        self.dimension = dimension
+        self.max_bytes = max_bytes
+        self.store = None
+        self._entries = OrderedDict()  # key -> float32 vector
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            try:
+                self.store = FeatureStore(path, dimension, disk_bytes, namespace)
+                print(f"Feature cache: {len(self.store.rows)} vectors in {path}")
+            except OSError as e:
+                print(f"Feature cache: {path} not used ({e})")
+
+    def _remember(self, key, vector):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = vector
+        self._bytes += vector.nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            _, dropped = self._entries.popitem(last=False)
+            self._bytes -= dropped.nbytes
+
+    def get(self, key: str):
+        """The cached vector of `key` (memory, then the store), or None."""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self.store is not None and (vector := self.store.get(key)) is not None:
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+            self.misses += 1
+            return None
+
+    def put_many(self, keys, vectors):
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                vector = np.array(vector, dtype=np.float32)  # Not a view of the whole batch
+                vector.setflags(write=False)
+                self._remember(key, vector)
+                if self.store is not None:
+                    self.store.put(key, vector)
+            if self.store is not None:
+                self.store.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self.store.rows) if self.store is not None else 0,
+            }
@@ -0,0 +1,87 @@
+"""
+File helpers shared by the stores that keep their entries on disk
+(result cache, artifacts, jobs, outbox and feature cache).
+"""
+import json
+import os
+import pickle
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks
+    fcntl = None
+
+
+def atomic_write(path: str, obj, format: str = "pickle"):
+    """
+    Write `obj` to `path` as "pickle", "json" or raw "bytes" through a
+    temporary file and a rename, so readers never see a partial file and a
+    crash never leaves a truncated one.
+    """
+    # Unique per process and thread, several writers may target the same path
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if format == "json":
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(obj, f)
+        else:
+            with open(tmp_path, "wb") as f:
+                if format == "bytes":
+                    f.write(obj)
+                else:
+                    pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def purge_dir(directory: str, ttl: float, max_bytes: float = float("inf"), now: float = None,
+              suffix: str = "") -> int:
+    """
+    Remove the files of `directory` (ending with `suffix`) older than `ttl`
+    seconds by mtime, then the oldest ones while they total more than
+    `max_bytes`. Returns the bytes left.
+    """
+    now = time.time() if now is None else now
+    files = []
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(suffix):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if now - mtime < ttl and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Already removed by another process
+        total -= size
+    return total
+
+
+def try_lock(path: str):
+    """
+    Open `path` and take an exclusive lock on it without waiting. Returns the
+    open file (keep it open to hold the lock), or None if another process
+    holds it. Without fcntl (Windows) the file is returned unlocked.
+    """
+    lock_file = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
@@ -1,27 +1,118 @@
-import base64
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from fastapi.responses import JSONResponse
 import numpy as np
 import cv2
 from PIL import Image
-import torch
 from skimage.color import rgb2gray
 import matplotlib.pyplot as plt
-from skimage import morphology, measure, feature
+from skimage import morphology, measure
 from skimage.measure import regionprops, perimeter_crofton
 
+from metrics import timed
+
 # Custom classes and visualization colors
 CUSTOM_CLASSES = ['calc', 'mass']
 COLOR = [(209, 109, 145), (0, 255, 255)]  # BGR colors for bounding boxes and masks
 CONTOUR_COLOR = [(0, 255, 255), (209, 109, 145)]  # BGR colors for mask contours
 
+def load_rgb_image(image) -> np.ndarray:
+    """
+    Return an RGB uint8 array for a path, the raw bytes of an encoded image,
+    or an array that was already decoded (returned as is, grayscale is expanded).
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    elif not isinstance(image, (str, os.PathLike)):
+        raise TypeError(f"Unsupported image source: {type(image).__name__}")
+    with Image.open(image) as img:
+        return np.array(img.convert("RGB"))
+
+@dataclass
+class ScaleMap:
+    """
+    Relation between an upload and the working-resolution image the pipeline
+    runs on (working = original * scale, per axis).
+    """
+    original_size: tuple  # (height, width)
+    working_size: tuple  # (height, width)
+
+    @property
+    def scale_y(self) -> float:
+        return self.working_size[0] / self.original_size[0]
+
+    @property
+    def scale_x(self) -> float:
+        return self.working_size[1] / self.original_size[1]
+
+    @property
+    def scale(self) -> float:
+        """Isotropic scale (geometric mean of both axes, so areas scale by its square)."""
+        return float(np.sqrt(self.scale_x * self.scale_y))
+
+    def working_spacing(self, pixel_spacing: float) -> float:
+        """Size in mm of a working-resolution pixel."""
+        return pixel_spacing / self.scale
+
+    def to_working_box(self, box, origin=(0, 0)):
+        """
+        Inclusive [x_min, y_min, x_max, y_max] box of the original image (or of a
+        region of it starting at `origin` (y, x)) in working coordinates.
+        """
+        x1, y1, x2, y2 = box
+        oy, ox = origin
+        height, width = self.working_size
+        wx1 = min(int((x1 + ox) * self.scale_x), width - 1)
+        wy1 = min(int((y1 + oy) * self.scale_y), height - 1)
+        wx2 = min(max(wx1, int(np.ceil((x2 + ox + 1) * self.scale_x)) - 1), width - 1)
+        wy2 = min(max(wy1, int(np.ceil((y2 + oy + 1) * self.scale_y)) - 1), height - 1)
+        return [wx1, wy1, wx2, wy2]
+
+    def as_dict(self) -> dict:
+        return {
+            "original_size": list(self.original_size),
+            "working_size": list(self.working_size),
+            "scale": round(self.scale, 6)
+        }
+
+
+def to_working_resolution(image_np, max_side: int = 0):
+    """
+    Resize an image once so its longest side is at most `max_side` (0 keeps
+    it as is). Returns the working image and its ScaleMap.
+    """
+    height, width = image_np.shape[:2]
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        image_np = cv2.resize(image_np, size, interpolation=cv2.INTER_AREA)
+    return image_np, ScaleMap((height, width), tuple(image_np.shape[:2]))
+
 def draw_rounded_rectangle(img, top_left, bottom_right, color, corner_radius=10, thickness=-1, alpha=0.6):
     """
     Draws a rounded rectangle with adjustable transparency on an image.
+    Only the region around the rectangle is blended, the image is modified in place.
     """
-    overlay = img.copy()
     x1, y1 = top_left
     x2, y2 = bottom_right
 
+    # Work on the rectangle's region (plus the line width for outlines)
+    pad = max(thickness, 0)
+    height, width = img.shape[:2]
+    rx1, ry1 = max(0, x1 - pad), max(0, y1 - pad)
+    rx2, ry2 = min(width, x2 + pad + 1), min(height, y2 + pad + 1)
+    if rx1 >= rx2 or ry1 >= ry2:
+        return img
+    roi = img[ry1:ry2, rx1:rx2]
+    overlay = roi.copy()
+    x1, y1, x2, y2 = x1 - rx1, y1 - ry1, x2 - rx1, y2 - ry1
+
     # Draw the straight sides of the rectangle
     cv2.rectangle(overlay, (x1 + corner_radius, y1), (x2 - corner_radius, y2), color, thickness)
     cv2.rectangle(overlay, (x1, y1 + corner_radius), (x2, y2 - corner_radius), color, thickness)
@@ -33,14 +124,56 @@ def draw_rounded_rectangle(img, top_left, bottom_right, color, corner_radius=10,
     cv2.circle(overlay, (x2 - corner_radius, y2 - corner_radius), corner_radius, color, thickness)
 
     # Blend overlay with the original image using the alpha factor
-    cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, img)
+    cv2.addWeighted(overlay, alpha, roi, 1 - alpha, 0, roi)
     return img
 
 
-def calculate_lesion_features(mask, image, pixel_spacing, min_area_px=10):
+# GLCM offsets (row, col) at distance 1 for the angles 0, 45, 90 and 135 degrees
+GLCM_OFFSETS = ((0, 1), (1, 1), (1, 0), (1, -1))
+
+
+def glcm_homogeneity(quant, lesion):
+    """
+    Mean GLCM homogeneity over the 4 angles, counting only pairs of lesion
+    pixels. Equivalent to a symmetric, normalized scikit-image graycomatrix
+    restricted to the lesion levels (each angle renormalized, 0 when an angle
+    has no pair) followed by graycoprops(..., 'homogeneity'), without building
+    the matrices. Returns nan when no angle has a pair.
+    """
+    height, width = quant.shape
+    values = quant.astype(np.int32)
+    per_angle = []
+    for dr, dc in GLCM_OFFSETS:
+        # Pixel pairs (r, c) -> (r + dr, c + dc) that fall inside the patch
+        c0, c1 = max(0, -dc), width - max(0, dc)
+        first = (slice(0, height - dr), slice(c0, c1))
+        second = (slice(dr, height), slice(c0 + dc, c1 + dc))
+        pairs = lesion[first] & lesion[second]
+        if not pairs.any():
+            per_angle.append(0.0)
+            continue
+        diff = values[first][pairs] - values[second][pairs]
+        per_angle.append(float(np.mean(1.0 / (1.0 + diff * diff))))
+    if not any(per_angle):
+        return np.nan
+    return float(np.mean(per_angle))
+
+
+def calculate_lesion_features(mask, image, pixel_spacing, min_area_px=10, box=None):
     """
     Extracts morphological, intensity, and texture features from a binary lesion mask.
+    `image` is RGB or already grayscale. Pass the lesion's `box` (inclusive x_min, y_min,
+    x_max, y_max) with a mask cropped to it; a full-image mask is cropped to its
+    bounding box. Everything is computed on that crop only.
     """
+    if box is None:
+        rows, cols = np.nonzero(mask)
+        if rows.size == 0:
+            raise ValueError("Empty lesion mask")
+        box = (cols.min(), rows.min(), cols.max(), rows.max())
+        mask = mask[box[1]:box[3] + 1, box[0]:box[2] + 1]
+    x_min, y_min, x_max, y_max = map(int, box)
+    image = image[y_min:y_max + 1, x_min:x_max + 1]
 
     # Convert image to grayscale if it's in RGB
     if image.ndim == 3 and image.shape[2] == 3:
@@ -75,23 +208,9 @@ def calculate_lesion_features(mask, image, pixel_spacing, min_area_px=10):
         patch_normalized = (patch - patch.min()) / (patch.max() - patch.min() + 1e-7) * 255
         patch_normalized = patch_normalized.astype(np.uint8)
 
-        # Quantize to 16 levels + background (17 bins)
-        bins = np.linspace(0, 256, 17)
-        quant = np.digitize(patch_normalized, bins) - 1
-        quant = np.where(mask_patch, quant, 16).astype(np.uint8)  # Set background to level 16
-
-        # Calculate GLCM and extract homogeneity
-        glcm = feature.graycomatrix(
-            quant,
-            distances=[1],
-            angles=[0, np.pi/4, np.pi/2, 3*np.pi/4],
-            levels=17,
-            symmetric=True,
-            normed=True
-        )
-        glcm_lesion = glcm[:16, :16, :, :]
-        if glcm_lesion.size and np.any(glcm_lesion):
-            homogeneity = float(np.mean(feature.graycoprops(glcm_lesion, 'homogeneity')))
+        # Quantize to 16 levels, homogeneity over pairs of lesion pixels
+        quant = patch_normalized // 16
+        homogeneity = glcm_homogeneity(quant, mask_patch)
 
     # Return all features as a structured dictionary
     return {
@@ -111,139 +230,58 @@ def calculate_lesion_features(mask, image, pixel_spacing, min_area_px=10):
     }
 
 
-def process_predictions(image_path: str, predictions: dict, pixel_spacing: float = None, confidence_threshold=0.5):
+# Optional thread pool computing the features of several lesions at once
+feature_pool = None
+
+
+def set_lesion_feature_workers(workers: int = 1):
+    """Compute lesion features in a pool of `workers` threads (1 computes them inline)."""
+    global feature_pool
+    if feature_pool is not None:
+        feature_pool.shutdown(wait=False)
+    feature_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lesion-features") if workers > 1 else None
+
+
+def process_predictions(image, predictions, pixel_spacing: float = None, confidence_threshold=0.5, rendered=None,
+                        timings: dict = None):
     """
-    Main function to process model predictions:
+    Main function to process model predictions (a model_utils.Detections) on
+    an image given as a path or an already decoded RGB array:
     - Draws boxes/masks
     - Extracts lesion features
-    - Encodes image regions to base64
+    - Encodes image regions to JPEG
+    Pass a previous result for the same image and predictions as `rendered` to
+    skip drawing and encoding: only the lesion features are recomputed.
+    Stage times (ms) are added to `timings` if given.
     """
     try:
-        print(pixel_spacing)
-
-        # Load image and convert to NumPy RGB array
-        with Image.open(image_path) as img:
-            image_np = np.array(img.convert("RGB"))
+        # Load image (if needed) as a NumPy RGB array
+        image_np = load_rgb_image(image)
 
         if image_np.max() <= 1:
             image_np = (image_np * 255).astype(np.uint8)
 
-        # Extract and filter prediction data
-        boxes = torch.tensor(predictions['boxes'])
-        labels = torch.tensor(predictions['labels'])
-        scores = torch.tensor(predictions['scores'])
-        masks = torch.tensor(predictions['masks'])
-        classif = predictions['classification']
-
-        high_conf = scores > confidence_threshold
-        boxes = boxes[high_conf].numpy()
-        labels = labels[high_conf].numpy()
-        scores = scores[high_conf].numpy()
-        masks = masks[high_conf].numpy()
-        high_conf = high_conf.cpu().numpy()
-        classif = [cls for cls, mask in zip(classif, high_conf) if mask]
-
-        output_data = {'full_image': None, 'individual_predictions': []}
-        full_image = image_np.copy()
-
-        # Encode original (unmodified) image
-        _, Normbuffer = cv2.imencode('.jpg', cv2.cvtColor(full_image, cv2.COLOR_RGB2BGR))
-
-        image_height, image_width = image_np.shape[:2]
-        colored_mask = np.zeros_like(image_np)
-
-        for i, (box, label, cls_result) in enumerate(zip(boxes, labels, classif)):
-            xmin, ymin, xmax, ymax = map(int, box)
-            mask = (masks[i].squeeze() > 0.5).astype(np.uint8)
-            print(CUSTOM_CLASSES[label - 1])
-
-            # Assign color depending on class
-            if CUSTOM_CLASSES[label - 1] == 'mass':
-                color_tbm = COLOR[0]
-                color_c = CONTOUR_COLOR[0]
-            else:
-                color_tbm = COLOR[1]
-                color_c = CONTOUR_COLOR[1]
-
-            colored_mask[:] = color_tbm
-
-            # Create label text
-            label_text = f"{int(scores[i] * 100)}% {CUSTOM_CLASSES[label - 1]}"
-            font = cv2.FONT_HERSHEY_DUPLEX
-            font_scale = 1.6
-            thickness = 2
-            (text_w, text_h), baseline = cv2.getTextSize(label_text, font, font_scale, thickness)
-
-            # Calculate label position
-            box_center = (xmin + xmax) // 2
-            text_x = max(0, min(box_center - text_w // 2, image_width - text_w))
-            text_y = ymin - 10
-            if text_y - text_h < 0:
-                text_y = ymax + text_h + 10
-                if text_y + baseline > image_height:
-                    text_y = ymin + (ymax - ymin) // 2
-
-            # Draw box and label on full image
-            cv2.rectangle(full_image, (xmin, ymin), (xmax, ymax), color_tbm, 2)
-            padding = 5
-            corner_radius = 8
-            bg_top_left = (max(0, text_x - padding), max(0, text_y - text_h - padding))
-            bg_bottom_right = (min(image_width, text_x + text_w + padding), min(image_height, text_y + padding))
-
-            draw_rounded_rectangle(full_image, bg_top_left, bg_bottom_right, color_tbm, corner_radius, alpha=0.6)
-            cv2.putText(full_image, label_text, (text_x, text_y), font, font_scale, (255, 255, 255), thickness)
-
-            # Apply mask overlay
-            full_image = np.where(mask[..., None],
-                                  cv2.addWeighted(full_image, 1, colored_mask, 0.3, 0),
-                                  full_image)
-
-            # Draw mask contours
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            cv2.drawContours(full_image, contours, -1, color_c, 2)
-
-            # Create cropped + annotated version for each prediction
-            single_pred = image_np.copy()
-            cv2.rectangle(single_pred, (xmin, ymin), (xmax, ymax), color_tbm, 2)
-            draw_rounded_rectangle(single_pred, bg_top_left, bg_bottom_right, color_tbm, corner_radius, alpha=0.6)
-            cv2.putText(single_pred, label_text, (text_x, text_y), font, font_scale, (255, 255, 255), thickness)
-            single_pred = np.where(mask[..., None],
-                                   cv2.addWeighted(single_pred, 1, colored_mask, 0.3, 0),
-                                   single_pred)
-            cv2.drawContours(single_pred, contours, -1, color_c, 2)
-
-            # Encode single detection image
-            _, buffer = cv2.imencode('.jpg', cv2.cvtColor(single_pred, cv2.COLOR_RGB2BGR))
-
-            # Create and encode cropped region
-            pad = 100
-            x1 = max(0, xmin - pad)
-            y1 = max(0, ymin - pad)
-            x2 = min(image_width, xmax + pad)
-            y2 = min(image_height, ymax + pad)
-            crop = image_np[y1:y2, x1:x2]
-            _, buf = cv2.imencode('.jpg', cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
-
-            # Append all outputs to the list
-            output_data['individual_predictions'].append({
-                'image': base64.b64encode(buffer).decode('utf-8'),
-                'label': CUSTOM_CLASSES[label - 1],
-                'classification': cls_result,
-                'score': float(scores[i]),
-                'features': calculate_lesion_features(mask, image_np, pixel_spacing),
-                'crop': base64.b64encode(buf).decode('utf-8'),
-            })
-
-        # Final encoded full image with all detections
-        _, buffer = cv2.imencode('.jpg', cv2.cvtColor(full_image, cv2.COLOR_RGB2BGR))
-        output_data['full_image'] = base64.b64encode(buffer).decode('utf-8')
+        # Filter prediction data
+        predictions = predictions.subset(predictions.scores > confidence_threshold)
 
-        return {
-            "full_image": output_data['full_image'],
-            "detections": True,
-            "full_Normal_image": base64.b64encode(Normbuffer).decode('utf-8'),
-            "individual_predictions": output_data['individual_predictions']
-        }
+        if rendered is None:
+            result = render_predictions(image_np, predictions, timings)
+        else:
+            result = {**rendered, 'individual_predictions': [dict(p) for p in rendered['individual_predictions']]}
+
+        # Lesion features depend on the pixel spacing, they are never reused.
+        # Only each lesion's box is converted to grayscale, never the whole image.
+        def lesion_features(i):
+            return calculate_lesion_features(predictions.masks[i], image_np, pixel_spacing, box=predictions.boxes[i])
+
+        with timed(timings, "lesion_features"):
+            if feature_pool is not None and len(predictions) > 1:
+                features = list(feature_pool.map(lesion_features, range(len(predictions))))
+            else:
+                features = [lesion_features(i) for i in range(len(predictions))]
+        for prediction, lesion in zip(result['individual_predictions'], features):
+            prediction['features'] = lesion
+        return result
 
     except Exception as e:
         # Return error response on failure
@@ -252,3 +290,164 @@ def process_predictions(image_path: str, predictions: dict, pixel_spacing: float
             status_code=500,
             content={"message": f"Processing error: {str(e)}"}
         )
+
+
+# Rendering options, set once per worker by set_render_options()
+DETECTION_VIEWS = ("full", "crop")
+render_options = {"detection_view": "full", "jpeg_quality": 95, "max_side": 0}
+
+
+def set_render_options(detection_view: str = "full", jpeg_quality: int = 95, max_side: int = 0):
+    """
+    detection_view: 'full' draws each detection on a copy of the whole image,
+    'crop' only on a padded crop around it. Encoded images are resized so
+    their longest side is at most `max_side` (0 keeps the full resolution).
+    """
+    if detection_view not in DETECTION_VIEWS:
+        raise ValueError(f"Unknown detection view: {detection_view} (expected one of {DETECTION_VIEWS})")
+    render_options.update(detection_view=detection_view, jpeg_quality=int(jpeg_quality), max_side=int(max_side))
+
+
+def encode_jpeg(image_rgb, timings: dict = None) -> bytes:
+    """JPEG bytes of an RGB image with the configured quality and maximum size."""
+    with timed(timings, "jpeg_encode"):
+        max_side = render_options["max_side"]
+        height, width = image_rgb.shape[:2]
+        if max_side and max(height, width) > max_side:
+            scale = max_side / max(height, width)
+            image_rgb = cv2.resize(image_rgb, (max(1, round(width * scale)), max(1, round(height * scale))),
+                                   interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode('.jpg', cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR),
+                                 [cv2.IMWRITE_JPEG_QUALITY, render_options["jpeg_quality"]])
+        return buffer.tobytes()
+
+
+def draw_detection(canvas, origin, box, mask, contours, label_text, text_org, label_box, colors, colored_mask):
+    """
+    Draws one detection (box, label, mask overlay, contours) on `canvas`, whose
+    top-left corner is at `origin` in full-image coordinates. The mask overlay
+    is blended inside the box only, `colored_mask` is a reusable buffer at
+    least as large as the box and filled with the mask color.
+    """
+    ox, oy = origin
+    xmin, ymin, xmax, ymax = box[0] - ox, box[1] - oy, box[2] - ox, box[3] - oy
+    color_tbm, color_c = colors
+    font = cv2.FONT_HERSHEY_DUPLEX
+
+    cv2.rectangle(canvas, (xmin, ymin), (xmax, ymax), color_tbm, 2)
+    (bx1, by1), (bx2, by2) = label_box
+    draw_rounded_rectangle(canvas, (bx1 - ox, by1 - oy), (bx2 - ox, by2 - oy), color_tbm, 8, alpha=0.6)
+    cv2.putText(canvas, label_text, (text_org[0] - ox, text_org[1] - oy), font, 1.6, (255, 255, 255), 2)
+
+    # Apply mask overlay
+    roi = canvas[ymin:ymax + 1, xmin:xmax + 1]
+    blended = cv2.addWeighted(roi, 1, colored_mask[:roi.shape[0], :roi.shape[1]], 0.3, 0)
+    roi[mask] = blended[mask]
+
+    # Draw mask contours
+    cv2.drawContours(canvas, contours, -1, color_c, 2, offset=(-ox, -oy))
+
+
+def render_predictions(image_np, predictions, timings: dict = None):
+    """
+    Draws the filtered predictions and encodes the images to JPEG bytes
+    (see response_formats for how they are sent to the client).
+    Drawing only touches each detection's region; see set_render_options for
+    the per-detection view, JPEG quality and output size.
+    The 'features' of each prediction are left empty.
+    JPEG encoding time (ms) is added to `timings` if given.
+    """
+    boxes = predictions.boxes
+    labels = predictions.labels
+    scores = predictions.scores
+    classif = predictions.classification
+    detection_view = render_options["detection_view"]
+
+    output_data = {'full_image': None, 'individual_predictions': []}
+    full_image = image_np.copy()
+
+    # Encode original (unmodified) image
+    normal_image = encode_jpeg(full_image, timings)
+
+    image_height, image_width = image_np.shape[:2]
+    # One mask color buffer, sized for the largest box
+    if len(boxes):
+        box_sizes = boxes[:, 2:] - boxes[:, :2] + 1
+        colored_mask = np.empty((int(box_sizes[:, 1].max()), int(box_sizes[:, 0].max()), 3), dtype=np.uint8)
+
+    for i, (box, label, cls_result) in enumerate(zip(boxes, labels, classif)):
+        xmin, ymin, xmax, ymax = map(int, box)
+        mask = predictions.masks[i]
+
+        # Assign color depending on class
+        if CUSTOM_CLASSES[label - 1] == 'mass':
+            colors = (COLOR[0], CONTOUR_COLOR[0])
+        else:
+            colors = (COLOR[1], CONTOUR_COLOR[1])
+
+        colored_mask[:] = colors[0]
+
+        # Create label text
+        label_text = f"{int(scores[i] * 100)}% {CUSTOM_CLASSES[label - 1]}"
+        (text_w, text_h), baseline = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_DUPLEX, 1.6, 2)
+
+        # Calculate label position
+        box_center = (xmin + xmax) // 2
+        text_x = max(0, min(box_center - text_w // 2, image_width - text_w))
+        text_y = ymin - 10
+        if text_y - text_h < 0:
+            text_y = ymax + text_h + 10
+            if text_y + baseline > image_height:
+                text_y = ymin + (ymax - ymin) // 2
+
+        padding = 5
+        bg_top_left = (max(0, text_x - padding), max(0, text_y - text_h - padding))
+        bg_bottom_right = (min(image_width, text_x + text_w + padding), min(image_height, text_y + padding))
+
+        # Contours of the box-sized mask, found with a zero border and shifted to image coordinates
+        contours, _ = cv2.findContours(np.pad(mask, 1).astype(np.uint8), cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE, offset=(xmin - 1, ymin - 1))
+
+        drawing = ((xmin, ymin, xmax, ymax), mask, contours, label_text, (text_x, text_y),
+                   (bg_top_left, bg_bottom_right), colors, colored_mask)
+
+        # Draw box, label and mask on full image
+        draw_detection(full_image, (0, 0), *drawing)
+
+        # Padded region around the detection
+        pad = 100
+        x1 = max(0, xmin - pad)
+        y1 = max(0, ymin - pad)
+        x2 = min(image_width, xmax + pad)
+        y2 = min(image_height, ymax + pad)
+
+        # Annotated version for each prediction: the whole image or a padded crop including the label
+        if detection_view == "crop":
+            vx1, vy1 = min(x1, bg_top_left[0]), min(y1, bg_top_left[1])
+            vx2 = max(x2, min(image_width, bg_bottom_right[0] + 1))
+            vy2 = max(y2, min(image_height, bg_bottom_right[1] + 1))
+            single_pred = image_np[vy1:vy2, vx1:vx2].copy()
+            draw_detection(single_pred, (vx1, vy1), *drawing)
+        else:
+            single_pred = image_np.copy()
+            draw_detection(single_pred, (0, 0), *drawing)
+
+        # Append all outputs to the list (the crop is the unannotated padded region)
+        output_data['individual_predictions'].append({
+            'image': encode_jpeg(single_pred, timings),
+            'label': CUSTOM_CLASSES[label - 1],
+            'classification': cls_result,
+            'score': float(scores[i]),
+            'features': None,
+            'crop': encode_jpeg(image_np[y1:y2, x1:x2], timings),
+        })
+
+    # Final encoded full image with all detections
+    output_data['full_image'] = encode_jpeg(full_image, timings)
+
+    return {
+        "full_image": output_data['full_image'],
+        "detections": True,
+        "full_Normal_image": normal_image,
+        "individual_predictions": output_data['individual_predictions']
+    }
@@ -0,0 +1,194 @@
+import asyncio
+import ipaddress
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.connection import Client
+
+
+class PoolFullError(Exception):
+    """Raised when the inference queue cannot accept another request."""
+
+
+# Barrier of the worker processes, set by _init_worker in each of them
+_worker_barrier = None
+
+
+def _init_worker(barrier, initializer=None):
+    global _worker_barrier
+    _worker_barrier = barrier
+    if initializer is not None:
+        initializer()
+
+
+def _run_in_every_worker(fn):
+    """
+    Run `fn`, then wait for every other worker process to have run it too: a
+    process blocked here cannot pick up a second call, so `workers` calls run
+    in `workers` different processes.
+    """
+    try:
+        result = fn()
+    except BaseException:
+        _worker_barrier.abort()  # Release the processes already waiting
+        raise
+    _worker_barrier.wait()
+    return result
+
+
+class InferencePool:
+    """
+    Runs blocking inference work in a thread or process pool so the event loop
+    stays free. Admission is bounded: at most `workers + queue_size` jobs may be
+    running or waiting at any time, extra requests are rejected immediately.
+    Process workers run `initializer` when they start; call warm_up() to load
+    everything before serving.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = 1, queue_size: int = 4, initializer=None):
+        if kind == "process":
+            context = multiprocessing.get_context()
+            self._barrier = context.Barrier(workers)
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                                 initargs=(self._barrier, initializer))
+        elif kind == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        else:
+            raise ValueError(f"Unknown inference executor: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.pending = 0
+
+    def _release(self, _future):
+        self.pending -= 1
+
+    async def run(self, fn, *args):
+        """Submit `fn(*args)` to the pool, or raise PoolFullError if the queue is full."""
+        if self.pending >= self.capacity:
+            raise PoolFullError(f"Inference queue is full ({self.pending}/{self.capacity})")
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, fn, *args)
+        self.pending += 1
+        # Release the slot when the job really finishes, even if the client went away
+        future.add_done_callback(self._release)
+        return await asyncio.shield(future)
+
+    async def warm_up(self, fn):
+        """
+        Run `fn` in the pool before any request: once for threads (models are
+        shared), exactly once in each worker for processes. Returns the results.
+        """
+        loop = asyncio.get_running_loop()
+        if self.kind == "thread":
+            return [await loop.run_in_executor(self._executor, fn)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _run_in_every_worker, fn) for _ in range(self.workers)),
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            self._barrier.reset()
+            # The error of fn itself rather than the broken barrier of the other workers
+            raise next((e for e in errors if not isinstance(e, threading.BrokenBarrierError)), errors[0])
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address: str, allow_remote: bool = False):
+    """
+    Unix socket path, or ("host", port) for a "host:port" address. The
+    inference server unpickles the calls it receives (and its clients the
+    results), so a TCP address must be a loopback one unless `allow_remote`.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        if not _is_loopback(host) and not allow_remote:
+            raise ValueError(
+                f"Inference address {address} is not a loopback one: the inference server must not be "
+                f"exposed (set INFERENCE_ALLOW_REMOTE=true only on a private, trusted network)"
+            )
+        return host.strip("[]"), int(port)
+    return address
+
+
+class RemoteInferencePool(InferencePool):
+    """
+    InferencePool whose jobs run in a separate inference_server.py process, so
+    several HTTP worker processes share one copy of the models. Calls are
+    pickled over local connections (one per concurrent call, reused); the
+    server applies its own admission limit and answers "busy" when full.
+    """
+
+    def __init__(self, address: str, authkey: bytes, connections: int = 8, connect_timeout: float = 600,
+                 allow_remote: bool = False):
+        self._executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="inference-client")
+        self.kind = "remote"
+        self.workers = 1
+        self.capacity = connections
+        self.pending = 0
+        self.address = parse_address(address, allow_remote)
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout: float = 0):
+        """Open a connection, retrying for `timeout` seconds while the server starts."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _call(self, fn, args, connect_timeout: float = 0):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect(connect_timeout)
+        try:
+            conn.send((fn, args))
+            status, value = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+        with self._lock:
+            self._idle.append(conn)
+
+        if status == "busy":
+            raise PoolFullError(value)
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` in the inference server, or raise PoolFullError if it is full."""
+        return await super().run(self._call, fn, args)
+
+    async def warm_up(self, fn):
+        """Run `fn` once in the inference server, waiting for it to come up."""
+        loop = asyncio.get_running_loop()
+        return [await loop.run_in_executor(self._executor, self._call, fn, (), self.connect_timeout)]
+
+    def shutdown(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+        super().shutdown()
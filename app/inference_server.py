@@ -0,0 +1,102 @@
+"""
+Inference process shared by several HTTP workers (INFERENCE_EXECUTOR=remote):
+the models are loaded once here and the workers send their jobs over a local
+socket (see inference_pool.RemoteInferencePool). serve.py starts it next to
+the uvicorn workers; it can also run on its own:
+    INFERENCE_AUTHKEY=<secret> python inference_server.py
+
+Calls are pickled: anyone holding the authkey can run code in this process.
+It listens on a Unix socket only its user can open, or on a loopback host:port;
+it must not be exposed to other machines (see INFERENCE_ALLOW_REMOTE).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener
+
+from config import Settings
+from inference_pool import parse_address
+from pipeline import init_models, model_init_options
+
+
+class InferenceServer:
+    """
+    Runs the jobs received on `address` in a pool of `workers` threads.
+    At most `workers + queue_size` jobs run or wait at once, extra calls are
+    answered "busy" (a 503 for the client) as with the in-process pool.
+    """
+
+    def __init__(self, address: str, authkey: bytes, workers: int = 1, queue_size: int = 4,
+                 allow_remote: bool = False):
+        self.address = parse_address(address, allow_remote)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)  # Socket left by a previous run
+        # Created owner-only, so other local users cannot connect to the socket
+        previous_umask = os.umask(0o177)
+        try:
+            self.listener = Listener(self.address, authkey=authkey)
+        finally:
+            os.umask(previous_umask)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self.capacity = workers + queue_size
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        print(f"Inference server listening on {self.address}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                # Failed handshake (wrong authkey) or a client that went away
+                print(f"Inference server: rejected connection: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), name="inference-connection", daemon=True).start()
+
+    def _handle(self, conn):
+        """Serve the calls of one client connection, one at a time."""
+        with conn:
+            while True:
+                try:
+                    fn, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    conn.send(("error", f"Invalid call: {e}"))
+                    continue
+                try:
+                    conn.send(self._call(fn, args))
+                except (EOFError, OSError):
+                    return
+
+    def _call(self, fn, args):
+        with self._lock:
+            if self.pending >= self.capacity:
+                return "busy", f"Inference queue is full ({self.pending}/{self.capacity})"
+            self.pending += 1
+        try:
+            return "ok", self._executor.submit(fn, *args).result()
+        except Exception as e:
+            return "error", f"{type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+
+def main():
+    settings = Settings()
+    if not settings.inference_authkey:
+        raise SystemExit("Set INFERENCE_AUTHKEY: clients authenticate with it")
+    # Threads are sized for this process only, the HTTP workers do not run models
+    init_models(**model_init_options(settings))
+    InferenceServer(
+        settings.inference_address,
+        settings.inference_authkey.encode(),
+        workers=settings.inference_workers,
+        queue_size=settings.inference_queue_size,
+        allow_remote=settings.inference_allow_remote
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
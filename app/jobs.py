@@ -0,0 +1,170 @@
+import ipaddress
+import json
+import os
+import pickle
+import re
+import socket
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+from file_store import atomic_write, purge_dir
+
+JOB_STATUSES = ("queued", "running", "done", "error")
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class JobStore:
+    """
+    Status and results of asynchronous /jobs predictions. Records live in memory,
+    or as one pickle file per job in `directory` (shared by every process using
+    that directory, and kept across restarts). A record expires `ttl` seconds
+    after it was created or last updated. Queued uploads wait as files in
+    `<directory>/uploads`, or in a private temporary directory.
+    """
+
+    def __init__(self, ttl: float = 3600, directory: str = None):
+        self.ttl = ttl
+        self.directory = directory
+        if directory:
+            self.upload_dir = os.path.join(directory, "uploads")
+            os.makedirs(self.upload_dir, mode=0o700, exist_ok=True)
+        else:
+            self.upload_dir = tempfile.mkdtemp(prefix="safescan-jobs-")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.pkl")
+
+    def _read(self, job_id):
+        if not self.directory:
+            return self._jobs.get(job_id)
+        try:
+            with open(self._path(job_id), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _write(self, job):
+        if not self.directory:
+            self._jobs[job["job_id"]] = job
+            return
+        atomic_write(self._path(job["job_id"]), job)
+
+    def _delete(self, job_id):
+        if not self.directory:
+            self._jobs.pop(job_id, None)
+            return
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def purge(self):
+        """Drop expired jobs."""
+        now = time.time()
+        with self._lock:
+            if not self.directory:
+                for job_id in [job_id for job_id, job in self._jobs.items() if job["expires_at"] <= now]:
+                    del self._jobs[job_id]
+                return
+            purge_dir(self.directory, self.ttl, now=now, suffix=".pkl")
+        # Uploads of jobs that were queued when a process stopped
+        purge_dir(self.upload_dir, self.ttl, now=now)
+
+    def create(self, **fields) -> str:
+        """Register a queued job and return its ID."""
+        self.purge()
+        now = time.time()
+        job = {"job_id": uuid.uuid4().hex, "status": "queued", "created_at": now,
+               "updated_at": now, "expires_at": now + self.ttl, **fields}
+        with self._lock:
+            self._write(job)
+        return job["job_id"]
+
+    def update(self, job_id: str, **fields):
+        """Update a job's fields (e.g. status, result); its TTL starts again."""
+        with self._lock:
+            job = self._read(job_id)
+            if job is None:
+                return
+            now = time.time()
+            job.update(fields, updated_at=now, expires_at=now + self.ttl)
+            self._write(job)
+
+    def save_upload(self, job_id: str, content: bytes) -> str:
+        """Write the upload of a queued job to a file, so the queue only holds its path."""
+        path = os.path.join(self.upload_dir, job_id)
+        atomic_write(path, content, format="bytes")
+        return path
+
+    @staticmethod
+    def load_upload(path: str) -> bytes:
+        """Read and remove the upload written by save_upload."""
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def get(self, job_id: str):
+        """The job record, or None if the ID is unknown or expired."""
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        with self._lock:
+            job = self._read(job_id)
+            if job is not None and job["expires_at"] <= time.time():
+                self._delete(job_id)
+                return None
+        return job
+
+
+def check_callback_url(url: str, allowed_hosts=()):
+    """
+    Raise ValueError unless `url` is an http(s) URL the server may POST to: a
+    host of `allowed_hosts` when given, otherwise a host whose addresses are
+    all public (no loopback, private, link-local, reserved or multicast one),
+    so callbacks cannot reach the server's own network.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("callback_url must be an http(s) URL.")
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise ValueError(f"callback_url host {host} is not allowed.")
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or 80, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, ValueError):
+        raise ValueError(f"callback_url host {host} does not resolve.")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"callback_url host {host} is not a public address.")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Callbacks are not redirected, a redirect could point to an internal host."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def notify_callback(url: str, body: dict, timeout: float = 10, allowed_hosts=()):
+    """POST a JSON notification to a client callback URL, failures are only logged."""
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode("utf-8"), method="POST",
+        headers={"Content-Type": "application/json"}
+    )
+    try:
+        # Checked again: the host may resolve to another address than when the job was created
+        check_callback_url(url, allowed_hosts)
+        with urllib.request.build_opener(_NoRedirect).open(request, timeout=timeout) as response:
+            response.read()
+    except Exception as e:
+        print(f"Callback to {url} failed: {e}")
@@ -1,109 +1,521 @@
-import base64
-import io
+import asyncio
+import json
 import os
+import time
 import uuid
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import List
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Query, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+from artifact_store import ArtifactStore
 from config import Settings
-from dicom_utils import dicom_to_png
-from model_utils import load_model, predict
-from image_processing import process_predictions
-from classifier_utils import load_classifier, classify
-from sendmail import send_email, reply_email
+from inference_pool import InferencePool, PoolFullError, RemoteInferencePool
+from jobs import JobStore, check_callback_url, notify_callback
+from metrics import (
+    INFERENCE_CAPACITY, INFERENCE_PENDING, JOB_QUEUE_DEPTH, MODEL_MEMORY, OUTBOX_PENDING, REQUEST_SECONDS, REQUESTS,
+    THREAD_ALLOCATION, mark_process_dead, observe_timings, render_metrics
+)
+from pipeline import (
+    init_models, model_init_options, model_memory, result_cache_namespace, run_prediction, run_study, study_summary
+)
+from runtime import thread_allocation
+from response_formats import build_response, negotiate_format, parse_exclude
+from result_cache import ResultCache
+from upload_limits import MaxBodySizeMiddleware, read_upload, read_uploads
+from outbox import Outbox, worker_outbox_path
+from sendmail import build_contact_email, build_reply_email
 
 # Dependency to load settings from .env
 
 def get_settings() -> Settings:
     return Settings()
 
+settings = get_settings()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the inference workers and load the models without blocking /healthz."""
+    app.state.ready = False
+    load_models = partial(init_models, **model_init_options(settings))
+    if settings.inference_executor == "remote":
+        # Models live in the inference_server.py process shared by every HTTP worker
+        app.state.inference_pool = RemoteInferencePool(
+            settings.inference_address,
+            settings.inference_authkey.encode(),
+            connections=settings.inference_workers + settings.inference_queue_size,
+            allow_remote=settings.inference_allow_remote
+        )
+    else:
+        app.state.inference_pool = InferencePool(
+            kind=settings.inference_executor,
+            workers=settings.inference_workers,
+            queue_size=settings.inference_queue_size,
+            initializer=load_models
+        )
+
+    async def warm_up():
+        try:
+            app.state.startup_timings = await app.state.inference_pool.warm_up(load_models)
+            # Workers load the same models, report the first one
+            for name, size in (await app.state.inference_pool.warm_up(model_memory))[0].items():
+                MODEL_MEMORY.labels(name).set(size)
+            app.state.thread_allocation = (await app.state.inference_pool.warm_up(thread_allocation))[0]
+            for library, threads in app.state.thread_allocation["threads"].items():
+                THREAD_ALLOCATION.labels(library).set(threads)
+            app.state.ready = True
+        except Exception as e:
+            print(f"Error while loading models: {e}")
+            app.state.load_error = str(e)
+
+    app.state.result_cache = None
+    if settings.result_cache_max_mb > 0:
+        app.state.result_cache = ResultCache(
+            max_bytes=settings.result_cache_max_mb * 1024 * 1024,
+            ttl=settings.result_cache_ttl,
+            disk_dir=settings.result_cache_dir or None,
+            disk_max_bytes=settings.result_cache_disk_mb * 1024 * 1024,
+            namespace=result_cache_namespace(settings)
+        )
+
+    app.state.artifacts = ArtifactStore(
+        ttl=settings.artifact_ttl,
+        max_bytes=settings.artifact_store_max_mb * 1024 * 1024,
+        directory=settings.artifact_store_dir or None
+    )
+
+    # Contact form emails, sent by a background thread
+    app.state.outbox = Outbox(
+        settings,
+        path=worker_outbox_path(settings.outbox_path),
+        max_attempts=settings.outbox_max_attempts,
+        backoff=settings.outbox_backoff
+    )
+    app.state.outbox.start()
+
+    # Asynchronous /jobs predictions
+    app.state.job_store = JobStore(ttl=settings.job_ttl, directory=settings.job_store_dir or None)
+    app.state.job_queue = asyncio.Queue(maxsize=settings.job_queue_size)
+    workers = [asyncio.create_task(job_worker()) for _ in range(settings.job_workers)]
+
+    # Load in the background so the server answers /healthz while models load
+    loading = asyncio.create_task(warm_up())
+    yield
+    loading.cancel()
+    for worker in workers:
+        worker.cancel()
+    app.state.outbox.stop()
+    app.state.inference_pool.shutdown()
+    mark_process_dead()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+ALLOWED_EXTENSIONS = {".dcm",".dicom", ".png", ".jpg", ".jpeg"}
+DICOM_EXTENSIONS = {".dcm", ".dicom"}
+MAX_FILE_SIZE = 60 * 1024 * 1024  # 60 MB
+MULTIPART_OVERHEAD = 64 * 1024  # Form fields and part headers around the file
+MAX_STUDY_IMAGES = 8  # /predict/batch
+MAX_STUDY_SIZE = 4 * MAX_FILE_SIZE  # All the files of a /predict/batch study, read in memory
 
-# Load models on startup
-model = load_model()
-classifier = load_classifier()
+# Request metrics, registered before the other middlewares so it is the innermost one
+# (each middleware added wraps the previous ones)
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and their latency per route template (not per raw path)."""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    route_path = route.path if route is not None else "unmatched"
+    REQUESTS.labels(request.method, route_path, response.status_code).inc()
+    REQUEST_SECONDS.labels(request.method, route_path).observe(time.perf_counter() - start)
+    return response
 
-# CORS middleware
+# Abort oversize uploads while they stream in, before multipart parsing buffers them
+app.add_middleware(
+    MaxBodySizeMiddleware,
+    max_body_size=MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+    path_prefixes=("/predict", "/jobs"),
+    path_limits={"/predict/batch": MAX_STUDY_SIZE + MAX_STUDY_IMAGES * MULTIPART_OVERHEAD}
+)
+
+# CORS middleware, added last so it is the outermost one and its headers are on every
+# response, including the 413 of MaxBodySizeMiddleware (not counted by the request metrics)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=False,
-    allow_methods=["POST"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
 
-ALLOWED_EXTENSIONS = {".dcm",".dicom", ".png", ".jpg", ".jpeg"}
-MAX_FILE_SIZE = 60 * 1024 * 1024  # 60 MB
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
 
-def convert_image_to_base64(image_stream: io.BytesIO) -> str:
-    image_stream.seek(0)
-    return base64.b64encode(image_stream.read()).decode('utf-8')
+@app.get("/readyz")
+async def readyz():
+    """Readiness: every model is loaded and the inference workers are warm (with their thread allocation)."""
+    if not getattr(app.state, "ready", False):
+        if getattr(app.state, "load_error", None):
+            return JSONResponse(status_code=503, content={"status": "error", "detail": app.state.load_error})
+        return JSONResponse(status_code=503, content={"status": "loading"})
+    return {"status": "ready", "startup_ms": app.state.startup_timings, "threads": app.state.thread_allocation}
 
-@app.post("/predict")
-async def predict_api(
-    file: UploadFile = File(...),
-    pixel_spacing: str = Form(...)
-):
-    print("Received file:", file.filename)
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters and size of the /predict result cache."""
+    if app.state.result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **app.state.result_cache.stats()}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency, queue depths, batch sizes and model memory."""
+    pool = app.state.inference_pool
+    INFERENCE_PENDING.set(pool.pending)
+    INFERENCE_CAPACITY.set(pool.capacity)
+    JOB_QUEUE_DEPTH.set(app.state.job_queue.qsize())
+    OUTBOX_PENDING.set(app.state.outbox.pending())
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/artifacts/{artifact_id}", name="get_artifact")
+async def get_artifact(artifact_id: str):
+    """Image referenced by a /predict response in 'refs' format, until it expires."""
+    artifact = app.state.artifacts.get(artifact_id)
+    if artifact is None:
+        raise HTTPException(404, "Unknown or expired artifact")
+    media_type, data = artifact
+    return Response(content=data, media_type=media_type, headers={"Cache-Control": "private, no-store"})
+
+def format_server_timing(timings: dict) -> str:
+    """Format stage timings (ms) as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
+
+def finish_timings(request: Request, response: Response, timings: dict):
+    """
+    Record the stage timings of a request in /metrics and send them back as
+    Server-Timing. With `X-Trace: 1` on the request (or TRACE_REQUESTS) the
+    response also carries an X-Trace header with a trace ID and the stages,
+    which is logged as well.
+    """
+    observe_timings(timings)
+    response.headers["Server-Timing"] = format_server_timing(timings)
+    if settings.trace_requests or request.headers.get("x-trace") == "1":
+        trace = json.dumps({
+            "trace_id": uuid.uuid4().hex,
+            "route": request.url.path,
+            "stages_ms": {stage: round(duration, 1) for stage, duration in timings.items()}
+        }, separators=(",", ":"))
+        print(f"Trace: {trace}")
+        response.headers["X-Trace"] = trace
 
-    # Parse pixel_spacing
+def parse_response_options(request: Request, format: str, exclude: str):
+    """Response format (query parameter first, then the Accept header) and excluded images."""
     try:
-        pixel_spacing_value = float(pixel_spacing) if pixel_spacing else None
+        return negotiate_format(format, request.headers.get("accept")), parse_exclude(exclude)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+def parse_pixel_spacing(pixel_spacing: str):
+    try:
+        return float(pixel_spacing) if pixel_spacing else None
     except ValueError:
         raise HTTPException(400, "Invalid pixel spacing. Must be a number.")
 
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(400, "File is too large.")
-    await file.seek(0)
+def require_pixel_spacing(ext: str, pixel_spacing):
+    """Only DICOM files may omit the pixel spacing: it is then read from their header."""
+    if pixel_spacing is None and ext not in DICOM_EXTENSIONS:
+        raise HTTPException(400, "Pixel spacing is required for non-DICOM files.")
 
+def upload_extension(file: UploadFile) -> str:
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(400, f"Unsupported file type: {ext}")
+    return ext
 
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
-    input_path = os.path.join(temp_dir, f"{uuid.uuid4()}{ext}")
-    output_path = os.path.join(temp_dir, f"{uuid.uuid4()}.png")
+def require_ready():
+    if not getattr(app.state, "ready", False):
+        raise HTTPException(
+            503,
+            "Models are still loading, please retry later.",
+            headers={"Retry-After": str(settings.inference_retry_after)}
+        )
 
+async def cached_result(content, ext: str):
+    """Cache key and entry of an upload (None, None when the cache is disabled)."""
+    cache = app.state.result_cache
+    if cache is None:
+        return None, None
+    # Same bytes, same model outputs: only the spacing-dependent features are recomputed
+    key = await asyncio.to_thread(cache.key, content, ext)
+    return key, await asyncio.to_thread(cache.get, key)
+
+async def run_inference(fn, *args):
+    """Run `fn` in the inference pool, mapping a full queue to 503 and failures to 500."""
     try:
-        # Save the uploaded file to a temporary location
-        with open(input_path, "wb") as f:
-            f.write(content)
-        
-
-        # Convert DICOM if needed
-        if ext in [".dcm", ".dicom"]:
-            dicom_to_png(input_path, output_path)
-            image_path = output_path
-            with open(output_path, "rb") as f:
-                original_stream = io.BytesIO(f.read())
-        else:
-            image_path = input_path
-            original_stream = io.BytesIO(content)
-
-        results = predict(image_path, model)
-        if results['boxes']:
-            results = classify(image_path, results, classifier)
-            response = process_predictions(image_path, results, pixel_spacing_value)
-            return JSONResponse(content=response)
-
-        return {
-            "status": "success",
-            "detections": False,
-            "full_Normal_image": convert_image_to_base64(original_stream)
-        }
+        return await app.state.inference_pool.run(fn, *args)
+    except PoolFullError:
+        raise HTTPException(
+            503,
+            "Server is busy, please retry later.",
+            headers={"Retry-After": str(settings.inference_retry_after)}
+        )
     except Exception as e:
         raise HTTPException(500, str(e))
-    finally:
-        for path in (input_path, output_path):
-            if os.path.exists(path):
-                os.remove(path)
+
+async def infer_upload(content, ext: str, pixel_spacing):
+    """
+    Prediction for one upload through the result cache and the inference pool.
+    Returns the payload, the stage timings and whether the cache was hit.
+    """
+    start = time.perf_counter()
+    key, cached = await cached_result(content, ext)
+    payload, timings, cache_entry = await run_inference(run_prediction, content, ext, pixel_spacing, cached)
+    if key is not None and cache_entry is not None:
+        await asyncio.to_thread(app.state.result_cache.put, key, cache_entry)
+
+    # Time spent hashing and waiting for a free worker
+    timings["queue"] = max(0.0, (time.perf_counter() - start) * 1000 - timings["pipeline"])
+    return payload, timings, cached is not None
+
+async def format_response(request: Request, payload, response_format: str, excluded):
+    # Encoding and serializing the images is CPU work, keep it off the event loop
+    return await asyncio.to_thread(
+        build_response, payload, response_format, excluded, app.state.artifacts,
+        lambda artifact_id: str(request.url_for("get_artifact", artifact_id=artifact_id))
+    )
+
+@app.post("/predict")
+async def predict_api(
+    request: Request,
+    file: UploadFile = File(...),
+    pixel_spacing: str = Form(None, description="mm per pixel, optional for DICOM files (read from their header)"),
+    format: str = Query(None, description="json (base64 images, default), multipart or refs (artifact URLs)"),
+    exclude: str = Query(None, description="Comma-separated image fields to leave out, e.g. full_Normal_image,image")
+):
+    print("Received file:", file.filename)
+
+    response_format, excluded = parse_response_options(request, format, exclude)
+    pixel_spacing_value = parse_pixel_spacing(pixel_spacing)
+    ext = upload_extension(file)
+    require_pixel_spacing(ext, pixel_spacing_value)
+    require_ready()
+
+    # Chunked read into a single buffer, no extra copies
+    start = time.perf_counter()
+    content = await read_upload(file, MAX_FILE_SIZE)
+    upload_ms = (time.perf_counter() - start) * 1000
+
+    payload, timings, cache_hit = await infer_upload(content, ext, pixel_spacing_value)
+    timings = {"upload_read": upload_ms, **timings}
+
+    if isinstance(payload, JSONResponse):
+        # Processing error, already formatted
+        response = payload
+    else:
+        start = time.perf_counter()
+        response = await format_response(request, payload, response_format, excluded)
+        timings["response_encode"] = (time.perf_counter() - start) * 1000
+
+    if app.state.result_cache is not None:
+        response.headers["X-Cache"] = "hit" if cache_hit else "miss"
+    finish_timings(request, response, timings)
+    return response
+
+@app.post("/predict/batch")
+async def predict_batch_api(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    pixel_spacing: List[str] = Form(None, description="mm per pixel, empty for DICOM files to use their header"),
+    format: str = Query(None, description="json (base64 images, default), multipart or refs (artifact URLs)"),
+    exclude: str = Query(None, description="Comma-separated image fields to leave out, e.g. full_Normal_image,image")
+):
+    """
+    A study (e.g. CC and MLO views of both breasts) in one call: one pixel
+    spacing per file (or a single one for all), one inference slot, batched
+    detector and classifier. Returns per-image results and a study summary.
+    """
+    print("Received study:", [file.filename for file in files])
+
+    response_format, excluded = parse_response_options(request, format, exclude)
+    if len(files) > MAX_STUDY_IMAGES:
+        raise HTTPException(400, f"A study has at most {MAX_STUDY_IMAGES} images.")
+    if not pixel_spacing:
+        pixel_spacing = [""]
+    if len(pixel_spacing) == 1:
+        pixel_spacing = pixel_spacing * len(files)
+    if len(pixel_spacing) != len(files):
+        raise HTTPException(400, "Give one pixel spacing per file, or a single one for all files.")
+    spacings = [parse_pixel_spacing(value) for value in pixel_spacing]
+    extensions = [upload_extension(file) for file in files]
+    for ext, spacing in zip(extensions, spacings):
+        require_pixel_spacing(ext, spacing)
+    require_ready()
+
+    start = time.perf_counter()
+    contents = await read_uploads(files, MAX_FILE_SIZE, MAX_STUDY_SIZE)
+    upload_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    keys, cached = zip(*[await cached_result(content, ext) for content, ext in zip(contents, extensions)])
+    payloads, timings, cache_entries = await run_inference(
+        run_study, list(zip(contents, extensions, spacings, cached))
+    )
+    timings = {"upload_read": upload_ms, **timings}
+    timings["queue"] = max(0.0, (time.perf_counter() - start) * 1000 - timings["pipeline"])
+
+    images = []
+    for file, payload in zip(files, payloads):
+        if isinstance(payload, JSONResponse):
+            # Processing error of this image only
+            images.append({"filename": file.filename, "status": "error", **json.loads(payload.body)})
+        else:
+            images.append({"filename": file.filename, **payload})
+    start = time.perf_counter()
+    response = await format_response(request, {
+        "status": "success",
+        "study": study_summary(payloads),
+        "images": images
+    }, response_format, excluded)
+    timings["response_encode"] = (time.perf_counter() - start) * 1000
+
+    cache = app.state.result_cache
+    if cache is not None:
+        for key, cache_entry in zip(keys, cache_entries):
+            if cache_entry is not None:
+                await asyncio.to_thread(cache.put, key, cache_entry)
+        response.headers["X-Cache"] = ",".join("hit" if entry is not None else "miss" for entry in cached)
+
+    finish_timings(request, response, timings)
+    return response
+
+async def process_job(job_id: str, upload_path: str, ext: str, pixel_spacing, callback_url: str = None,
+                      status_url: str = None):
+    """Run a queued /jobs prediction, waiting for the models and for room in the inference pool."""
+    store = app.state.job_store
+    await asyncio.to_thread(store.update, job_id, status="running")
+    try:
+        content = await asyncio.to_thread(store.load_upload, upload_path)
+        while True:
+            if getattr(app.state, "load_error", None):
+                raise RuntimeError(f"Models failed to load: {app.state.load_error}")
+            if not getattr(app.state, "ready", False):
+                await asyncio.sleep(settings.inference_retry_after)
+                continue
+            try:
+                payload, timings, _ = await infer_upload(content, ext, pixel_spacing)
+                break
+            except HTTPException as e:
+                if e.status_code != 503:
+                    raise RuntimeError(e.detail)
+                # Inference pool busy: the job waits instead of failing
+                await asyncio.sleep(settings.inference_retry_after)
+
+        if isinstance(payload, JSONResponse):
+            await asyncio.to_thread(store.update, job_id, status="error", error=json.loads(payload.body)["message"])
+        else:
+            observe_timings(timings)
+            await asyncio.to_thread(store.update, job_id, status="done", result=payload, timings=timings)
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        await asyncio.to_thread(store.update, job_id, status="error", error=str(e))
+
+    if callback_url:
+        job = await asyncio.to_thread(store.get, job_id)
+        await asyncio.to_thread(notify_callback, callback_url, {
+            "job_id": job_id,
+            "status": job["status"] if job else "error",
+            "status_url": status_url
+        }, allowed_hosts=callback_hosts())
+
+def callback_hosts():
+    """Hosts /jobs callbacks may reach (JOB_CALLBACK_HOSTS), empty for any public host."""
+    return tuple(host.strip().lower() for host in settings.job_callback_hosts.split(",") if host.strip())
+
+async def job_worker():
+    """Background consumer of the /jobs queue."""
+    queue = app.state.job_queue
+    while True:
+        job = await queue.get()
+        try:
+            await process_job(*job)
+        finally:
+            queue.task_done()
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    request: Request,
+    file: UploadFile = File(...),
+    pixel_spacing: str = Form(None, description="mm per pixel, optional for DICOM files (read from their header)"),
+    callback_url: str = Form(None)
+):
+    """
+    Queue a prediction and return its job ID right away; poll GET /jobs/{id}
+    or pass a `callback_url` that is POSTed to when the job finishes.
+    """
+    print("Received job file:", file.filename)
+
+    pixel_spacing_value = parse_pixel_spacing(pixel_spacing)
+    ext = upload_extension(file)
+    require_pixel_spacing(ext, pixel_spacing_value)
+    if callback_url:
+        try:
+            await asyncio.to_thread(check_callback_url, callback_url, callback_hosts())
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+    if app.state.job_queue.full():
+        raise HTTPException(
+            503,
+            "Job queue is full, please retry later.",
+            headers={"Retry-After": str(settings.inference_retry_after)}
+        )
+
+    content = await read_upload(file, MAX_FILE_SIZE)
+    job_id = await asyncio.to_thread(app.state.job_store.create, filename=file.filename)
+    status_url = str(request.url_for("get_job", job_id=job_id))
+    # Queued jobs keep their upload on disk, not in memory
+    upload_path = await asyncio.to_thread(app.state.job_store.save_upload, job_id, content)
+    try:
+        app.state.job_queue.put_nowait((job_id, upload_path, ext, pixel_spacing_value, callback_url, status_url))
+    except asyncio.QueueFull:
+        await asyncio.to_thread(os.remove, upload_path)
+        await asyncio.to_thread(app.state.job_store.update, job_id, status="error", error="Job queue is full")
+        raise HTTPException(
+            503,
+            "Job queue is full, please retry later.",
+            headers={"Retry-After": str(settings.inference_retry_after)}
+        )
+    return {"job_id": job_id, "status": "queued", "status_url": status_url}
+
+@app.get("/jobs/{job_id}", name="get_job")
+async def get_job(
+    request: Request,
+    job_id: str,
+    format: str = Query(None, description="json (base64 images, default), multipart or refs (artifact URLs)"),
+    exclude: str = Query(None, description="Comma-separated image fields to leave out, e.g. full_Normal_image,image")
+):
+    """Status of a job, with its result (formatted like /predict) once done."""
+    response_format, excluded = parse_response_options(request, format, exclude)
+    job = await asyncio.to_thread(app.state.job_store.get, job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown or expired job")
+
+    body = {key: job[key] for key in ("job_id", "status", "filename", "created_at", "updated_at", "expires_at")}
+    if job["status"] == "error":
+        body["error"] = job.get("error")
+    if job["status"] != "done":
+        return body
+    response = await format_response(request, {**body, "result": job["result"]}, response_format, excluded)
+    response.headers["Server-Timing"] = format_server_timing(job["timings"])
+    return response
 
 # Email data model
 class EmailData(BaseModel):
@@ -117,6 +529,8 @@ async def send_email_endpoint(
     email_data: EmailData,
     settings: Settings = Depends(get_settings)
 ):
+    if not settings.email or not settings.password:
+        raise HTTPException(503, "Email is not configured on this server.")
     try:
         # Prepare email content
         body_text = (
@@ -127,23 +541,24 @@ async def send_email_endpoint(
             f"Message:\n{email_data.message}\n"
         )
 
-        # Send and reply
-        send_email(
+        # Queue the message and the reply, the outbox sends them in the background
+        outbox = app.state.outbox
+        await asyncio.to_thread(outbox.enqueue, build_contact_email(
             subject=email_data.subject,
             email=email_data.email,
             name=email_data.name,
             message=email_data.message,
             body=body_text,
-            settings=settings,
-            recipient_email=settings.email
-        )
-        reply_email(
+            recipient_email=settings.email,
+            sender_email=settings.email
+        ), settings.email)
+        await asyncio.to_thread(outbox.enqueue, build_reply_email(
             subject=email_data.subject,
             email=email_data.email,
             name=email_data.name,
             message=email_data.message,
-            settings=settings
-        )
+            sender_email=settings.email
+        ), email_data.email)
 
         return {"status": "success", "message": "Email processed"}
     except Exception as e:
@@ -0,0 +1,74 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Served on /metrics. Batch sizes are observed in the process running the
+# models: with INFERENCE_EXECUTOR=process only the stage timings (sent back
+# with every result) and the gauges below reach the server's registry.
+# With PROMETHEUS_MULTIPROC_DIR set (serve.py), the series of every HTTP
+# worker and of the inference server are aggregated.
+STAGE_SECONDS = Histogram(
+    "safescan_stage_seconds", "Wall time of each inference stage", ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+REQUEST_SECONDS = Histogram(
+    "safescan_request_seconds", "Wall time of each HTTP request", ["method", "route"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+REQUESTS = Counter("safescan_requests", "HTTP requests by route and status", ["method", "route", "status"])
+DETECTOR_BATCH_SIZE = Histogram(
+    "safescan_detector_batch_size", "Images per detector forward pass", buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32)
+)
+CLASSIFIER_BATCH_SIZE = Histogram(
+    "safescan_classifier_batch_size", "Lesion crops per feature extraction batch", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+FEATURE_CACHE_LOOKUPS = Counter("safescan_feature_cache_lookups", "Classifier crops looked up in the feature cache",
+                                ["result"])
+INFERENCE_PENDING = Gauge("safescan_inference_pending", "Inference jobs running or waiting for a worker",
+                          multiprocess_mode="livesum")
+INFERENCE_CAPACITY = Gauge("safescan_inference_capacity", "Inference jobs admitted before answering 503",
+                           multiprocess_mode="livemax")
+JOB_QUEUE_DEPTH = Gauge("safescan_job_queue_depth", "Queued /jobs predictions", multiprocess_mode="livesum")
+OUTBOX_PENDING = Gauge("safescan_outbox_pending", "Emails waiting in the outbox", multiprocess_mode="livesum")
+# Every worker reports the same shared models, so the maximum is the memory held once
+MODEL_MEMORY = Gauge("safescan_model_memory_bytes", "Weight memory of each loaded model", ["model"],
+                     multiprocess_mode="livemax")
+THREAD_ALLOCATION = Gauge("safescan_threads", "Threads used by each library in an inference worker", ["library"],
+                          multiprocess_mode="livemax")
+
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    """Accumulate the wall time of a block (in ms) under `stage`. No-op if `timings` is None."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def observe_timings(timings: dict):
+    """Record the stage timings (ms) of one request in the stage histograms."""
+    for stage, duration in timings.items():
+        STAGE_SECONDS.labels(stage).observe(duration / 1000)
+
+
+def render_metrics():
+    """Body and content type of the /metrics response."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Drop the live gauges of this process from the multi-process series when it exits."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
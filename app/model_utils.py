@@ -2,19 +2,88 @@ import torch
 from torchvision.models.detection import maskrcnn_resnet50_fpn
 from PIL import Image
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 import numpy as np
 import torchvision.transforms as T
 import torchvision
 from torchvision.models.detection import MaskRCNN
 from torchvision.models.detection.backbone_utils import BackboneWithFPN
 from torchvision.ops.feature_pyramid_network import LastLevelMaxPool
+import cv2
+from image_processing import ScaleMap, load_rgb_image
+from metrics import DETECTOR_BATCH_SIZE, timed
 transform = T.Compose([
             T.ToTensor(),
         ])
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-def load_model():
+
+
+@dataclass
+class Detections:
+    """
+    Detector output for one image, passed as-is from predict to classify and
+    process_predictions. masks[i] is a boolean array covering boxes[i] only.
+    """
+    boxes: np.ndarray  # (N, 4) int64 [x_min, y_min, x_max, y_max], inclusive
+    labels: np.ndarray  # (N,) class ids
+    scores: np.ndarray  # (N,) confidence scores
+    masks: list  # N boolean arrays cropped to their box
+    image_size: tuple  # (height, width) of the image the boxes refer to
+    classification: list = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @classmethod
+    def empty(cls, image_size):
+        return cls(np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.int64),
+                   np.zeros(0, dtype=np.float32), [], tuple(image_size))
+
+    @classmethod
+    def from_full_masks(cls, masks, labels, scores, boxes):
+        """Build from full-resolution (N, H, W) masks, keeping only each box's crop."""
+        crops = [mask[y1:y2 + 1, x1:x2 + 1] > 0.5 for mask, (x1, y1, x2, y2) in zip(masks, boxes)]
+        return cls(np.asarray(boxes, dtype=np.int64), np.asarray(labels), np.asarray(scores),
+                   crops, tuple(masks.shape[-2:]))
+
+    def full_mask(self, i) -> np.ndarray:
+        """Mask i pasted into a zero uint8 array of the full image size."""
+        full = np.zeros(self.image_size, dtype=np.uint8)
+        x1, y1, x2, y2 = self.boxes[i]
+        full[y1:y2 + 1, x1:x2 + 1] = self.masks[i]
+        return full
+
+    def subset(self, keep):
+        """Detections selected by a boolean array, classification included."""
+        keep = np.asarray(keep, dtype=bool)
+        return Detections(
+            self.boxes[keep], self.labels[keep], self.scores[keep],
+            [mask for mask, k in zip(self.masks, keep) if k], self.image_size,
+            [cls for cls, k in zip(self.classification, keep) if k]
+        )
+
+
+DETECTOR_BACKENDS = ("eager", "torchscript", "onnx")
+DETECTOR_CHECKPOINT = os.path.join("models", "MaskRcnn_bestmapkmeans.pth")
+
+def detector_export_path(backend: str, quantize: bool = False) -> str:
+    """Default location of an exported detector (see export_models.py detector)."""
+    suffix = ".int8" if quantize else ""
+    extension = {"torchscript": ".torchscript.pt", "onnx": ".onnx"}[backend]
+    return os.path.join("models", f"MaskRcnn{suffix}{extension}")
+
+def build_model(checkpoint: str = DETECTOR_CHECKPOINT):
+    """
+    Build the ConvNeXt-FPN Mask R-CNN and restore the trained checkpoint (eager fp32).
+    checkpoint=None keeps random weights (benchmarks without the trained model).
+    """
     print("loading seg model ...")
-    convnext = torchvision.models.convnext_tiny(weights='IMAGENET1K_V1')
+    # No ImageNet download: every backbone weight is restored from the checkpoint below
+    convnext = torchvision.models.convnext_tiny(weights=None)
     
     # 2. Identify feature layers for FPN
     return_layers = {
@@ -58,65 +127,260 @@ def load_model():
         (0.5,1.0,2.0),
         ] * len(model.rpn.anchor_generator.sizes)
 
-    model.load_state_dict(torch.load(os.path.join("models","MaskRcnn_bestmapkmeans.pth"), map_location=device))
+    if checkpoint is not None:
+        model.load_state_dict(torch.load(checkpoint, map_location=device))
     
     return model.to(device)
 
-def predict(image_path: str, model):
+def quantize_backbone(model):
+    """
+    Dynamic int8 quantization of the ConvNeXt backbone. Its pointwise convolutions
+    are nn.Linear layers, which carry most of the backbone FLOPs. CPU only.
+    """
+    model.backbone = torch.ao.quantization.quantize_dynamic(
+        model.cpu().backbone, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return model
+
+class ScriptedDetector:
+    """TorchScript detector with the eager call convention (scripted R-CNNs return (losses, detections))."""
+
+    def __init__(self, path):
+        self.module = torch.jit.load(path, map_location=device)
+        self.module.eval()
+
+    def eval(self):
+        return self
+
+    def __call__(self, images):
+        return self.module(images)[1]
+
+class OnnxDetector:
+    """ONNX Runtime detector (CPU) with the eager call convention, one image per run."""
+
+    def __init__(self, path):
+        import onnxruntime as ort  # Optional dependency, only needed for this backend
+
+        self.session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    def __call__(self, images):
+        outputs = []
+        for image in images:
+            boxes, labels, scores, masks = self.session.run(None, {self.input_name: image.cpu().numpy()})
+            outputs.append({
+                "boxes": torch.from_numpy(boxes),
+                "labels": torch.from_numpy(labels),
+                "scores": torch.from_numpy(scores),
+                "masks": torch.from_numpy(masks),
+            })
+        return outputs
+
+def load_model(backend: str = "eager", quantize: bool = False, path: str = None):
+    """
+    Load the detector for serving.
+    backend: "eager" (PyTorch module), "torchscript" or "onnx" (artifacts from export_models.py).
+    quantize: eager models are int8-quantized on load, exported ones load the .int8 artifact.
+    """
+    if backend == "eager":
+        model = build_model()
+        if quantize:
+            if device.type != "cpu":
+                print("Dynamic quantization runs on CPU only, keeping the fp32 detector")
+            else:
+                model = quantize_backbone(model)
+        return model
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend: {backend} (expected one of {DETECTOR_BACKENDS})")
+
+    path = path or detector_export_path(backend, quantize)
+    print(f"loading {backend} seg model from {path} ...")
+    if backend == "torchscript":
+        return ScriptedDetector(path)
+    return OnnxDetector(path)
+
+class DetectorBatcher:
+    """
+    Collects concurrent detector calls for up to `max_wait_ms` and runs them
+    through the model as one batched list of tensors.
+    """
+
+    def __init__(self, model, max_batch_size: int = 4, max_wait_ms: float = 10):
+        self.model = model
+        self.model.eval()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="detector-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, img_tensor) -> Future:
+        """Queue a single CHW image tensor, the future resolves to its prediction dict."""
+        future = Future()
+        self._queue.put((img_tensor, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        tensors = [img_tensor for img_tensor, _ in batch]
+        DETECTOR_BATCH_SIZE.observe(len(tensors))
+        try:
+            with torch.no_grad():
+                outputs = self.model(tensors)
+        except Exception as e:
+            print(f"Error during batched inference: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
+
+
+def predict(image, model, batcher: DetectorBatcher = None) -> Detections:
+    """Run the detector on an image path or a decoded RGB array."""
+    return predict_batch([image], model, batcher)[0]
+
+
+def predict_batch(images, model, batcher: DetectorBatcher = None, timings: dict = None) -> list:
+    """
+    Run the detector on several images (paths or decoded RGB arrays) in one
+    forward pass, or through the batcher. Returns one Detections per image.
+    Stage times (ms) are added to `timings` if given.
+    """
     model.eval()
-    merged_masks = []
-    merged_labels = []
-    merged_scores = []
-    merged_boxes = []
-    # Preprocess image
+    # Preprocess images
     try:
-        img = Image.open(image_path).convert("RGB")
+        imgs = [load_rgb_image(image) for image in images]
 
     except Exception as e:
         print(f"Error during loading from local: {e}")
         raise
-    # Ensure image is on the correct device
+    # Ensure images are on the correct device
 
-    img_tensor = transform(img).unsqueeze(0).to(device)  # Move tensor to the correct device
-    print(f"Image tensor moved to device: {device}")
+    img_tensors = [transform(img).to(device) for img in imgs]  # Move tensors to the correct device
     # Inference
-    print(f"Performing inference on device: {device}")
     try:
-        with torch.no_grad():
-            prediction = model(img_tensor)
+        with timed(timings, "detector_forward"):
+            if batcher is not None:
+                # Shares forward passes with other concurrent requests
+                futures = [batcher.submit(img_tensor) for img_tensor in img_tensors]
+                prediction = [future.result() for future in futures]
+            else:
+                DETECTOR_BATCH_SIZE.observe(len(img_tensors))
+                with torch.no_grad():
+                    prediction = model(img_tensors)
     except Exception as e:
-        print(f"Error during inference: {e}")
+        print(f"Error during inference on {device}: {e}")
         raise
-    print('Inference completed successfully')
 
+    with timed(timings, "mask_merge"):
+        return [to_detections(output, img.shape[:2]) for output, img in zip(prediction, imgs)]
+
+
+# Classes kept from the tiled high-resolution pass (label 1 is 'calc', see
+# image_processing.CUSTOM_CLASSES): masses are already found at working resolution
+TILED_LABELS = (1,)
+
+
+def tile_origins(height: int, width: int, tile_size: int, overlap: int) -> list:
+    """(y, x) corners of tile_size tiles covering the image, neighbours overlapping by at least `overlap`."""
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        step = max(tile_size - overlap, 1)
+        count = int(np.ceil((length - tile_size) / step)) + 1
+        return [min(i * step, length - tile_size) for i in range(count)]
+    return [(y, x) for y in starts(height) for x in starts(width)]
+
+
+def predict_tiled(image, model, tile_size: int, overlap: int = 128, scale_map: ScaleMap = None,
+                  labels=TILED_LABELS, batcher: DetectorBatcher = None, tiles_per_batch: int = 2,
+                  timings: dict = None) -> Detections:
+    """
+    High-resolution pass for small lesions: run the detector on overlapping
+    tiles of the full-resolution image, keep the `labels` classes and map
+    them to the working resolution of `scale_map`. Lesions split by a tile
+    border or found in two tiles are merged.
+    """
+    image = load_rgb_image(image)
+    height, width = image.shape[:2]
+    scale_map = scale_map or ScaleMap((height, width), (height, width))
+    out_height, out_width = scale_map.working_size
+
+    origins = tile_origins(height, width, tile_size, overlap)
+    masks, mask_labels, scores = [], [], []
+    for start in range(0, len(origins), tiles_per_batch):
+        chunk = origins[start:start + tiles_per_batch]
+        tiles = [np.ascontiguousarray(image[y:y + tile_size, x:x + tile_size]) for y, x in chunk]
+        for origin, detections in zip(chunk, predict_batch(tiles, model, batcher, timings)):
+            for i in np.nonzero(np.isin(detections.labels, labels))[0]:
+                x1, y1, x2, y2 = scale_map.to_working_box(detections.boxes[i], origin)
+                crop = cv2.resize(detections.masks[i].astype(np.float32), (x2 - x1 + 1, y2 - y1 + 1),
+                                  interpolation=cv2.INTER_AREA)
+                # Keep lesions a few pixels wide from vanishing when downscaled
+                crop_mask = crop > 0.25
+                if not crop_mask.any():
+                    crop_mask.flat[crop.argmax()] = True
+                full = np.zeros((out_height, out_width), dtype=bool)
+                full[y1:y2 + 1, x1:x2 + 1] = crop_mask
+                masks.append(full)
+                mask_labels.append(detections.labels[i])
+                scores.append(detections.scores[i])
+
+    if not masks:
+        return Detections.empty((out_height, out_width))
+    return Detections.from_full_masks(*merge_overlapping_masks(np.stack(masks), mask_labels, scores, iou_threshold=0.0))
+
+
+def merge_detections(*parts) -> Detections:
+    """Union of several Detections of the same image, overlapping masks of the same class merged."""
+    image_size = parts[0].image_size
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return Detections.empty(image_size)
+    if len(parts) == 1:
+        return parts[0]
+    masks = np.stack([part.full_mask(i) for part in parts for i in range(len(part))])
+    labels = np.concatenate([part.labels for part in parts])
+    scores = np.concatenate([part.scores for part in parts])
+    return Detections.from_full_masks(*merge_overlapping_masks(masks, labels, scores, iou_threshold=0.0))
 
+
+def to_detections(output, image_size, confidence_threshold=0.5) -> Detections:
+    """Threshold and merge one raw detector output into Detections."""
     try:
-        confidence_threshold = 0.5
-        high_conf_indices = prediction[0]['scores'] > confidence_threshold
-        
-        if high_conf_indices.any():
-            pred_boxes = prediction[0]['boxes'][high_conf_indices].cpu().numpy()
-            pred_labels = prediction[0]['labels'][high_conf_indices].cpu().numpy()
-            pred_masks = prediction[0]['masks'][high_conf_indices].cpu().numpy()
-            pred_scores = prediction[0]['scores'][high_conf_indices].cpu().numpy()
-
-            # Merge only overlapping masks of same class
-            merged_masks, merged_labels, merged_scores,merged_boxes = merge_overlapping_masks(
-                pred_masks, pred_labels, pred_scores, iou_threshold=0.0
-            )
-        
-        if (len(merged_boxes)>0):
-        # Format results
-            return {
-                "boxes": merged_boxes.tolist(),
-                "labels": merged_labels.tolist(),
-                "scores": merged_scores.tolist(),
-                "masks": merged_masks.tolist(),
-            }
-        return { "boxes":[],
-                "labels": [],
-                "scores": [],
-                "masks": []}
+        high_conf_indices = output['scores'] > confidence_threshold
+
+        if not high_conf_indices.any():
+            return Detections.empty(image_size)
+
+        pred_boxes = output['boxes'][high_conf_indices].cpu().numpy()
+        pred_labels = output['labels'][high_conf_indices].cpu().numpy()
+        pred_masks = output['masks'][high_conf_indices].cpu().numpy()
+        pred_scores = output['scores'][high_conf_indices].cpu().numpy()
+
+        # Merge only overlapping masks of same class
+        merged_masks, merged_labels, merged_scores,merged_boxes = merge_overlapping_masks(
+            pred_masks, pred_labels, pred_scores, iou_threshold=0.0
+        )
+
+        return Detections.from_full_masks(merged_masks, merged_labels, merged_scores, merged_boxes)
     except Exception as e:
             print(f"Error during merging masks: {e}")
             raise
@@ -139,54 +403,104 @@ def mask_to_box(mask):
     x_max = np.max(pos[1])
     return [x_min, y_min, x_max, y_max]
 
+def masks_to_boxes(binary_masks):
+    """
+    Vectorized mask_to_box for a stack of binary masks (N, H, W).
+    Returns an (N, 4) int64 array of [x_min, y_min, x_max, y_max] and a
+    boolean array flagging empty masks (their box is [0, 0, 0, 0]).
+    """
+    rows = binary_masks.any(axis=2)
+    cols = binary_masks.any(axis=1)
+    empty = ~rows.any(axis=1)
+
+    height, width = binary_masks.shape[1:]
+    boxes = np.stack([
+        cols.argmax(axis=1),
+        rows.argmax(axis=1),
+        width - 1 - cols[:, ::-1].argmax(axis=1),
+        height - 1 - rows[:, ::-1].argmax(axis=1)
+    ], axis=1).astype(np.int64)
+    boxes[empty] = 0
+    return boxes, empty
+
+def pairwise_mask_iou(binary_masks, boxes, empty, labels=None):
+    """
+    IoU matrix between binary masks. Intersections are only counted for pairs
+    whose bounding boxes overlap (and share a label, if given), on the crop of
+    that overlap.
+    """
+    n = len(binary_masks)
+    areas = binary_masks.reshape(n, -1).sum(axis=1)
+    iou = np.zeros((n, n), dtype=np.float64)
+
+    # Box intersections of every pair (inclusive coordinates)
+    ix1 = np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    iy1 = np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    ix2 = np.minimum(boxes[:, None, 2], boxes[None, :, 2])
+    iy2 = np.minimum(boxes[:, None, 3], boxes[None, :, 3])
+    overlapping = (ix1 <= ix2) & (iy1 <= iy2) & ~empty[:, None] & ~empty[None, :]
+    if labels is not None:
+        overlapping &= labels[:, None] == labels[None, :]
+
+    for i, j in zip(*np.nonzero(np.triu(overlapping, k=1))):
+        window = (slice(iy1[i, j], iy2[i, j] + 1), slice(ix1[i, j], ix2[i, j] + 1))
+        intersection = np.count_nonzero(binary_masks[i][window] & binary_masks[j][window])
+        iou[i, j] = iou[j, i] = intersection / (areas[i] + areas[j] - intersection)
+
+    # Two empty masks have an undefined IoU, which never passes a threshold
+    iou[empty[:, None] & empty[None, :]] = np.nan
+    return iou
+
 def merge_overlapping_masks(masks, labels, scores, iou_threshold=0.0):
     """
     Merge overlapping masks of the same class based on IoU threshold.
     Returns merged masks, labels, scores, and bounding boxes.
     """
-    print("here")
     if len(masks) == 0:
         return np.array([]), np.array([]), np.array([]), np.array([])
 
-    binary_masks = [(mask.squeeze() > 0.5).astype(np.float32) for mask in masks]
-    binary_masks = np.stack(binary_masks)
+    binary_masks = np.asarray(masks).reshape(len(masks), *np.shape(masks)[-2:]) > 0.5
+    labels = np.asarray(labels)
+    scores = np.asarray(scores)
+
+    boxes, empty = masks_to_boxes(binary_masks)
+    iou = pairwise_mask_iou(binary_masks, boxes, empty, labels)
+    with np.errstate(invalid='ignore'):
+        mergeable = (iou > iou_threshold) & (labels[:, None] == labels[None, :])
 
     merged_masks = []
     merged_labels = []
     merged_scores = []
     merged_boxes = []
-    used_indices = set()
+    used = np.zeros(len(binary_masks), dtype=bool)
 
     for i in range(len(binary_masks)):
-        if i in used_indices:
+        if used[i]:
             continue
 
-        current_mask = binary_masks[i]
-        current_label = labels[i]
-        current_score = scores[i]
-        merge_candidates = [i]
+        # Same greedy rule as before: later, unused masks overlapping mask i
+        candidates = np.concatenate([[i], i + 1 + np.nonzero(mergeable[i, i + 1:] & ~used[i + 1:])[0]])
+        used[candidates] = True
 
-        for j in range(i + 1, len(binary_masks)):
-            if (j not in used_indices and
-                labels[j] == current_label and
-                calculate_iou(current_mask, binary_masks[j]) > iou_threshold):
-                merge_candidates.append(j)
+        if len(candidates) > 1:
+            combined_mask = binary_masks[candidates].any(axis=0)
+            max_score = scores[candidates].max()
+        else:
+            combined_mask = binary_masks[i]
+            max_score = scores[i]
 
-        if len(merge_candidates) > 1:
-            combined_mask = np.max(binary_masks[merge_candidates], axis=0)
-            max_score = max(scores[merge_candidates])
+        # Box of the union is the hull of the members' boxes
+        members = candidates[~empty[candidates]]
+        if len(members):
+            combined_box = [boxes[members, 0].min(), boxes[members, 1].min(),
+                            boxes[members, 2].max(), boxes[members, 3].max()]
         else:
-            combined_mask = current_mask
-            max_score = current_score
+            combined_box = [0, 0, 0, 0]
 
         merged_masks.append(combined_mask)
-        merged_labels.append(current_label)
+        merged_labels.append(labels[i])
         merged_scores.append(max_score)
-        merged_boxes.append(mask_to_box(combined_mask))
-        used_indices.update(merge_candidates)
-
-    if len(merged_masks) > 0:
-        merged_masks = np.stack(merged_masks)
-    else:
-        merged_masks = []
-    return np.array(merged_masks), np.array(merged_labels), np.array(merged_scores), np.array(merged_boxes)
+        merged_boxes.append(combined_box)
+
+    merged_masks = np.stack(merged_masks).astype(np.float32)
+    return merged_masks, np.array(merged_labels), np.array(merged_scores), np.array(merged_boxes, dtype=np.int64)
@@ -0,0 +1,174 @@
+import json
+import os
+import smtplib
+import threading
+import time
+import uuid
+
+from config import Settings
+from file_store import atomic_write, fcntl, try_lock
+from sendmail import smtp_connect
+
+# Lock files of the claimed outbox slots, held open for the life of the process
+_slot_locks = []
+
+
+def worker_outbox_path(path: str, max_slots: int = 64) -> str:
+    """
+    Outbox file of this process when several HTTP workers share OUTBOX_PATH:
+    the first slot not locked by another process (slot 0 is `path` itself,
+    slot k is `<name>.k<ext>`). Each file then has a single writer, and the
+    messages a stopped worker left behind are sent by the next one taking its slot.
+    """
+    if not path or fcntl is None:  # Windows: a single worker per outbox path
+        return path
+    root, ext = os.path.splitext(path)
+    for slot in range(max_slots):
+        slot_path = path if slot == 0 else f"{root}.{slot}{ext}"
+        lock = try_lock(slot_path + ".lock")
+        if lock is None:
+            continue
+        _slot_locks.append(lock)
+        return slot_path
+    raise RuntimeError(f"No free outbox slot for {path} ({max_slots} workers)")
+
+
+class Outbox:
+    """
+    Queue of outgoing emails sent by a background thread over one reused SMTP
+    connection. Pending messages are kept in memory, or in a JSON file at
+    `path` so they survive restarts; failed sends are retried with exponential
+    backoff and dropped after `max_attempts`. The connection is closed after
+    `idle_timeout` seconds without mail.
+    """
+
+    def __init__(self, settings: Settings, path: str = "", max_attempts: int = 5,
+                 backoff: float = 2.0, max_backoff: float = 300, idle_timeout: float = 60):
+        self.settings = settings
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self._pending = self._load()
+        self._server = None
+        self._last_used = 0.0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name="outbox", daemon=True)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read outbox {self.path}: {e}")
+            return []
+
+    def _save(self):
+        if not self.path:
+            return
+        atomic_write(self.path, self._pending, format="json")
+
+    def start(self):
+        self._thread.start()
+        if self._pending:
+            print(f"Outbox: {len(self._pending)} pending message(s) from a previous run")
+
+    def stop(self, timeout: float = 5):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def enqueue(self, msg, recipient: str) -> str:
+        """Queue an email.message.Message for `recipient`, return its outbox ID."""
+        item = {
+            "id": uuid.uuid4().hex,
+            "sender": msg["From"],
+            "recipient": recipient,
+            "message": msg.as_string(),
+            "attempts": 0,
+            "next_attempt_at": 0.0
+        }
+        with self._condition:
+            self._pending.append(item)
+            self._save()
+            self._condition.notify()
+        return item["id"]
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def _close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+
+    def _send(self, item):
+        # A connection the server dropped while idle is reopened once
+        for attempt in range(2):
+            if self._server is None:
+                self._server = smtp_connect(self.settings)
+            try:
+                self._server.sendmail(item["sender"], item["recipient"], item["message"])
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                if attempt:
+                    raise
+
+    def _next_due(self):
+        """The earliest pending message and how long until it is due."""
+        item = min(self._pending, key=lambda pending: pending["next_attempt_at"])
+        return item, item["next_attempt_at"] - time.time()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if self._pending:
+                        item, wait = self._next_due()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    if self._server is not None:
+                        idle = self.idle_timeout - (time.monotonic() - self._last_used)
+                        if idle <= 0:
+                            self._close()
+                        else:
+                            wait = idle if wait is None else min(wait, idle)
+                    self._condition.wait(wait)
+                if self._stopped:
+                    self._close()
+                    return
+
+            try:
+                self._send(item)
+                error = None
+            except Exception as e:
+                self._close()
+                error = e
+
+            with self._condition:
+                if error is None:
+                    self._pending.remove(item)
+                else:
+                    item["attempts"] += 1
+                    if item["attempts"] >= self.max_attempts:
+                        print(f"Outbox: giving up on message to {item['recipient']} after "
+                              f"{item['attempts']} attempts: {error}")
+                        self._pending.remove(item)
+                    else:
+                        delay = min(self.max_backoff, self.backoff * 2 ** (item["attempts"] - 1))
+                        print(f"Outbox: sending to {item['recipient']} failed ({error}), retrying in {delay:.1f} s")
+                        item["next_attempt_at"] = time.time() + delay
+                self._save()
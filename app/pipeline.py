@@ -0,0 +1,337 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from fastapi.responses import JSONResponse
+
+from dicom_utils import read_dicom
+from feature_cache import FeatureCache, weights_fingerprint
+from metrics import timed
+from runtime import ThreadBudget, apply_thread_budget, plan_thread_budget
+from model_utils import (
+    DetectorBatcher, DETECTOR_CHECKPOINT, detector_export_path, load_model, merge_detections, predict_batch,
+    predict_tiled
+)
+from image_processing import (
+    load_rgb_image, process_predictions, set_lesion_feature_workers, set_render_options, to_working_resolution
+)
+import classifier_utils
+from classifier_utils import (
+    classify_batch, extract_deep_features, load_classifier, load_feature_extractors, load_scaler, set_crop_mode,
+    set_feature_backend, set_feature_cache, CONVNEXT_WEIGHTS, DENSENET_WEIGHTS,
+    REDUCED_CLASSIFIER_PATH, SCALER_PATH, SVM_PATH
+)
+
+# Models used by the inference workers (loaded once per worker process)
+model = None
+classifier = None
+batcher = None
+dicom_windowing = "max"
+working_options = {"max_side": 0, "tile_size": 0, "tile_overlap": 128}
+startup_timings = {}
+
+
+def _load_feature_backend(feature_backend, feature_onnx_path, densenet_weights, convnext_weights):
+    if feature_backend != "onnx":
+        load_feature_extractors(densenet_weights, convnext_weights)
+    set_feature_backend(feature_backend, feature_onnx_path)
+    # Trace / initialize the backend now rather than on the first request
+    return extract_deep_features(np.zeros((1, 224, 224, 3), dtype=np.uint8)).shape[1]
+
+
+def model_init_options(settings) -> dict:
+    """init_models() arguments from the Settings, shared by the API and inference_server.py."""
+    return dict(
+        max_batch_size=settings.detector_max_batch_size,
+        max_wait_ms=settings.detector_max_wait_ms,
+        feature_backend=settings.feature_backend,
+        feature_onnx_path=settings.feature_onnx_path,
+        classifier_crop_mode=settings.classifier_crop_mode,
+        classifier_runtime=settings.classifier_runtime,
+        reduced_classifier_path=settings.reduced_classifier_path,
+        feature_cache_max_mb=settings.feature_cache_max_mb,
+        feature_cache_path=settings.feature_cache_path,
+        feature_cache_disk_mb=settings.feature_cache_disk_mb,
+        densenet_weights=settings.densenet_weights,
+        convnext_weights=settings.convnext_weights,
+        detector_backend=settings.detector_backend,
+        detector_quantize=settings.detector_quantize,
+        detector_path=settings.detector_path or None,
+        render_detection_view=settings.render_detection_view,
+        render_jpeg_quality=settings.render_jpeg_quality,
+        render_max_side=settings.render_max_side,
+        lesion_feature_workers=settings.lesion_feature_workers,
+        dicom_window=settings.dicom_windowing,
+        working_max_side=settings.working_max_side,
+        detector_tile_size=settings.detector_tile_size,
+        detector_tile_overlap=settings.detector_tile_overlap,
+        # The inference workers (threads or processes) split the cores between them
+        thread_budget=plan_thread_budget(
+            settings.inference_workers,
+            auto=settings.thread_budget,
+            torch_threads=settings.torch_threads,
+            torch_interop_threads=settings.torch_interop_threads,
+            tf_intra_op_threads=settings.tf_intra_op_threads,
+            tf_inter_op_threads=settings.tf_inter_op_threads,
+            cv2_threads=settings.cv2_threads
+        )
+    )
+
+
+def result_cache_namespace(settings) -> str:
+    """
+    Identifies the models and the options a cached /predict result depends on,
+    so a result cache (and its disk tier) never serves outputs of another setup.
+    """
+    if settings.detector_backend == "eager":
+        detector_weights = DETECTOR_CHECKPOINT
+    else:
+        detector_weights = settings.detector_path or detector_export_path(
+            settings.detector_backend, settings.detector_quantize
+        )
+    if settings.feature_backend == "onnx":
+        feature_weights = (settings.feature_onnx_path,)
+    else:
+        feature_weights = (settings.densenet_weights, settings.convnext_weights)
+    if settings.classifier_runtime == "reduced":
+        classifier_weights = (settings.reduced_classifier_path,)
+    else:
+        classifier_weights = (SVM_PATH, SCALER_PATH)
+    options = [
+        settings.detector_backend, settings.detector_quantize, settings.working_max_side,
+        settings.detector_tile_size, settings.detector_tile_overlap, settings.dicom_windowing,
+        settings.feature_backend, settings.classifier_runtime, settings.classifier_crop_mode,
+        settings.render_detection_view, settings.render_jpeg_quality, settings.render_max_side,
+        weights_fingerprint(detector_weights, *feature_weights, *classifier_weights),
+    ]
+    return "|".join(map(str, options))
+
+
+def init_models(max_batch_size: int = 1, max_wait_ms: float = 10,
+                feature_backend: str = "fused", feature_onnx_path: str = "models/feature_extractor.onnx",
+                classifier_crop_mode: str = "direct", classifier_runtime: str = "svm",
+                reduced_classifier_path: str = REDUCED_CLASSIFIER_PATH,
+                feature_cache_max_mb: int = 0, feature_cache_path: str = "", feature_cache_disk_mb: int = 2048,
+                densenet_weights: str = DENSENET_WEIGHTS, convnext_weights: str = CONVNEXT_WEIGHTS,
+                detector_backend: str = "eager", detector_quantize: bool = False, detector_path: str = None,
+                render_detection_view: str = "full", render_jpeg_quality: int = 95, render_max_side: int = 0,
+                lesion_feature_workers: int = 1, dicom_window: str = "max",
+                working_max_side: int = 0, detector_tile_size: int = 0, detector_tile_overlap: int = 128,
+                thread_budget: ThreadBudget = None):
+    """
+    Load the detector, the classifier, the scaler and the feature extractors in
+    parallel if they are not loaded yet. Returns the load time of each (ms).
+    With max_batch_size > 1, concurrent detector calls in this process are micro-batched.
+    working_max_side and detector_tile_size configure the working resolution
+    and the tiled calcification pass of run_study; thread_budget sizes the
+    thread pools of this process (runtime.plan_thread_budget). The feature_cache
+    arguments keep the deep features of the crops already classified;
+    classifier_runtime "reduced" loads reduced_classifier_path instead of the
+    scaler and the SVM.
+    """
+    global model, classifier, batcher, dicom_windowing
+    if model is not None:
+        return startup_timings
+    if thread_budget is not None:
+        apply_thread_budget(thread_budget)
+    set_render_options(render_detection_view, render_jpeg_quality, render_max_side)
+    set_lesion_feature_workers(lesion_feature_workers)
+    set_crop_mode(classifier_crop_mode)
+    dicom_windowing = dicom_window
+    working_options.update(max_side=working_max_side, tile_size=detector_tile_size, tile_overlap=detector_tile_overlap)
+
+    def load(name, fn, *args):
+        with timed(startup_timings, name):
+            return fn(*args)
+
+    with timed(startup_timings, "total"):
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="model-loader") as loader:
+            detector_job = loader.submit(load, "detector", load_model, detector_backend, detector_quantize, detector_path)
+            classifier_job = loader.submit(load, "classifier", load_classifier,
+                                           classifier_runtime, reduced_classifier_path)
+            # The reduced classifier carries its own scaling
+            scaler_job = loader.submit(load, "scaler", load_scaler) if classifier_runtime == "svm" else None
+            features_job = loader.submit(load, "feature_extractors", _load_feature_backend,
+                                         feature_backend, feature_onnx_path, densenet_weights, convnext_weights)
+            if scaler_job is not None:
+                scaler_job.result()
+            feature_dimension = features_job.result()
+            classifier = classifier_job.result()
+            model = detector_job.result()
+
+    if feature_cache_max_mb > 0 or feature_cache_path:
+        weights = (feature_onnx_path,) if feature_backend == "onnx" else (densenet_weights, convnext_weights)
+        set_feature_cache(FeatureCache(
+            feature_dimension,
+            max_bytes=feature_cache_max_mb * 1024 * 1024,
+            path=feature_cache_path or None,
+            disk_bytes=feature_cache_disk_mb * 1024 * 1024,
+            namespace=weights_fingerprint(*weights)
+        ))
+
+    if max_batch_size > 1:
+        batcher = DetectorBatcher(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    print("Startup: " + ", ".join(f"{name} {duration:.0f} ms" for name, duration in startup_timings.items()))
+    return startup_timings
+
+
+def _array_bytes(arrays) -> int:
+    return int(sum(np.prod(array.shape) * np.dtype(array.dtype).itemsize for array in arrays))
+
+
+def model_memory() -> dict:
+    """Bytes of weights held by each loaded model in this worker (for /metrics)."""
+    memory = {}
+    detector = getattr(model, "module", model)  # TorchScript wrapper
+    if hasattr(detector, "state_dict"):
+        memory["detector"] = sum(t.numel() * t.element_size() for t in detector.state_dict().values())
+    if classifier is not None:
+        memory["classifier"] = _array_bytes(v for v in vars(classifier).values() if isinstance(v, np.ndarray))
+    backbones = [m for m in (classifier_utils.model_densenet, classifier_utils.model_convnext) if m is not None]
+    if backbones:
+        memory["feature_extractors"] = _array_bytes(w for m in backbones for w in m.weights)
+    return memory
+
+
+def decode_upload(content: bytes, ext: str):
+    """
+    Decode an uploaded file (DICOM or PNG/JPEG) to an RGB array. Also returns
+    the pixel spacing (mm) of the DICOM header, None for other files.
+    """
+    if ext in [".dcm", ".dicom"]:
+        image, pixel_spacing = read_dicom(content, dicom_windowing)
+        return load_rgb_image(image), pixel_spacing
+    return load_rgb_image(content), None
+
+
+def run_prediction(content: bytes, ext: str, pixel_spacing: float, cached=None):
+    """
+    Run the full blocking inference pipeline on an uploaded file.
+    The upload is decoded once in memory and the array is shared by every stage.
+    `cached` is the cache entry of a previous run on the same bytes: detection,
+    classification and rendering are reused and only lesion features are recomputed.
+    A `pixel_spacing` of None is read from the DICOM header.
+    Returns the response payload (images as encoded bytes, or an error
+    JSONResponse), the per-stage timings (ms) and the cache entry to store for
+    this upload (None if nothing new should be cached).
+    """
+    payloads, timings, cache_entries = run_study([(content, ext, pixel_spacing, cached)])
+    return payloads[0], timings, cache_entries[0]
+
+
+def run_study(uploads):
+    """
+    run_prediction for the images of a study, given as (content, ext,
+    pixel_spacing, cached) tuples. Images that are not cached go through the
+    detector in one batch and their lesions through the classifier in one
+    batch. Returns the per-image payloads and cache entries, and the
+    timings (ms) of the whole study.
+    Each image is resized once to the working resolution (see init_models):
+    boxes, masks, rendered images and lesion features all refer to it, and
+    the payload's "working_resolution" maps it back to the upload.
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    with timed(timings, "decode"):
+        decoded = [decode_upload(content, ext) for content, ext, _, _ in uploads]
+    originals = [image for image, _ in decoded]
+    # Spacing sent by the client first, then the one of the DICOM header
+    spacings = [pixel_spacing if pixel_spacing is not None else header_spacing
+                for (_, _, pixel_spacing, _), (_, header_spacing) in zip(uploads, decoded)]
+    if working_options["max_side"]:
+        with timed(timings, "resize"):
+            working = [to_working_resolution(image, working_options["max_side"]) for image in originals]
+    else:
+        working = [to_working_resolution(image) for image in originals]
+    images = [image for image, _ in working]
+    scale_maps = [scale_map for _, scale_map in working]
+
+    results = [cached[0] if cached is not None else None for _, _, _, cached in uploads]
+    misses = [i for i, result in enumerate(results) if result is None and spacings[i] is not None]
+    if misses:
+        with timed(timings, "detect"):
+            detected = predict_batch([images[i] for i in misses], model, batcher, timings)
+        for i, result in zip(misses, detected):
+            results[i] = result
+        if working_options["tile_size"]:
+            with timed(timings, "detect_tiles"):
+                for i in misses:
+                    tiled = predict_tiled(originals[i], model, working_options["tile_size"],
+                                          working_options["tile_overlap"], scale_maps[i], batcher=batcher,
+                                          timings=timings)
+                    results[i] = merge_detections(results[i], tiled)
+        found = [i for i in misses if len(results[i])]
+        if found:
+            with timed(timings, "classify"):
+                classify_batch([images[i] for i in found], [results[i] for i in found], classifier, timings)
+    del originals, working
+
+    payloads, cache_entries = [], []
+    for (content, ext, _, cached), image, scale_map, pixel_spacing, result in zip(
+            uploads, images, scale_maps, spacings, results):
+        cache_entry = None
+        if pixel_spacing is None:
+            response = JSONResponse(status_code=400, content={
+                "message": "Pixel spacing is required: the file has no PixelSpacing or ImagerPixelSpacing."
+            })
+        elif len(result):
+            rendered = cached[1] if cached is not None else None
+            with timed(timings, "render"):
+                response = process_predictions(image, result, scale_map.working_spacing(pixel_spacing),
+                                               rendered=rendered, timings=timings)
+            # Failed rendering or classification is never cached
+            if not isinstance(response, JSONResponse) and cached is None \
+                    and len(result.classification) == len(result):
+                cache_entry = (result, response)
+        else:
+            if cached is None:
+                cache_entry = (result, None)
+            if ext in [".dcm", ".dicom"] or scale_map.scale != 1:
+                # DICOM (and resized) uploads are sent back as a PNG of the working image
+                _, buffer = cv2.imencode('.png', cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+                content = buffer.tobytes()
+            response = {
+                "status": "success",
+                "detections": False,
+                "full_Normal_image": content
+            }
+        if isinstance(response, dict):
+            response["pixel_spacing"] = pixel_spacing
+            if working_options["max_side"]:
+                response["working_resolution"] = scale_map.as_dict()
+        payloads.append(response)
+        cache_entries.append(cache_entry)
+
+    timings["pipeline"] = (time.perf_counter() - start) * 1000
+    return payloads, timings, cache_entries
+
+
+def study_summary(payloads) -> dict:
+    """Study-level counts over the per-image payloads of run_study."""
+    summary = {
+        "images": len(payloads),
+        "images_with_detections": 0,
+        "detections": 0,
+        "labels": {},
+        "classifications": {},
+        "max_score": None,
+        "malignant_images": []
+    }
+    for i, payload in enumerate(payloads):
+        if not isinstance(payload, dict):
+            continue  # Failed image
+        predictions = payload.get("individual_predictions", [])
+        if predictions:
+            summary["images_with_detections"] += 1
+        for prediction in predictions:
+            summary["detections"] += 1
+            summary["labels"][prediction["label"]] = summary["labels"].get(prediction["label"], 0) + 1
+            cls = prediction["classification"]
+            summary["classifications"][cls] = summary["classifications"].get(cls, 0) + 1
+            summary["max_score"] = max(summary["max_score"] or 0.0, prediction["score"])
+        if any(prediction["classification"] == "Malignant" for prediction in predictions):
+            summary["malignant_images"].append(i)
+    return summary
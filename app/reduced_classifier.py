@@ -0,0 +1,82 @@
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.linear_model import LogisticRegression
+from sklearn.random_projection import GaussianRandomProjection
+from sklearn.svm import SVC, LinearSVC
+
+PROJECTIONS = ("pca", "random")
+LIGHT_CLASSIFIERS = ("logistic", "linear-svm", "rbf-svm")
+
+
+def build_light_classifier(name: str, seed: int = 42):
+    if name == "logistic":
+        return LogisticRegression(C=1.0, class_weight="balanced", max_iter=5000)
+    if name == "linear-svm":
+        return LinearSVC(C=0.1, class_weight="balanced", max_iter=20000)
+    if name == "rbf-svm":
+        return SVC(kernel="rbf", C=6, gamma="scale", class_weight="balanced", random_state=seed)
+    raise ValueError(f"Unknown classifier: {name} (expected one of {LIGHT_CLASSIFIERS})")
+
+
+class ReducedClassifier:
+    """
+    Classifier on a few hundred projected values instead of the 87808 deep
+    features: StandardScaler, PCA (or a Gaussian random projection) and the
+    standardization of the projected values are fused into one float32
+    (features, components) matrix multiply, followed by a small classifier.
+    Takes the raw extract_deep_features vectors (it replaces scaler + SVM).
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classifier, info: dict = None):
+        self.weights = weights  # (feature dimension, components) float32
+        self.bias = bias  # (components,) float32
+        self.classifier = classifier
+        self.info = info or {}
+
+    @classmethod
+    def fit(cls, features, labels, components: int = 256, projection: str = "pca",
+            classifier: str = "logistic", seed: int = 42):
+        """Fit the scaler, the projection and the classifier on training features (N, D)."""
+        features = np.asarray(features, dtype=np.float32)
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1  # As StandardScaler for constant features
+        standardized = (features - mean) / scale
+
+        if projection == "pca":
+            fitted = PCA(n_components=components, svd_solver="randomized", random_state=seed).fit(standardized)
+            matrix, offset = fitted.components_.T, fitted.mean_
+        elif projection == "random":
+            fitted = GaussianRandomProjection(n_components=components, random_state=seed).fit(standardized)
+            matrix, offset = fitted.components_.T, np.zeros(features.shape[1])
+        else:
+            raise ValueError(f"Unknown projection: {projection} (expected one of {PROJECTIONS})")
+
+        # x -> ((x - mean) / scale - offset) @ matrix, as x @ weights + bias
+        weights = matrix / scale[:, None]
+        bias = -(mean / scale + offset) @ matrix
+        projected = features @ weights + bias
+        # Standardize the projected values too, folded into the same matrix
+        projected_mean, projected_scale = projected.mean(axis=0), projected.std(axis=0)
+        projected_scale[projected_scale == 0] = 1
+        weights = (weights / projected_scale).astype(np.float32)
+        bias = ((bias - projected_mean) / projected_scale).astype(np.float32)
+
+        model = build_light_classifier(classifier, seed).fit(features @ weights + bias, labels)
+        info = {
+            "projection": projection, "components": components, "classifier": classifier,
+            "feature_dimension": features.shape[1], "training_samples": len(features),
+        }
+        if projection == "pca":
+            info["explained_variance_ratio"] = round(float(fitted.explained_variance_ratio_.sum()), 4)
+        return cls(weights, bias, model, info)
+
+    def transform(self, features) -> np.ndarray:
+        """Projected, standardized values (N, components) of raw deep features (N, D)."""
+        return np.asarray(features, dtype=np.float32) @ self.weights + self.bias
+
+    def predict(self, features) -> np.ndarray:
+        return self.classifier.predict(self.transform(features))
+
+    def decision_function(self, features) -> np.ndarray:
+        return self.classifier.decision_function(self.transform(features))
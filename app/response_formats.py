@@ -0,0 +1,123 @@
+import base64
+import json
+import uuid
+
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Image fields of a /predict payload (raw encoded bytes until formatted)
+IMAGE_FIELDS = ("full_image", "full_Normal_image")
+PREDICTION_IMAGE_FIELDS = ("image", "crop")
+RESPONSE_FORMATS = ("json", "multipart", "refs")
+
+
+def negotiate_format(requested: str = None, accept: str = None) -> str:
+    """Pick the response format from the `format` query parameter, then the Accept header."""
+    if requested:
+        if requested not in RESPONSE_FORMATS:
+            raise ValueError(f"Unknown response format: {requested} (expected one of {RESPONSE_FORMATS})")
+        return requested
+    if accept and "multipart/mixed" in accept:
+        return "multipart"
+    return "json"
+
+
+def parse_exclude(exclude: str = None) -> set:
+    """Comma-separated image fields the client does not need (e.g. 'full_Normal_image,image')."""
+    fields = {field.strip() for field in (exclude or "").split(",") if field.strip()}
+    unknown = fields - set(IMAGE_FIELDS) - set(PREDICTION_IMAGE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown image fields: {', '.join(sorted(unknown))}")
+    return fields
+
+
+def image_media_type(data: bytes) -> str:
+    return "image/png" if bytes(data[:8]) == b"\x89PNG\r\n\x1a\n" else "image/jpeg"
+
+
+def map_images(payload: dict, fn, exclude=(), prefix: str = ""):
+    """
+    Copy of `payload` where every image is replaced by fn(name, data), and
+    excluded fields are dropped. Names are the field name for top-level images
+    and 'prediction-<i>-<field>' for per-detection ones; the images of a study
+    payload (/predict/batch) are prefixed with 'image-<k>-'.
+    """
+    result = {}
+    for key, value in payload.items():
+        if key in IMAGE_FIELDS:
+            if key not in exclude and value is not None:
+                result[key] = fn(prefix + key, value)
+        elif key == "individual_predictions":
+            result[key] = []
+            for i, prediction in enumerate(value):
+                item = {}
+                for field, field_value in prediction.items():
+                    if field not in PREDICTION_IMAGE_FIELDS:
+                        item[field] = field_value
+                    elif field not in exclude:
+                        item[field] = fn(f"{prefix}prediction-{i}-{field}", field_value)
+                result[key].append(item)
+        elif key == "result" and isinstance(value, dict):
+            # Job envelope around a /predict payload
+            result[key] = map_images(value, fn, exclude, prefix)
+        elif key == "images" and not prefix:
+            result[key] = [map_images(image, fn, exclude, f"image-{k}-") for k, image in enumerate(value)]
+        else:
+            result[key] = value
+    return result
+
+
+def json_response(payload: dict, exclude=(), status_code: int = 200) -> JSONResponse:
+    """Default format: images inlined as base64 strings."""
+    return JSONResponse(
+        status_code=status_code,
+        content=map_images(payload, lambda name, data: base64.b64encode(data).decode('utf-8'), exclude)
+    )
+
+
+def refs_response(payload: dict, store, artifact_url, exclude=()) -> JSONResponse:
+    """
+    JSON metadata only: images are kept in `store` and replaced by their fetch
+    URL. An image too large for the store is inlined as base64 instead.
+    """
+    def reference(name, data):
+        try:
+            return artifact_url(store.put(data, image_media_type(data)))
+        except ValueError:
+            return base64.b64encode(data).decode('utf-8')
+
+    return JSONResponse(content=map_images(payload, reference, exclude))
+
+
+def multipart_response(payload: dict, exclude=()) -> StreamingResponse:
+    """
+    multipart/mixed: a JSON part where images are 'cid:<name>' references,
+    followed by one binary part per image, streamed part by part.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+
+    def reference(name, data):
+        parts.append((name, data))
+        return f"cid:{name}"
+
+    metadata = json.dumps(map_images(payload, reference, exclude)).encode('utf-8')
+
+    def generate():
+        yield (f"--{boundary}\r\nContent-Type: application/json\r\nContent-ID: <metadata>\r\n\r\n").encode()
+        yield metadata
+        for name, data in parts:
+            yield (f"\r\n--{boundary}\r\nContent-Type: {image_media_type(data)}\r\n"
+                   f"Content-ID: <{name}>\r\nContent-Length: {len(data)}\r\n\r\n").encode()
+            yield bytes(data)
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    return StreamingResponse(generate(), media_type=f"multipart/mixed; boundary={boundary}")
+
+
+def build_response(payload: dict, response_format: str = "json", exclude=(), store=None, artifact_url=None):
+    """Format a raw /predict or /predict/batch payload (images as bytes) for the client."""
+    if response_format == "multipart":
+        return multipart_response(payload, exclude)
+    if response_format == "refs":
+        return refs_response(payload, store, artifact_url, exclude)
+    return json_response(payload, exclude)
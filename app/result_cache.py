@@ -0,0 +1,122 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from file_store import atomic_write, purge_dir
+
+
+def content_hash(content: bytes, ext: str = "", namespace: str = "") -> str:
+    """
+    Cache key of an upload: SHA-256 of its raw bytes, its file extension (the
+    decoder depends on it) and the namespace of the models and options in use.
+    """
+    digest = hashlib.sha256(f"{namespace}\0{ext}\0".encode())
+    digest.update(content)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of model outputs keyed by upload hash (see `key`). Entries are
+    stored pickled, so the memory bound is exact and cached values cannot be
+    mutated by callers. Bounded by total size (`max_bytes`) and age (`ttl`
+    seconds); with `disk_dir` set, entries are also written there and survive
+    eviction and restarts, up to `disk_max_bytes` (expired and oldest files are
+    removed first). `namespace` identifies the models and options in use.
+    """
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, ttl: float = 3600, disk_dir: str = None,
+                 disk_max_bytes: int = 2 * 1024 * 1024 * 1024, namespace: str = ""):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.namespace = namespace
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()  # key -> (stored_at, pickled value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, content: bytes, ext: str = "") -> str:
+        """Cache key of an upload for the models and options of this cache."""
+        return content_hash(content, ext, self.namespace)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _drop(self, key):
+        _, data = self._entries.pop(key)
+        self._bytes -= len(data)
+
+    def _store(self, key, stored_at, data):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (stored_at, data)
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _load_from_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if time.time() - stored_at > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "rb") as f:
+                return stored_at, f.read()
+        except OSError:
+            return None
+
+    def get(self, key):
+        """Return the cached value for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            elif self.disk_dir and (entry := self._load_from_disk(key)) is not None:
+                self._store(key, *entry)
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                return None
+        return pickle.loads(entry[1])
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._store(key, time.time(), data)
+        if self.disk_dir:
+            atomic_write(self._disk_path(key), data, format="bytes")
+            # Expired files, then the oldest ones while over disk_max_bytes
+            purge_dir(self.disk_dir, self.ttl, self.disk_max_bytes, suffix=".pkl")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,102 @@
+import os
+from dataclasses import asdict, dataclass
+
+import cv2
+import torch
+
+# Budget applied to this process by apply_thread_budget (None until then)
+thread_budget = None
+
+
+@dataclass
+class ThreadBudget:
+    """
+    Threads given to each library in one inference process. `cpus` are the
+    cores this process may use and `workers` the inference jobs running at
+    once in it; a library set to 0 keeps its own default.
+    """
+    cpus: int
+    workers: int
+    torch: int = 0
+    torch_interop: int = 0
+    tf_intra_op: int = 0
+    tf_inter_op: int = 0
+    cv2: int = 0
+
+
+def available_cpus() -> int:
+    """Cores this process may run on (CPU affinity, e.g. a container's cpuset)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS, Windows
+        return os.cpu_count() or 1
+
+
+def plan_thread_budget(workers: int = 1, auto: bool = True, torch_threads: int = 0, torch_interop_threads: int = 0,
+                       tf_intra_op_threads: int = 0, tf_inter_op_threads: int = 0, cv2_threads: int = 0,
+                       cpus: int = None) -> ThreadBudget:
+    """
+    Split the cores between the `workers` concurrent jobs of a process: each
+    job gets cpus // workers threads in torch, TensorFlow and OpenCV, which
+    otherwise all size their pools to every core and oversubscribe them as
+    soon as two jobs run. Explicit thread counts take precedence; with
+    `auto` off, the others keep the library defaults.
+    """
+    cpus = cpus or available_cpus()
+    workers = max(1, workers)
+    share = max(1, cpus // workers)
+    return ThreadBudget(
+        cpus=cpus,
+        workers=workers,
+        torch=torch_threads or (share if auto else 0),
+        # Inter-op pools only run independent ops side by side (the two backbones)
+        torch_interop=torch_interop_threads or (1 if auto else 0),
+        tf_intra_op=tf_intra_op_threads or (share if auto else 0),
+        tf_inter_op=tf_inter_op_threads or (min(2, share) if auto else 0),
+        cv2=cv2_threads or (share if auto else 0)
+    )
+
+
+def apply_thread_budget(budget: ThreadBudget):
+    """
+    Size the thread pools of this process. Call it before the models are
+    loaded: inter-op pools can only be set before their first use.
+    """
+    global thread_budget
+    import tensorflow as tf  # Loaded by classifier_utils, after torchvision (import order matters)
+
+    if budget.torch:
+        torch.set_num_threads(budget.torch)
+    if budget.cv2:
+        cv2.setNumThreads(budget.cv2)
+    # Each of these fails once its runtime is initialized, without stopping the others
+    late_settings = [
+        ("torch interop threads", torch.set_num_interop_threads, budget.torch_interop),
+        ("TensorFlow intra-op threads", tf.config.threading.set_intra_op_parallelism_threads, budget.tf_intra_op),
+        ("TensorFlow inter-op threads", tf.config.threading.set_inter_op_parallelism_threads, budget.tf_inter_op),
+    ]
+    for name, set_threads, threads in late_settings:
+        if not threads:
+            continue
+        try:
+            set_threads(threads)
+        except RuntimeError as e:
+            print(f"{name} not set to {threads}, the runtime is already initialized: {e}")
+    thread_budget = budget
+
+
+def thread_allocation() -> dict:
+    """The planned budget of this process and the thread counts each library actually uses."""
+    import tensorflow as tf
+
+    return {
+        "budget": asdict(thread_budget) if thread_budget is not None else None,
+        "threads": {
+            "torch": torch.get_num_threads(),
+            "torch_interop": torch.get_num_interop_threads(),
+            # 0 means TensorFlow picks the number itself
+            "tf_intra_op": tf.config.threading.get_intra_op_parallelism_threads(),
+            "tf_inter_op": tf.config.threading.get_inter_op_parallelism_threads(),
+            "cv2": cv2.getNumThreads(),
+        }
+    }
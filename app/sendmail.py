@@ -2,7 +2,6 @@ import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import smtplib
-from fastapi import Form, HTTPException  # Add this import at the top
 from pydantic import BaseModel, validator, EmailStr
 from config import Settings
 # Pydantic model to validate the structure of email input data
@@ -13,22 +12,38 @@ class EmailData(BaseModel):
     message: str
 
 
-# Function to send an email to the SafeScan team
-def send_email(subject: str, email: str, name: str, message: str, body: str, recipient_email: str, settings: Settings):
-    print("innnnnnnnn")
+def smtp_connect(settings: Settings) -> smtplib.SMTP:
+    """Open an authenticated connection to the configured SMTP server."""
+    if settings.smtp_ssl:
+        server = smtplib.SMTP_SSL(settings.smtp_host, settings.smtp_port, timeout=settings.smtp_timeout)
+    else:
+        server = smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=settings.smtp_timeout)
     try:
-        # Sender credentials from settings
-        sender_email = settings.email
-        sender_password = settings.password  # App-specific password for Gmail
-
-        # Compose email with HTML content
-        msg = MIMEMultipart('alternative')
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
-        msg['Subject'] = f"SafeScan Contact: {subject}"
-
-        # HTML template for the email body
-        html = f"""
+        server.ehlo()
+        if settings.smtp_starttls:
+            server.starttls()
+            server.ehlo()
+        # Local stand-in servers (e.g. aiosmtpd) may not offer authentication
+        if server.has_extn("auth"):
+            server.login(settings.email, settings.password)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+# Message to the SafeScan team for a contact form submission
+def build_contact_email(subject: str, email: str, name: str, message: str, body: str, recipient_email: str,
+                        sender_email: str) -> MIMEMultipart:
+    message_html = message.replace('\n', '<br>')
+    # Compose email with HTML content
+    msg = MIMEMultipart('alternative')
+    msg['From'] = sender_email
+    msg['To'] = recipient_email
+    msg['Subject'] = f"SafeScan Contact: {subject}"
+
+    # HTML template for the email body
+    html = f"""
         <!DOCTYPE html>
         <html>
         <head>
@@ -84,7 +99,7 @@ def send_email(subject: str, email: str, name: str, message: str, body: str, rec
                 
                 <div class="message-box">
                     <p><span class="info-label">Message:</span></p>
-                    <p>{message.replace('\n', '<br>')}</p>
+                    <p>{message_html}</p>
                 </div>
             </div>
             
@@ -96,40 +111,27 @@ def send_email(subject: str, email: str, name: str, message: str, body: str, rec
         </html>
         """
 
-        # Attach both plain text and HTML versions
-        part1 = MIMEText(body, 'plain')
-        part2 = MIMEText(html, 'html')
-        
-        msg.attach(part1)
-        msg.attach(part2)
-
-        # Send the email using Gmail's SMTP server over SSL
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, recipient_email, msg.as_string())
-
-    except Exception as e:
-        # Return a 500 Internal Server Error with exception message if sending fails
-        raise HTTPException(status_code=500, detail=f"Error sending email: {str(e)}")
+    # Attach both plain text and HTML versions
+    part1 = MIMEText(body, 'plain')
+    part2 = MIMEText(html, 'html')
     
+    msg.attach(part1)
+    msg.attach(part2)
+    return msg
 
 
+# Acknowledgement sent back to the person who used the contact form
+def build_reply_email(subject: str, email: str, name: str, message: str, sender_email: str) -> MIMEMultipart:
+    message_html = message.replace('\n', '<br>')
+    # Create the email message with HTML content
+    msg = MIMEMultipart('alternative')
+    msg['From'] = sender_email
+    msg['To'] = email
+    msg['Subject'] = f"SafeScan Contact: {subject}"
 
 
-    
-def reply_email(subject: str , email : str ,name: str  , message : str  ,settings:Settings):
-    try:
-        sender_email = settings.email
-        sender_password = settings.password  # Use App Password
-       # Create the email message with HTML content
-        msg = MIMEMultipart('alternative')
-        msg['From'] = sender_email
-        msg['To'] = email
-        msg['Subject'] = f"SafeScan Contact: {subject}"
-
-
-        # HTML email template
-        html = f"""
+    # HTML email template
+    html = f"""
 <!DOCTYPE html>
 <html>
 <head>
@@ -195,7 +197,7 @@ def reply_email(subject: str , email : str ,name: str  , message : str  ,setting
         
         <div style="background: white; padding: 15px; border-radius: 5px; border-left: 3px solid #e27bb1;">
             <p><strong>Subject:</strong> {subject}</p>
-            <p>{message.replace('\n', '<br>')}</p>
+            <p>{message_html}</p>
         </div>
         
         <div class="team-signature">
@@ -216,14 +218,7 @@ def reply_email(subject: str , email : str ,name: str  , message : str  ,setting
 </html>
 """
 
-        # Attach both plain text and HTML versions
-        part2 = MIMEText(html, 'html')
-        msg.attach(part2)
-
-        # Send email
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, email, msg.as_string())
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error sending email: {str(e)}")
\ No newline at end of file
+    # Attach both plain text and HTML versions
+    part2 = MIMEText(html, 'html')
+    msg.attach(part2)
+    return msg
@@ -0,0 +1,58 @@
+"""
+Start the API. With HTTP_WORKERS > 1 (or --workers), one inference_server.py
+process loads the models and several uvicorn workers share it over a local
+socket, so the models are in memory once however many workers serve HTTP.
+That socket (INFERENCE_ADDRESS) accepts pickled calls: keep it a Unix socket
+or a loopback host:port, never a port exposed to other machines.
+
+Run from the app directory:
+    python serve.py --workers 4
+"""
+import argparse
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import uvicorn
+
+from config import Settings
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.http_workers)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run("main:app", host=args.host, port=args.port, app_dir=APP_DIR)
+        return
+
+    # Read by the inference server and by every worker (through the environment)
+    os.environ["INFERENCE_EXECUTOR"] = "remote"
+    os.environ.setdefault("INFERENCE_AUTHKEY", settings.inference_authkey or secrets.token_hex(16))
+    # /metrics aggregates the series of all the processes
+    metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="safescan-metrics-"))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    if not settings.job_store_dir or not settings.artifact_store_dir:
+        print("Warning: set JOB_STORE_DIR and ARTIFACT_STORE_DIR so /jobs and /artifacts "
+              "work whichever worker answers")
+
+    server = subprocess.Popen([sys.executable, os.path.join(APP_DIR, "inference_server.py")])
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=APP_DIR)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
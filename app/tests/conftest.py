@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Same import order as the app: torchvision must load before Keras / TensorFlow
+import model_utils  # noqa: E402,F401
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+from model_utils import Detections, merge_overlapping_masks  # noqa: E402
+
+
+def make_lesion_case(n, height=600, width=500, seed=0):
+    """Blurred noise image (RGB) and n merged elliptical detections on it, as the pipeline passes them on."""
+    rng = np.random.default_rng(seed)
+    image = cv2.GaussianBlur((rng.random((height, width)) * 255).astype(np.uint8), (0, 0), 3)
+    image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+    yy, xx = np.mgrid[:height, :width]
+    masks = np.zeros((n, height, width), dtype=np.float32)
+    for k in range(n):
+        cy, cx = rng.uniform(0.1, 0.9) * height, rng.uniform(0.1, 0.9) * width
+        ry, rx = rng.uniform(8, 60, size=2)
+        masks[k] = np.clip(1.5 - ((yy - cy) / ry) ** 2 - ((xx - cx) / rx) ** 2, 0, 1)
+    labels = rng.integers(1, 3, size=n)
+    scores = rng.uniform(0.5, 1.0, size=n).astype(np.float32)
+    detections = Detections.from_full_masks(*merge_overlapping_masks(masks, labels, scores))
+    detections.classification = [{"label": "benign"}] * len(detections)
+    return image, detections
+
+
+@pytest.fixture
+def lesion_case():
+    return make_lesion_case
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import artifact_store
+from artifact_store import ArtifactStore
+
+
+@pytest.fixture
+def purge_calls(monkeypatch):
+    calls = []
+
+    def purge_dir(*args, **kwargs):
+        calls.append(args[0])
+        return real_purge_dir(*args, **kwargs)
+
+    real_purge_dir = artifact_store.purge_dir
+    monkeypatch.setattr(artifact_store, "purge_dir", purge_dir)
+    return calls
+
+
+def test_memory_store_drops_oldest_beyond_max_bytes():
+    store = ArtifactStore(max_bytes=2500)
+    ids = [store.put(bytes([i]) * 1000, "image/jpeg") for i in range(3)]
+    assert store.get(ids[0]) is None
+    assert store.get(ids[2]) == ("image/jpeg", bytes([2]) * 1000)
+    assert store.get("unknown") is None
+
+
+def test_expired_artifacts_are_not_returned(tmp_path):
+    for store in (ArtifactStore(ttl=-1), ArtifactStore(ttl=-1, directory=str(tmp_path))):
+        assert store.get(store.put(b"data", "image/png")) is None
+
+
+@pytest.mark.parametrize("in_directory", [False, True])
+def test_oversized_artifact_is_rejected(tmp_path, in_directory):
+    store = ArtifactStore(max_bytes=100, directory=str(tmp_path) if in_directory else None)
+    kept = store.put(bytes(60), "image/jpeg")
+    with pytest.raises(ValueError):
+        store.put(bytes(101), "image/jpeg")
+    # Nothing was written or dropped
+    assert store.get(kept) == ("image/jpeg", bytes(60))
+    assert len(os.listdir(tmp_path)) == (1 if in_directory else 0)
+
+
+def test_directory_is_shared_between_stores(tmp_path):
+    writer = ArtifactStore(directory=str(tmp_path))
+    reader = ArtifactStore(directory=str(tmp_path))
+    artifact_id = writer.put(b"\x89PNG", "image/png")
+    assert reader.get(artifact_id) == ("image/png", b"\x89PNG")
+    assert reader.get("../" + artifact_id) is None
+
+
+def test_directory_is_scanned_on_a_timer_or_once_full(tmp_path, purge_calls):
+    store = ArtifactStore(max_bytes=3500, directory=str(tmp_path), purge_interval=3600)
+    ids = [store.put(bytes(1000), "image/jpeg") for _ in range(3)]
+    assert len(purge_calls) == 1  # First put only, the running total stays below max_bytes
+
+    ids.append(store.put(bytes(1000), "image/jpeg"))
+    assert len(purge_calls) == 2
+    assert store.get(ids[0]) is None
+    assert all(store.get(artifact_id) is not None for artifact_id in ids[1:])
+    assert sum(entry.stat().st_size for entry in os.scandir(tmp_path)) <= 3500
+
+
+def test_directory_scan_counts_other_writers(tmp_path, purge_calls):
+    store = ArtifactStore(max_bytes=3500, directory=str(tmp_path), purge_interval=0)
+    other = ArtifactStore(max_bytes=3500, directory=str(tmp_path), purge_interval=3600)
+    old = [other.put(bytes(1000), "image/jpeg") for _ in range(3)]
+    store.put(bytes(1000), "image/jpeg")
+    assert other.get(old[0]) is None and other.get(old[1]) is not None
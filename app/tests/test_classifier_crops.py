@@ -0,0 +1,90 @@
+import cv2
+import numpy as np
+import pytest
+
+import classifier_utils
+from classifier_utils import CLASSIFIER_FRAME, CROP_SIZES, classifier_crops, crop_windows, frame_crop_windows
+from model_utils import Detections
+
+IMAGE_SIZES = [(3328, 2560), (2294, 1914), (1147, 957), (800, 600)]  # (height, width)
+MEAN_TOLERANCE = 3.0  # Gray levels, mean absolute difference per patch
+
+
+def smart_crop_window(frame_size, box):
+    """The window smart_crop_from_box resizes in a frame of (height, width), the whole frame as fallback."""
+    height, width = frame_size
+    x1, y1, x2, y2 = map(int, box)
+    for crop_size in CROP_SIZES:
+        if crop_size < max(x2 - x1, y2 - y1):
+            continue
+        center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+        crop_x1, crop_y1 = max(0, center_x - crop_size // 2), max(0, center_y - crop_size // 2)
+        crop_x2, crop_y2 = min(width, crop_x1 + crop_size), min(height, crop_y1 + crop_size)
+        if crop_x2 - crop_x1 < crop_size:
+            crop_x1 = max(0, crop_x2 - crop_size)
+        if crop_y2 - crop_y1 < crop_size:
+            crop_y1 = max(0, crop_y2 - crop_size)
+        if x1 >= crop_x1 and y1 >= crop_y1 and x2 <= crop_x2 and y2 <= crop_y2:
+            return [crop_x1, crop_y1, crop_x2, crop_y2]
+    return [0, 0, width, height]
+
+
+def synthetic_image(height, width, seed=0):
+    """Smooth grayscale texture with fine noise, as an RGB mammogram-sized array."""
+    rng = np.random.default_rng(seed)
+    coarse = cv2.resize(rng.uniform(0, 255, (32, 24)).astype(np.float32), (width, height),
+                        interpolation=cv2.INTER_CUBIC)
+    gray = np.clip(coarse + rng.normal(0, 2, (height, width)), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+
+
+def synthetic_detections(n, height, width, seed=0):
+    """Boxes from a few pixels to most of the image, some against the borders, some below the score cut."""
+    rng = np.random.default_rng(seed)
+    sides = rng.uniform(0.01, 0.6, (n, 2)) * [width, height]
+    x1 = rng.uniform(-0.05, 1.0, n) * (width - sides[:, 0])
+    y1 = rng.uniform(-0.05, 1.0, n) * (height - sides[:, 1])
+    boxes = np.stack([x1, y1, x1 + sides[:, 0], y1 + sides[:, 1]], axis=1)
+    boxes = np.clip(boxes, 0, [width - 1, height - 1, width - 1, height - 1]).astype(np.int64)
+    scores = rng.uniform(0.3, 1.0, n).astype(np.float32)
+    return Detections(boxes, np.ones(n, dtype=np.int64), scores, [], (height, width))
+
+
+def crops(mode, image, detections):
+    classifier_utils.set_crop_mode(mode)
+    try:
+        return np.array(classifier_crops(image, detections)).reshape(-1, 224, 224, 3)
+    finally:
+        classifier_utils.set_crop_mode("direct")
+
+
+@pytest.mark.parametrize("height, width", IMAGE_SIZES)
+def test_windows_match_smart_crop_from_box(height, width):
+    boxes = synthetic_detections(50, height, width, seed=height).boxes
+    frame_width, frame_height = CLASSIFIER_FRAME
+    scale = np.array([frame_width / width, frame_height / height] * 2)
+    expected = [smart_crop_window((frame_height, frame_width), (box * scale).astype(int)) for box in boxes]
+    assert np.array_equal(frame_crop_windows(boxes, (height, width)), expected)
+
+    windows = crop_windows(boxes, (height, width))
+    assert (windows[:, :2] >= 0).all() and (windows[:, 2] <= width).all() and (windows[:, 3] <= height).all()
+    assert (windows[:, 2:] > windows[:, :2]).all()
+
+
+@pytest.mark.parametrize("height, width", IMAGE_SIZES)
+def test_direct_crops_match_legacy(height, width):
+    image = synthetic_image(height, width, seed=width)
+    detections = synthetic_detections(20, height, width, seed=width)
+    legacy, direct = crops("legacy", image, detections), crops("direct", image, detections)
+    assert len(direct) == np.count_nonzero(detections.scores >= 0.5)
+    assert direct.shape == legacy.shape
+
+    difference = np.abs(legacy.astype(np.int16) - direct.astype(np.int16))
+    assert difference.reshape(len(difference), -1).mean(axis=1).max() <= MEAN_TOLERANCE
+
+
+def test_grayscale_image_gives_rgb_crops():
+    image = synthetic_image(1147, 957)
+    detections = synthetic_detections(5, 1147, 957)
+    gray = crops("direct", image[:, :, 0], detections)
+    assert np.array_equal(gray, crops("direct", image, detections))
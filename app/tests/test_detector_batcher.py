@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+import torch
+
+from model_utils import DetectorBatcher
+
+
+class StubDetector:
+    """Returns {"value": 2 * x} per input tensor, records batch sizes, can hold a call until released."""
+
+    def __init__(self, hold_first=False):
+        self.batches = []
+        self.release = threading.Event()
+        self.holding = threading.Event()
+        if not hold_first:
+            self.release.set()
+
+    def eval(self):
+        return self
+
+    def __call__(self, tensors):
+        self.batches.append(len(tensors))
+        self.holding.set()
+        self.release.wait(5)
+        if any(tensor.item() < 0 for tensor in tensors):
+            raise RuntimeError("negative input")
+        return [{"value": 2 * tensor.item()} for tensor in tensors]
+
+
+def hold_first_batch(batcher, model):
+    """Blocks the batcher in a first call, so the next submissions queue up."""
+    first = batcher.submit(torch.tensor(0))
+    assert model.holding.wait(5)
+    return first
+
+
+def test_results_go_back_to_their_callers_in_order():
+    model = StubDetector(hold_first=True)
+    batcher = DetectorBatcher(model, max_batch_size=4, max_wait_ms=20)
+    first = hold_first_batch(batcher, model)
+
+    results = {}
+
+    def caller(k):
+        futures = [batcher.submit(torch.tensor(10 * k + i)) for i in range(3)]
+        results[k] = [future.result(timeout=5)["value"] for future in futures]
+
+    threads = [threading.Thread(target=caller, args=(k,)) for k in range(1, 7)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)  # Let every caller queue its tensors
+    model.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert first.result(timeout=5) == {"value": 0}
+    assert results == {k: [20 * k, 20 * k + 2, 20 * k + 4] for k in range(1, 7)}
+    assert model.batches[0] == 1 and sum(model.batches) == 19
+    assert max(model.batches) == 4  # The queued tensors went through full batches
+
+
+def test_detector_error_reaches_every_waiting_future():
+    model = StubDetector(hold_first=True)
+    batcher = DetectorBatcher(model, max_batch_size=4, max_wait_ms=20)
+    first = hold_first_batch(batcher, model)
+    futures = [batcher.submit(torch.tensor(value)) for value in (1, -1, 2)]
+    model.release.set()
+
+    assert first.result(timeout=5) == {"value": 0}
+    for future in futures:
+        with pytest.raises(RuntimeError, match="negative input"):
+            future.result(timeout=5)
+
+    assert model.batches == [1, 3]
+
+    # The batcher keeps serving after the error
+    assert batcher.submit(torch.tensor(5)).result(timeout=5) == {"value": 10}
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    model = StubDetector()
+    batcher = DetectorBatcher(model, max_batch_size=8, max_wait_ms=200)
+    start = time.monotonic()
+    futures = [batcher.submit(torch.tensor(value)) for value in (1, 2)]
+    assert [future.result(timeout=5)["value"] for future in futures] == [2, 4]
+    elapsed = time.monotonic() - start
+    assert model.batches == [2]
+    assert 0.15 <= elapsed < 2
+
+
+def test_full_batch_does_not_wait():
+    model = StubDetector()
+    batcher = DetectorBatcher(model, max_batch_size=2, max_wait_ms=10_000)
+    start = time.monotonic()
+    futures = [batcher.submit(torch.tensor(value)) for value in (1, 2)]
+    assert [future.result(timeout=5)["value"] for future in futures] == [2, 4]
+    assert time.monotonic() - start < 2 and model.batches == [2]
@@ -0,0 +1,170 @@
+import io
+
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, SecondaryCaptureImageStorage, generate_uid
+
+from dicom_utils import _to_uint8, pixel_spacing_mm, read_dicom
+
+
+def make_dataset(pixels, photometric="MONOCHROME2", **elements):
+    """Single-frame (or multi-frame, pixels of ndim 3) grayscale dataset holding `pixels`."""
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.file_meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    if pixels.ndim == 3:
+        ds.NumberOfFrames = len(pixels)
+    ds.Rows, ds.Columns = pixels.shape[-2:]
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = photometric
+    ds.BitsAllocated = ds.BitsStored = 8 * pixels.itemsize
+    ds.HighBit = ds.BitsStored - 1
+    ds.PixelRepresentation = int(pixels.dtype.kind == "i")
+    ds.PixelData = pixels.tobytes()
+    for name, value in elements.items():
+        setattr(ds, name, value)
+    return ds
+
+
+def to_bytes(ds):
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def baseline(pixels):
+    """The conversion of the original dicom_to_png."""
+    pixels = pixels.astype(float)
+    return np.uint8(np.maximum(pixels, 0) / pixels.max() * 255.0)
+
+
+def window_reference(x, center, width):
+    """Linear window of DICOM PS3.3 C.11.2.1.2.1, to 0-255."""
+    y = np.where(x <= center - 0.5 - (width - 1) / 2, 0.0,
+                 np.where(x > center - 0.5 + (width - 1) / 2, 1.0, (x - (center - 0.5)) / (width - 1) + 0.5))
+    return y * 255.0
+
+
+def assert_close(actual, expected):
+    """Equal up to one gray level (float rounding before the uint8 cast)."""
+    assert actual.dtype == np.uint8 and actual.shape == expected.shape
+    assert np.abs(actual.astype(np.int16) - np.asarray(expected).astype(np.int16)).max() <= 1
+
+
+def mammogram_pixels(dtype=np.uint16, low=0, high=4096, seed=0):
+    return np.random.default_rng(seed).integers(low, high, (24, 20)).astype(dtype)
+
+
+@pytest.mark.parametrize("dtype, high", [(np.uint16, 4096), (np.uint16, 65536), (np.uint8, 256), (np.int16, 2000)])
+def test_max_scaling_matches_baseline(dtype, high):
+    pixels = mammogram_pixels(dtype, high=high)
+    # Window, rescale and inversion are ignored by the default scaling
+    ds = make_dataset(pixels, "MONOCHROME1", WindowCenter=100, WindowWidth=50, RescaleSlope=2)
+    image, _ = read_dicom(to_bytes(ds))
+    assert np.array_equal(image, baseline(pixels))
+
+
+def test_max_scaling_of_32_bit_pixels():
+    pixels = mammogram_pixels(np.uint32, high=2 ** 20)
+    assert np.array_equal(_to_uint8(make_dataset(pixels), pixels, "max"), baseline(pixels))
+
+
+def test_max_scaling_of_signed_pixels_clips_negatives():
+    pixels = mammogram_pixels(np.int16, low=-500, high=1500)
+    image = _to_uint8(make_dataset(pixels), pixels, "max")
+    assert np.array_equal(image, baseline(pixels))
+    assert (image[pixels <= 0] == 0).all()
+
+
+def test_voi_without_window_scales_by_maximum():
+    pixels = mammogram_pixels()
+    image, _ = read_dicom(to_bytes(make_dataset(pixels)), windowing="voi")
+    assert np.array_equal(image, baseline(pixels))
+
+
+def test_voi_applies_rescale_and_window():
+    pixels = mammogram_pixels()
+    ds = make_dataset(pixels, RescaleSlope=2, RescaleIntercept=-1000, WindowCenter=3000, WindowWidth=4000)
+    image, _ = read_dicom(to_bytes(ds), windowing="voi")
+    assert_close(image, window_reference(pixels * 2.0 - 1000, 3000, 4000))
+
+
+def test_voi_of_signed_pixels():
+    pixels = mammogram_pixels(np.int16, low=-2000, high=2000)
+    ds = make_dataset(pixels, RescaleIntercept=100, WindowCenter=[0, 500], WindowWidth=[1000, 200])
+    image, _ = read_dicom(to_bytes(ds), windowing="voi")
+    # The first of several windows is used
+    assert_close(image, window_reference(pixels + 100.0, 0, 1000))
+    assert image.min() == 0 and image.max() == 255
+
+
+@pytest.mark.parametrize("function, expected", [
+    ("SIGMOID", lambda x: 255.0 / (1.0 + np.exp(-4.0 * (x - 2000) / 1000))),
+    ("LINEAR_EXACT", lambda x: np.clip((x - 2000) / 1000 + 0.5, 0, 1) * 255.0),
+])
+def test_voi_lut_functions(function, expected):
+    pixels = mammogram_pixels()
+    ds = make_dataset(pixels, WindowCenter=2000, WindowWidth=1000, VOILUTFunction=function)
+    assert_close(_to_uint8(ds, pixels, "voi"), expected(pixels.astype(np.float64)))
+
+
+def test_voi_lut_sequence():
+    pixels = mammogram_pixels()
+    first_mapped, bits = 1000, 10
+    lut_data = np.linspace(0, 2 ** bits - 1, 2000).astype(np.uint16)
+    item = Dataset()
+    item.LUTDescriptor = [len(lut_data), first_mapped, bits]
+    item.add_new("LUTData", "US", lut_data.tolist())
+    # The LUT takes precedence over the window
+    ds = make_dataset(pixels, VOILUTSequence=Sequence([item]), WindowCenter=0, WindowWidth=10)
+
+    image, _ = read_dicom(to_bytes(ds), windowing="voi")
+    index = np.clip(pixels.astype(np.int64) - first_mapped, 0, len(lut_data) - 1)
+    assert_close(image, lut_data[index] * (255.0 / (2 ** bits - 1)))
+
+
+@pytest.mark.parametrize("dtype, high", [(np.uint16, 4096), (np.uint32, 2 ** 20)])
+def test_voi_inverts_monochrome1(dtype, high):
+    pixels = mammogram_pixels(dtype, high=high)
+    window = {"WindowCenter": high // 2, "WindowWidth": high // 2}
+    monochrome2 = _to_uint8(make_dataset(pixels, **window), pixels, "voi")
+    monochrome1 = _to_uint8(make_dataset(pixels, "MONOCHROME1", **window), pixels, "voi")
+    assert_close(monochrome1, 255 - window_reference(pixels.astype(np.float64), high // 2, high // 2))
+    assert_close(monochrome1, 255 - monochrome2.astype(np.int16))
+
+
+def test_first_frame_of_multi_frame_dataset():
+    frames = np.stack([mammogram_pixels(seed=1), mammogram_pixels(seed=2)])
+    image, _ = read_dicom(to_bytes(make_dataset(frames)))
+    assert np.array_equal(image, baseline(frames[0]))
+
+
+def test_unknown_windowing_is_rejected():
+    with pytest.raises(ValueError):
+        read_dicom(b"", windowing="auto")
+
+
+@pytest.mark.parametrize("elements, expected", [
+    ({"PixelSpacing": [0.1, 0.12]}, 0.11),
+    ({"ImagerPixelSpacing": [0.1, 0.1]}, 0.1),
+    ({"ImagerPixelSpacing": [0.1, 0.1], "EstimatedRadiographicMagnificationFactor": 1.25}, 0.08),
+    # PixelSpacing is already corrected for the magnification
+    ({"PixelSpacing": [0.07, 0.07], "ImagerPixelSpacing": [0.1, 0.1],
+      "EstimatedRadiographicMagnificationFactor": 1.25}, 0.07),
+    ({}, None),
+    ({"PixelSpacing": [0.0, 0.1]}, None),
+])
+def test_pixel_spacing(elements, expected):
+    pixels = mammogram_pixels()
+    _, spacing = read_dicom(to_bytes(make_dataset(pixels, **elements)))
+    if expected is None:
+        assert spacing is None
+    else:
+        assert spacing == pytest.approx(expected)
+    assert pixel_spacing_mm(make_dataset(pixels, **elements)) == spacing
@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+import classifier_utils
+from feature_cache import FeatureCache, FeatureStore, crop_key
+
+DIMENSION = 4
+VECTOR_BYTES = DIMENSION * 4
+
+
+def vector(value):
+    return np.full(DIMENSION, value, dtype=np.float32)
+
+
+def test_crop_key_depends_on_pixels_and_shape():
+    crop = np.zeros((4, 6, 3), dtype=np.uint8)
+    assert crop_key(crop) == crop_key(crop.copy())
+    assert crop_key(crop) != crop_key(crop.reshape(6, 4, 3))
+    changed = crop.copy()
+    changed[0, 0, 0] = 1
+    assert crop_key(crop) != crop_key(changed)
+
+
+def test_memory_tier_is_an_lru_bounded_in_bytes():
+    cache = FeatureCache(DIMENSION, max_bytes=3 * VECTOR_BYTES)
+    cache.put_many(["a", "b", "c"], [vector(0), vector(1), vector(2)])
+    assert cache.get("a") is not None  # "a" is now the most recent
+    cache.put_many(["d"], [vector(3)])
+
+    assert cache.get("b") is None
+    for key, value in [("a", 0), ("c", 2), ("d", 3)]:
+        assert np.array_equal(cache.get(key), vector(value))
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 3 * VECTOR_BYTES
+    assert stats["hits"] == 4 and stats["misses"] == 1
+
+
+def test_cached_vectors_are_copies_of_the_batch():
+    cache = FeatureCache(DIMENSION)
+    batch = np.stack([vector(1), vector(2)])
+    cache.put_many(["a", "b"], batch)
+    batch[:] = 0
+    assert np.array_equal(cache.get("a"), vector(1))
+    with pytest.raises(ValueError):
+        cache.get("a")[0] = 5
+
+
+def test_ring_overwrites_the_oldest_row(tmp_path):
+    store = FeatureStore(str(tmp_path / "features.npy"), DIMENSION, max_bytes=3 * VECTOR_BYTES)
+    assert store.capacity == 3
+    for i in range(4):
+        store.put(f"key{i}", vector(i))
+
+    assert store.get("key0") is None
+    assert store.rows == {"key3": 0, "key1": 1, "key2": 2}
+    assert np.array_equal(store.get("key3"), vector(3))
+    store.put("key1", vector(9))  # Already stored: kept as is
+    assert np.array_equal(store.get("key1"), vector(1)) and store.next_row == 1
+    store.close()
+
+
+def test_store_is_reopened(tmp_path):
+    path = str(tmp_path / "features.npy")
+    store = FeatureStore(path, DIMENSION, max_bytes=3 * VECTOR_BYTES, namespace="weights")
+    for i in range(4):
+        store.put(f"key{i}", vector(i))
+    store.close()
+
+    store = FeatureStore(path, DIMENSION, max_bytes=3 * VECTOR_BYTES, namespace="weights")
+    assert set(store.rows) == {"key1", "key2", "key3"}
+    assert np.array_equal(store.get("key2"), vector(2))
+    store.put("key4", vector(4))  # The ring goes on where it stopped
+    assert store.get("key1") is None
+    store.close()
+
+
+@pytest.mark.parametrize("namespace, dimension, max_bytes", [
+    ("other weights", DIMENSION, 3 * VECTOR_BYTES),
+    ("weights", DIMENSION * 2, 6 * VECTOR_BYTES),
+    ("weights", DIMENSION, 5 * VECTOR_BYTES),
+])
+def test_store_is_reset_when_its_layout_changes(tmp_path, namespace, dimension, max_bytes):
+    path = str(tmp_path / "features.npy")
+    store = FeatureStore(path, DIMENSION, max_bytes=3 * VECTOR_BYTES, namespace="weights")
+    store.put("key", vector(1))
+    store.close()
+
+    store = FeatureStore(path, dimension, max_bytes=max_bytes, namespace=namespace)
+    assert store.rows == {} and store.next_row == 0
+    assert store.get("key") is None
+    store.close()
+
+
+def test_disk_tier_refills_memory(tmp_path):
+    path = str(tmp_path / "features.npy")
+    cache = FeatureCache(DIMENSION, path=path, disk_bytes=8 * VECTOR_BYTES)
+    cache.put_many(["a", "b"], [vector(1), vector(2)])
+    cache.store.close()
+
+    cache = FeatureCache(DIMENSION, path=path, disk_bytes=8 * VECTOR_BYTES)
+    assert np.array_equal(cache.get("a"), vector(1))
+    assert cache.get("a") is not None
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1 and stats["hits"] == 1 and stats["disk_entries"] == 2
+    cache.store.close()
+
+
+def test_store_in_use_is_not_shared(tmp_path):
+    path = str(tmp_path / "features.npy")
+    owner = FeatureCache(DIMENSION, path=path)
+    other = FeatureCache(DIMENSION, path=path)
+    assert owner.store is not None and other.store is None
+    owner.store.close()
+
+
+@pytest.fixture
+def extractor_calls(monkeypatch):
+    """Stub backbones returning each crop's mean, recording the batches they get."""
+    calls = []
+
+    def extract(image_batch):
+        calls.append(len(image_batch))
+        means = image_batch.reshape(len(image_batch), -1).mean(axis=1)
+        return np.repeat(means[:, None], DIMENSION, axis=1).astype(np.float32)
+
+    monkeypatch.setattr(classifier_utils, "_feature_extractor", extract)
+    monkeypatch.setattr(classifier_utils, "feature_cache", FeatureCache(DIMENSION))
+    return calls
+
+
+def test_duplicate_crops_in_a_batch_are_extracted_once(extractor_calls):
+    crops = np.stack([np.full((8, 8, 3), value, dtype=np.uint8) for value in [10, 20, 10, 10, 30, 20]])
+    features = classifier_utils.cached_deep_features(crops)
+    assert extractor_calls == [3]
+    assert np.array_equal(features, classifier_utils.extract_deep_features(crops))
+
+    # Seen crops come from the cache, only the new one is extracted
+    more = np.stack([crops[0], np.full((8, 8, 3), 40, dtype=np.uint8), crops[4], crops[0]])
+    features = classifier_utils.cached_deep_features(more)
+    assert extractor_calls == [3, 6, 1]
+    assert np.array_equal(features[:, 0], [10, 40, 30, 10])
+
+
+def test_fully_cached_batch_skips_the_backbones(extractor_calls):
+    crops = np.stack([np.full((8, 8, 3), value, dtype=np.uint8) for value in [1, 2]])
+    first = classifier_utils.cached_deep_features(crops)
+    second = classifier_utils.cached_deep_features(crops[::-1])
+    assert extractor_calls == [2]
+    assert np.array_equal(second, first[::-1])
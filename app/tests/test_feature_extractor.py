@@ -0,0 +1,56 @@
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+from keras.applications.convnext import ConvNeXtTiny
+from keras.applications.densenet import DenseNet121
+
+import classifier_utils
+
+RTOL = 1e-3  # Largest difference allowed, relative to the largest Keras feature
+
+
+@pytest.fixture(scope="module")
+def random_backbones():
+    """Random-weight backbones in classifier_utils (no checkpoint needed), restored afterwards."""
+    previous = classifier_utils.model_densenet, classifier_utils.model_convnext, classifier_utils._feature_extractor
+    classifier_utils.model_densenet = DenseNet121(weights=None, include_top=False, input_shape=(224, 224, 3))
+    classifier_utils.model_convnext = ConvNeXtTiny(weights=None, include_top=False, input_shape=(224, 224, 3))
+    classifier_utils._fused_model = None
+    yield
+    classifier_utils.model_densenet, classifier_utils.model_convnext, classifier_utils._feature_extractor = previous
+    classifier_utils._fused_model = None
+
+
+@pytest.fixture(scope="module")
+def batch_and_reference(random_backbones):
+    batch = np.random.default_rng(0).integers(0, 256, size=(3, 224, 224, 3), dtype=np.uint8)
+    classifier_utils.set_feature_backend("keras")
+    return batch, classifier_utils.extract_deep_features(batch)
+
+
+def assert_close(features, reference):
+    assert features.shape == reference.shape
+    relative_error = np.abs(features - reference).max() / np.abs(reference).max()
+    assert relative_error <= RTOL, f"relative error {relative_error:.2e}"
+
+
+def test_fused_features_match_keras(batch_and_reference):
+    batch, reference = batch_and_reference
+    classifier_utils.set_feature_backend("fused")
+    assert_close(classifier_utils.extract_deep_features(batch), reference)
+    # A single crop goes through the same traced graph
+    assert_close(classifier_utils.extract_deep_features(batch[:1]), reference[:1])
+
+
+@pytest.mark.skipif(importlib.util.find_spec("onnxruntime") is None or importlib.util.find_spec("tf2onnx") is None,
+                    reason="onnxruntime and tf2onnx are needed for the ONNX backend")
+@pytest.mark.skipif(not os.environ.get("TEST_ONNX_EXPORT"),
+                    reason="the export needs several GB of memory, set TEST_ONNX_EXPORT=1 to run it")
+def test_onnx_features_match_keras(batch_and_reference, tmp_path):
+    batch, reference = batch_and_reference
+    onnx_path = str(tmp_path / "feature_extractor.onnx")
+    classifier_utils.export_feature_extractor_onnx(onnx_path)
+    classifier_utils.set_feature_backend("onnx", onnx_path)
+    assert_close(classifier_utils.extract_deep_features(batch), reference)
@@ -0,0 +1,37 @@
+import os
+import pickle
+import time
+
+from file_store import atomic_write, purge_dir, try_lock
+
+
+def test_atomic_write_formats(tmp_path):
+    atomic_write(str(tmp_path / "a.pkl"), {"x": 1})
+    atomic_write(str(tmp_path / "b.json"), [1, 2], format="json")
+    atomic_write(str(tmp_path / "c.bin"), b"raw", format="bytes")
+    assert pickle.loads((tmp_path / "a.pkl").read_bytes()) == {"x": 1}
+    assert (tmp_path / "b.json").read_text() == "[1, 2]"
+    assert (tmp_path / "c.bin").read_bytes() == b"raw"
+    assert sorted(os.listdir(tmp_path)) == ["a.pkl", "b.json", "c.bin"]  # No temporary file left
+
+
+def test_purge_dir_expired_then_oldest(tmp_path):
+    now = time.time()
+    for i, age in enumerate([500, 30, 20, 10]):
+        path = tmp_path / f"{i}.pkl"
+        path.write_bytes(bytes(100))
+        os.utime(path, (now - age, now - age))
+    (tmp_path / "other.txt").write_bytes(bytes(1000))
+
+    assert purge_dir(str(tmp_path), ttl=60, max_bytes=250, now=now, suffix=".pkl") == 200
+    assert sorted(os.listdir(tmp_path)) == ["2.pkl", "3.pkl", "other.txt"]
+
+
+def test_try_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / "store.lock")
+    held = try_lock(path)
+    assert held is not None
+    # flock locks belong to the open file description: a second open conflicts
+    assert try_lock(path) is None
+    held.close()
+    assert try_lock(path) is not None
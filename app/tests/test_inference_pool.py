@@ -0,0 +1,61 @@
+import asyncio
+import functools
+import os
+import time
+
+import pytest
+
+from inference_pool import InferencePool, PoolFullError
+
+
+def slow_pid(delay=0.0):
+    time.sleep(delay)
+    return os.getpid()
+
+
+def fail_in_one_worker(marker):
+    """Fails in the first process to get here only."""
+    try:
+        os.close(os.open(marker, os.O_CREAT | os.O_EXCL))
+    except FileExistsError:
+        return os.getpid()
+    raise ValueError("model file is corrupt")
+
+
+def test_process_warm_up_runs_once_in_each_worker(tmp_path):
+    pool = InferencePool("process", workers=3)
+    try:
+        # The first worker done could otherwise pick up the other calls as well
+        pids = asyncio.run(pool.warm_up(slow_pid))
+        assert len(set(pids)) == 3
+        assert set(asyncio.run(pool.warm_up(functools.partial(slow_pid, 0.05)))) == set(pids)
+
+        with pytest.raises(ValueError, match="corrupt"):
+            asyncio.run(pool.warm_up(functools.partial(fail_in_one_worker, str(tmp_path / "marker"))))
+        # The barrier is usable again
+        assert set(asyncio.run(pool.warm_up(slow_pid))) == set(pids)
+    finally:
+        pool.shutdown()
+
+
+def test_thread_warm_up_runs_once():
+    pool = InferencePool("thread", workers=2)
+    calls = []
+    assert asyncio.run(pool.warm_up(lambda: calls.append(1) or "ready")) == ["ready"]
+    assert calls == [1]
+    pool.shutdown()
+
+
+def test_admission_is_bounded():
+    pool = InferencePool("thread", workers=1, queue_size=1)
+
+    async def submit_three():
+        jobs = [asyncio.ensure_future(pool.run(time.sleep, 0.2)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PoolFullError):
+            await pool.run(time.sleep, 0)
+        await asyncio.gather(*jobs)
+        assert pool.pending == 0
+
+    asyncio.run(submit_three())
+    pool.shutdown()
@@ -0,0 +1,32 @@
+import operator
+import os
+import stat
+import threading
+
+import pytest
+
+from inference_pool import RemoteInferencePool, parse_address
+from inference_server import InferenceServer
+
+
+def test_tcp_addresses_must_be_loopback():
+    assert parse_address("inference.sock") == "inference.sock"
+    assert parse_address("127.0.0.1:7000") == ("127.0.0.1", 7000)
+    assert parse_address("localhost:7000") == ("localhost", 7000)
+    assert parse_address("[::1]:7000") == ("::1", 7000)
+    for address in ("0.0.0.0:7000", "10.0.0.2:7000", "inference:7000"):
+        with pytest.raises(ValueError):
+            parse_address(address)
+    assert parse_address("10.0.0.2:7000", allow_remote=True) == ("10.0.0.2", 7000)
+
+
+def test_unix_socket_is_owner_only(tmp_path):
+    path = str(tmp_path / "inference.sock")
+    server = InferenceServer(path, b"secret")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    pool = RemoteInferencePool(path, b"secret")
+    assert pool._call(operator.add, (2, 3)) == 5
+    pool.shutdown()
+    server.listener.close()
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from jobs import JobStore, check_callback_url
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://0.0.0.0/hook",
+    "ftp://8.8.8.8/hook",
+    "file:///etc/passwd",
+])
+def test_internal_callbacks_are_rejected(url):
+    with pytest.raises(ValueError):
+        check_callback_url(url)
+
+
+def test_public_and_allowed_callbacks():
+    check_callback_url("https://8.8.8.8/hook")
+    check_callback_url("http://hooks.internal:9000/done", allowed_hosts=("hooks.internal",))
+    with pytest.raises(ValueError):
+        check_callback_url("https://8.8.8.8/hook", allowed_hosts=("hooks.internal",))
+
+
+@pytest.mark.parametrize("directory", [None, "store"])
+def test_queued_upload_round_trip(tmp_path, directory):
+    store = JobStore(directory=str(tmp_path / directory) if directory else None)
+    job_id = store.create(filename="scan.png")
+    path = store.save_upload(job_id, b"upload bytes")
+    assert store.load_upload(path) == b"upload bytes"
+    assert not os.path.exists(path)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from skimage import feature, measure, morphology
+from skimage.color import rgb2gray
+from skimage.measure import perimeter_crofton
+
+from image_processing import calculate_lesion_features, glcm_homogeneity
+
+RTOL = 1e-9
+PIXEL_SPACING = 0.07
+
+
+def calculate_lesion_features_reference(mask, image, pixel_spacing, min_area_px=10):
+    """The full-image implementation calculate_lesion_features replaced."""
+    if image.ndim == 3 and image.shape[2] == 3:
+        image = rgb2gray(image)
+    bin_mask = morphology.remove_small_objects(mask.astype(bool), max_size=min_area_px - 1)
+    region = measure.regionprops(measure.label(bin_mask), intensity_image=image)[0]
+
+    area_mm2 = region.area * (pixel_spacing ** 2)
+    perim_mm = perimeter_crofton(region.image, directions=4) * pixel_spacing
+    circularity = (4 * np.pi * area_mm2) / (perim_mm ** 2) if perim_mm > 0 else 0.0
+
+    minr, minc, maxr, maxc = region.bbox
+    patch = image[minr:maxr, minc:maxc]
+    homogeneity = np.nan
+    if patch.size >= 4:
+        patch_normalized = ((patch - patch.min()) / (patch.max() - patch.min() + 1e-7) * 255).astype(np.uint8)
+        quant = np.digitize(patch_normalized, np.linspace(0, 256, 17)) - 1
+        quant = np.where(region.image, quant, 16).astype(np.uint8)
+        glcm = feature.graycomatrix(quant, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4],
+                                    levels=17, symmetric=True, normed=True)
+        glcm_lesion = glcm[:16, :16, :, :]
+        if glcm_lesion.size and np.any(glcm_lesion):
+            homogeneity = float(np.mean(feature.graycoprops(glcm_lesion, 'homogeneity')))
+
+    return {
+        'morphology': {'area_mm2': area_mm2, 'perimeter_mm': perim_mm, 'circularity': circularity,
+                       'eccentricity': region.eccentricity},
+        'intensity': {'mean': region.intensity_mean, 'std_dev': region.intensity_std},
+        'texture': {'glcm_homogeneity': homogeneity}
+    }
+
+
+def assert_features_close(result, expected):
+    for group in expected:
+        for name, value in expected[group].items():
+            if np.isnan(value):
+                assert np.isnan(result[group][name]), f"{group}.{name}"
+            else:
+                assert result[group][name] == pytest.approx(value, rel=RTOL, abs=1e-12), f"{group}.{name}"
+
+
+@pytest.mark.filterwarnings("ignore::FutureWarning")
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_crop_features_match_full_image(lesion_case, seed):
+    image, detections = lesion_case(8, seed=seed)
+    assert len(detections)
+    for i in range(len(detections)):
+        expected = calculate_lesion_features_reference(detections.full_mask(i), image, PIXEL_SPACING)
+        cropped = calculate_lesion_features(detections.masks[i], image, PIXEL_SPACING, box=detections.boxes[i])
+        assert_features_close(cropped, expected)
+        # A full-image mask is cropped to its bounding box
+        assert_features_close(calculate_lesion_features(detections.full_mask(i), image, PIXEL_SPACING), expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_glcm_homogeneity_matches_scikit_image(seed):
+    rng = np.random.default_rng(seed)
+    quant = rng.integers(0, 16, (23, 31)).astype(np.uint8)
+    lesion = rng.random((23, 31)) < 0.7
+    masked = np.where(lesion, quant, 16).astype(np.uint8)
+    glcm = feature.graycomatrix(masked, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4],
+                                levels=17, symmetric=True, normed=True)[:16, :16]
+    expected = float(np.mean(feature.graycoprops(glcm, 'homogeneity')))
+    assert glcm_homogeneity(quant, lesion) == pytest.approx(expected, rel=RTOL)
+
+
+def test_glcm_homogeneity_without_pairs():
+    lesion = np.zeros((4, 4), dtype=bool)
+    lesion[0, 0] = True  # No neighbour in the lesion at any angle
+    assert np.isnan(glcm_homogeneity(np.zeros((4, 4), dtype=np.uint8), lesion))
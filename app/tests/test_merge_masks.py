@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from model_utils import masks_to_boxes, merge_overlapping_masks, pairwise_mask_iou
+
+HEIGHT, WIDTH = 240, 200
+
+
+def calculate_iou_reference(mask1, mask2):
+    intersection = np.logical_and(mask1, mask2)
+    union = np.logical_or(mask1, mask2)
+    return np.sum(intersection) / np.sum(union)
+
+
+def mask_to_box_reference(mask):
+    pos = np.where(mask)
+    if pos[0].size == 0 or pos[1].size == 0:
+        return [0, 0, 0, 0]
+    return [np.min(pos[1]), np.min(pos[0]), np.max(pos[1]), np.max(pos[0])]
+
+
+def merge_overlapping_masks_reference(masks, labels, scores, iou_threshold=0.0):
+    """The O(n²) full-resolution loop merge_overlapping_masks replaced."""
+    if len(masks) == 0:
+        return np.array([]), np.array([]), np.array([]), np.array([])
+
+    binary_masks = np.stack([(mask.squeeze() > 0.5).astype(np.float32) for mask in masks])
+    merged_masks, merged_labels, merged_scores, merged_boxes = [], [], [], []
+    used_indices = set()
+
+    for i in range(len(binary_masks)):
+        if i in used_indices:
+            continue
+        merge_candidates = [i]
+        for j in range(i + 1, len(binary_masks)):
+            if (j not in used_indices and
+                labels[j] == labels[i] and
+                calculate_iou_reference(binary_masks[i], binary_masks[j]) > iou_threshold):
+                merge_candidates.append(j)
+
+        if len(merge_candidates) > 1:
+            combined_mask = np.max(binary_masks[merge_candidates], axis=0)
+            max_score = max(scores[merge_candidates])
+        else:
+            combined_mask = binary_masks[i]
+            max_score = scores[i]
+
+        merged_masks.append(combined_mask)
+        merged_labels.append(labels[i])
+        merged_scores.append(max_score)
+        merged_boxes.append(mask_to_box_reference(combined_mask))
+        used_indices.update(merge_candidates)
+
+    return np.stack(merged_masks), np.array(merged_labels), np.array(merged_scores), np.array(merged_boxes)
+
+
+def blobs(centers, radii):
+    """Soft elliptical blobs shaped like Mask R-CNN outputs (N, 1, H, W)."""
+    yy, xx = np.mgrid[:HEIGHT, :WIDTH]
+    masks = np.zeros((len(centers), 1, HEIGHT, WIDTH), dtype=np.float32)
+    for k, ((cy, cx), (ry, rx)) in enumerate(zip(centers, radii)):
+        masks[k, 0] = np.clip(1.5 - ((yy - cy) / ry) ** 2 - ((xx - cx) / rx) ** 2, 0, 1)
+    return masks
+
+
+def random_detections(n, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, 1, (n, 2)) * [HEIGHT, WIDTH]
+    masks = blobs(centers, rng.uniform(5, 50, (n, 2)))
+    return masks, rng.integers(1, 3, size=n), rng.uniform(0.5, 1.0, size=n).astype(np.float32)
+
+
+def assert_same_merge(masks, labels, scores):
+    reference = merge_overlapping_masks_reference(masks, labels, scores)
+    merged = merge_overlapping_masks(masks, labels, scores)
+    for expected, actual in zip(reference, merged):
+        assert actual.dtype == expected.dtype
+        assert np.array_equal(actual, expected)
+    return merged
+
+
+def test_no_detection():
+    masks = np.zeros((0, 1, HEIGHT, WIDTH), dtype=np.float32)
+    merged = assert_same_merge(masks, np.array([]), np.array([]))
+    assert all(len(output) == 0 for output in merged)
+
+
+def test_single_detection():
+    masks, labels, scores = random_detections(1, seed=1)
+    assert len(assert_same_merge(masks, labels, scores)[0]) == 1
+
+
+def test_all_overlapping_merge_into_one():
+    n = 5
+    masks = blobs([(120, 100)] * n, [(20 + 5 * k, 30) for k in range(n)])
+    scores = np.linspace(0.6, 0.9, n).astype(np.float32)
+    merged_masks, merged_labels, merged_scores, _ = assert_same_merge(masks, np.ones(n, dtype=np.int64), scores)
+    assert len(merged_masks) == 1 and merged_scores[0] == scores.max()
+
+
+def test_none_overlapping_are_kept():
+    centers = [(30 + 60 * (k // 3), 30 + 60 * (k % 3)) for k in range(9)]
+    masks = blobs(centers, [(15, 15)] * 9)
+    merged = assert_same_merge(masks, np.ones(9, dtype=np.int64), np.full(9, 0.8, dtype=np.float32))
+    assert len(merged[0]) == 9
+
+
+def test_overlapping_masks_of_other_classes_are_kept():
+    masks = blobs([(120, 100)] * 2, [(30, 30), (25, 25)])
+    merged = assert_same_merge(masks, np.array([1, 2]), np.array([0.7, 0.9], dtype=np.float32))
+    assert len(merged[0]) == 2
+
+
+@pytest.mark.parametrize("n, seed", [(5, 0), (20, 1), (50, 2)])
+def test_random_masks_match_reference(n, seed):
+    assert_same_merge(*random_detections(n, seed))
+
+
+def test_pairwise_iou_matches_reference():
+    masks, labels, _ = random_detections(12, seed=3)
+    masks[4] = 0  # An empty mask
+    binary_masks = masks[:, 0] > 0.5
+    boxes, empty = masks_to_boxes(binary_masks)
+    assert np.array_equal(boxes, [mask_to_box_reference(mask) for mask in binary_masks])
+
+    iou = pairwise_mask_iou(binary_masks, boxes, empty)
+    for i in range(len(masks)):
+        for j in range(len(masks)):
+            if i != j:
+                assert iou[i, j] == pytest.approx(calculate_iou_reference(binary_masks[i], binary_masks[j]))
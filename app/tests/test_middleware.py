@@ -0,0 +1,21 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_oversize_upload_answer_has_cors_headers():
+    # No lifespan: the body limit answers before any model is needed
+    client = TestClient(main.app)
+    body = b"0" * (main.MAX_FILE_SIZE + main.MULTIPART_OVERHEAD + 1)
+    response = client.post("/predict", content=body, headers={
+        "Origin": "https://viewer.example", "Content-Type": "application/octet-stream"
+    })
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "*"
+
+
+def test_middleware_order():
+    # The first in user_middleware is the outermost one
+    assert [middleware.cls.__name__ for middleware in main.app.user_middleware] == [
+        "CORSMiddleware", "MaxBodySizeMiddleware", "BaseHTTPMiddleware"
+    ]
@@ -0,0 +1,122 @@
+import json
+import socket
+import time
+from email.message import EmailMessage
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+from config import Settings  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+
+class Recorder:
+    """aiosmtpd handler keeping the envelopes it receives."""
+
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def smtp_server(port):
+    handler = Recorder()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    return controller, handler
+
+
+def local_settings(port):
+    return Settings(smtp_host="127.0.0.1", smtp_port=port, smtp_ssl=False, smtp_timeout=5)
+
+
+def message(recipient):
+    msg = EmailMessage()
+    msg["From"] = "safescan@example.com"
+    msg["To"] = recipient
+    msg["Subject"] = "SafeScan Contact: test"
+    msg.set_content("Hello")
+    return msg
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_delivery(tmp_path):
+    port = free_port()
+    controller, handler = smtp_server(port)
+    path = tmp_path / "outbox.json"
+    outbox = Outbox(local_settings(port), path=str(path))
+    outbox.start()
+    try:
+        outbox.enqueue(message("team@example.com"), "team@example.com")
+        wait_for(lambda: outbox.pending() == 0)
+    finally:
+        outbox.stop()
+        controller.stop()
+    assert [envelope.rcpt_tos for envelope in handler.envelopes] == [["team@example.com"]]
+    assert b"Subject: SafeScan Contact: test" in handler.envelopes[0].content
+    assert json.loads(path.read_text()) == []
+
+
+def test_retry_with_backoff():
+    port = free_port()  # Nothing listens yet: the first attempt fails
+    outbox = Outbox(local_settings(port), backoff=0.5)
+    outbox.start()
+    controller = None
+    try:
+        failed_at = time.time()
+        outbox.enqueue(message("team@example.com"), "team@example.com")
+        wait_for(lambda: outbox._pending and outbox._pending[0]["attempts"] == 1)
+        item = outbox._pending[0]
+        assert item["next_attempt_at"] - failed_at == pytest.approx(0.5, abs=0.4)
+
+        controller, handler = smtp_server(port)
+        wait_for(lambda: outbox.pending() == 0)
+        assert time.time() >= item["next_attempt_at"]
+        assert len(handler.envelopes) == 1
+    finally:
+        outbox.stop()
+        if controller is not None:
+            controller.stop()
+
+
+def test_replay_from_file(tmp_path):
+    port = free_port()
+    path = str(tmp_path / "outbox.json")
+    # Queued by a process that stopped before sending (its thread never started)
+    Outbox(local_settings(port), path=path).enqueue(message("team@example.com"), "team@example.com")
+    assert len(json.loads(open(path).read())) == 1
+
+    controller, handler = smtp_server(port)
+    outbox = Outbox(local_settings(port), path=path)
+    assert outbox.pending() == 1
+    outbox.start()
+    try:
+        wait_for(lambda: outbox.pending() == 0)
+    finally:
+        outbox.stop()
+        controller.stop()
+    assert [envelope.rcpt_tos for envelope in handler.envelopes] == [["team@example.com"]]
+    assert json.loads(open(path).read()) == []
+
+
+def test_no_file_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    outbox = Outbox(local_settings(free_port()))
+    outbox.enqueue(message("team@example.com"), "team@example.com")
+    assert outbox.pending() == 1
+    assert list(tmp_path.iterdir()) == []
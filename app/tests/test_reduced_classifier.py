@@ -0,0 +1,69 @@
+import joblib
+import numpy as np
+import pytest
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+from sklearn.random_projection import GaussianRandomProjection
+
+from classifier_utils import load_classifier, predict_labels
+from reduced_classifier import ReducedClassifier, build_light_classifier
+
+SAMPLES, DIMENSION, COMPONENTS = 300, 64, 8
+
+
+def synthetic_features(seed=0):
+    """Low-rank features with uneven scales, offsets and a constant column, and labels they separate."""
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=(SAMPLES, COMPONENTS)) * np.linspace(8, 1, COMPONENTS)
+    features = latent @ rng.normal(size=(COMPONENTS, DIMENSION)) + 0.1 * rng.normal(size=(SAMPLES, DIMENSION))
+    features = features * rng.uniform(0.5, 20, DIMENSION) + rng.uniform(-50, 50, DIMENSION)
+    features[:, 3] = 7.0
+    labels = (latent[:, 0] + 0.5 * latent[:, 1] > 0).astype(int)
+    return features.astype(np.float32), labels
+
+
+def step_by_step(features, projection, seed=42):
+    """Scaler, projection and standardization of the projected values as separate sklearn steps."""
+    scaler = StandardScaler().fit(features)
+    standardized = scaler.transform(features).astype(np.float32)
+    if projection == "pca":
+        projector = PCA(n_components=COMPONENTS, svd_solver="randomized", random_state=seed)
+    else:
+        projector = GaussianRandomProjection(n_components=COMPONENTS, random_state=seed)
+    projected = projector.fit_transform(standardized)
+    return StandardScaler().fit_transform(projected)
+
+
+@pytest.mark.parametrize("projection", ["pca", "random"])
+def test_fused_transform_matches_sequential_steps(projection):
+    features, labels = synthetic_features()
+    model = ReducedClassifier.fit(features, labels, COMPONENTS, projection)
+    fused = model.transform(features)
+    assert fused.shape == (SAMPLES, COMPONENTS) and fused.dtype == np.float32
+    assert np.allclose(fused, step_by_step(features, projection), rtol=1e-3, atol=1e-3)
+    assert np.allclose(fused.mean(axis=0), 0, atol=1e-4) and np.allclose(fused.std(axis=0), 1, atol=1e-3)
+
+    # The classifier is the light classifier fitted on the sequential output
+    reference = build_light_classifier("logistic").fit(step_by_step(features, projection), labels)
+    assert (model.predict(features) == reference.predict(step_by_step(features, projection))).mean() > 0.99
+
+
+def test_unknown_projection_is_rejected():
+    features, labels = synthetic_features()
+    with pytest.raises(ValueError):
+        ReducedClassifier.fit(features, labels, COMPONENTS, "umap")
+
+
+@pytest.mark.parametrize("classifier", ["logistic", "linear-svm", "rbf-svm"])
+def test_saved_model_predicts_the_same(tmp_path, classifier):
+    features, labels = synthetic_features()
+    model = ReducedClassifier.fit(features[:200], labels[:200], COMPONENTS, classifier=classifier)
+    path = str(tmp_path / "reduced_classifier.joblib")
+    joblib.dump(model, path)
+
+    loaded = load_classifier("reduced", path)
+    assert isinstance(loaded, ReducedClassifier) and loaded.info == model.info
+    assert np.array_equal(loaded.weights, model.weights) and np.array_equal(loaded.bias, model.bias)
+    assert np.array_equal(predict_labels(loaded, features[200:]), model.predict(features[200:]))
+    assert np.array_equal(loaded.decision_function(features[200:]), model.decision_function(features[200:]))
+    assert (loaded.predict(features[200:]) == labels[200:]).mean() > 0.8
@@ -0,0 +1,168 @@
+import cv2
+import numpy as np
+import pytest
+
+import image_processing
+from image_processing import CONTOUR_COLOR, COLOR, CUSTOM_CLASSES, render_predictions, set_render_options
+
+
+@pytest.fixture(autouse=True)
+def default_render_options():
+    set_render_options()
+    yield
+    set_render_options()
+
+
+def draw_rounded_rectangle_reference(img, top_left, bottom_right, color, corner_radius=10, thickness=-1, alpha=0.6):
+    overlay = img.copy()
+    x1, y1 = top_left
+    x2, y2 = bottom_right
+    cv2.rectangle(overlay, (x1 + corner_radius, y1), (x2 - corner_radius, y2), color, thickness)
+    cv2.rectangle(overlay, (x1, y1 + corner_radius), (x2, y2 - corner_radius), color, thickness)
+    cv2.circle(overlay, (x1 + corner_radius, y1 + corner_radius), corner_radius, color, thickness)
+    cv2.circle(overlay, (x2 - corner_radius, y1 + corner_radius), corner_radius, color, thickness)
+    cv2.circle(overlay, (x1 + corner_radius, y2 - corner_radius), corner_radius, color, thickness)
+    cv2.circle(overlay, (x2 - corner_radius, y2 - corner_radius), corner_radius, color, thickness)
+    cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, img)
+    return img
+
+
+def label_layout(image_shape, box, label_text):
+    """Text origin and background corners of a detection's label."""
+    image_height, image_width = image_shape[:2]
+    xmin, ymin, xmax, ymax = map(int, box)
+    (text_w, text_h), baseline = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_DUPLEX, 1.6, 2)
+    box_center = (xmin + xmax) // 2
+    text_x = max(0, min(box_center - text_w // 2, image_width - text_w))
+    text_y = ymin - 10
+    if text_y - text_h < 0:
+        text_y = ymax + text_h + 10
+        if text_y + baseline > image_height:
+            text_y = ymin + (ymax - ymin) // 2
+    bg_top_left = (max(0, text_x - 5), max(0, text_y - text_h - 5))
+    bg_bottom_right = (min(image_width, text_x + text_w + 5), min(image_height, text_y + 5))
+    return (text_x, text_y), bg_top_left, bg_bottom_right
+
+
+def label_text(predictions, i):
+    return f"{int(predictions.scores[i] * 100)}% {CUSTOM_CLASSES[predictions.labels[i] - 1]}"
+
+
+def render_predictions_reference(image_np, predictions):
+    """The full-image implementation render_predictions replaced."""
+    boxes, labels, scores = predictions.boxes, predictions.labels, predictions.scores
+    output = []
+    full_image = image_np.copy()
+    _, normal = cv2.imencode('.jpg', cv2.cvtColor(full_image, cv2.COLOR_RGB2BGR))
+    image_height, image_width = image_np.shape[:2]
+    colored_mask = np.zeros_like(image_np)
+
+    for i, (box, label, cls_result) in enumerate(zip(boxes, labels, predictions.classification)):
+        xmin, ymin, xmax, ymax = map(int, box)
+        mask = predictions.full_mask(i)
+        if CUSTOM_CLASSES[label - 1] == 'mass':
+            color_tbm, color_c = COLOR[0], CONTOUR_COLOR[0]
+        else:
+            color_tbm, color_c = COLOR[1], CONTOUR_COLOR[1]
+        colored_mask[:] = color_tbm
+
+        text = label_text(predictions, i)
+        font = cv2.FONT_HERSHEY_DUPLEX
+        text_org, bg_top_left, bg_bottom_right = label_layout(image_np.shape, box, text)
+
+        cv2.rectangle(full_image, (xmin, ymin), (xmax, ymax), color_tbm, 2)
+        draw_rounded_rectangle_reference(full_image, bg_top_left, bg_bottom_right, color_tbm, 8, alpha=0.6)
+        cv2.putText(full_image, text, text_org, font, 1.6, (255, 255, 255), 2)
+        full_image = np.where(mask[..., None], cv2.addWeighted(full_image, 1, colored_mask, 0.3, 0), full_image)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cv2.drawContours(full_image, contours, -1, color_c, 2)
+
+        single_pred = image_np.copy()
+        cv2.rectangle(single_pred, (xmin, ymin), (xmax, ymax), color_tbm, 2)
+        draw_rounded_rectangle_reference(single_pred, bg_top_left, bg_bottom_right, color_tbm, 8, alpha=0.6)
+        cv2.putText(single_pred, text, text_org, font, 1.6, (255, 255, 255), 2)
+        single_pred = np.where(mask[..., None], cv2.addWeighted(single_pred, 1, colored_mask, 0.3, 0), single_pred)
+        cv2.drawContours(single_pred, contours, -1, color_c, 2)
+        _, buffer = cv2.imencode('.jpg', cv2.cvtColor(single_pred, cv2.COLOR_RGB2BGR))
+
+        x1, y1 = max(0, xmin - 100), max(0, ymin - 100)
+        x2, y2 = min(image_width, xmax + 100), min(image_height, ymax + 100)
+        _, buf = cv2.imencode('.jpg', cv2.cvtColor(image_np[y1:y2, x1:x2], cv2.COLOR_RGB2BGR))
+        output.append({'image': buffer.tobytes(), 'label': CUSTOM_CLASSES[label - 1], 'classification': cls_result,
+                       'score': float(scores[i]), 'features': None, 'crop': buf.tobytes()})
+
+    _, buffer = cv2.imencode('.jpg', cv2.cvtColor(full_image, cv2.COLOR_RGB2BGR))
+    return {"full_image": buffer.tobytes(), "detections": True, "full_Normal_image": normal.tobytes(),
+            "individual_predictions": output}
+
+
+def decode(jpeg):
+    return cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+
+def all_jpegs(result):
+    yield result["full_image"]
+    yield result["full_Normal_image"]
+    for prediction in result["individual_predictions"]:
+        yield prediction["image"]
+        yield prediction["crop"]
+
+
+@pytest.mark.parametrize("n, seed", [(0, 0), (1, 1), (5, 2), (12, 3)])
+def test_full_view_is_byte_identical_to_reference(lesion_case, n, seed):
+    image, detections = lesion_case(n, seed=seed)
+    assert render_predictions(image, detections) == render_predictions_reference(image, detections)
+
+
+def test_crop_view_is_the_full_view_window(lesion_case, monkeypatch):
+    # Compare the drawn pixels before JPEG encoding
+    monkeypatch.setattr(image_processing, "encode_jpeg", lambda image, timings=None: image.copy())
+    image, detections = lesion_case(6, seed=4)
+    set_render_options("full")
+    full = render_predictions(image, detections)
+    set_render_options("crop")
+    crop = render_predictions(image, detections)
+
+    assert np.array_equal(crop["full_image"], full["full_image"])
+    height, width = image.shape[:2]
+    for i, (full_pred, crop_pred) in enumerate(zip(full["individual_predictions"],
+                                                   crop["individual_predictions"])):
+        assert np.array_equal(crop_pred["crop"], full_pred["crop"])
+        xmin, ymin, xmax, ymax = map(int, detections.boxes[i])
+        _, bg_top_left, bg_bottom_right = label_layout(image.shape, detections.boxes[i], label_text(detections, i))
+        vx1, vy1 = min(max(0, xmin - 100), bg_top_left[0]), min(max(0, ymin - 100), bg_top_left[1])
+        vx2 = max(min(width, xmax + 100), min(width, bg_bottom_right[0] + 1))
+        vy2 = max(min(height, ymax + 100), min(height, bg_bottom_right[1] + 1))
+        assert np.array_equal(crop_pred["image"], full_pred["image"][vy1:vy2, vx1:vx2])
+        # Nothing is drawn outside the window
+        outside = full_pred["image"] != image
+        outside[vy1:vy2, vx1:vx2] = False
+        assert not outside.any()
+
+
+def test_max_side_limits_every_image(lesion_case):
+    image, detections = lesion_case(5, seed=5)
+    set_render_options("crop", max_side=300)
+    result = render_predictions(image, detections)
+    assert decode(result["full_image"]).shape[:2] == (300, 250)
+    for jpeg in all_jpegs(result):
+        assert max(decode(jpeg).shape[:2]) <= 300
+
+
+def test_max_side_keeps_smaller_images(lesion_case):
+    image, detections = lesion_case(3, seed=6)
+    set_render_options("full", max_side=1000)
+    assert render_predictions(image, detections) == render_predictions_reference(image, detections)
+
+
+def test_lower_quality_gives_smaller_images(lesion_case):
+    image, detections = lesion_case(3, seed=7)
+    default = render_predictions(image, detections)
+    set_render_options("full", jpeg_quality=50)
+    lighter = render_predictions(image, detections)
+    assert sum(map(len, all_jpegs(lighter))) < sum(map(len, all_jpegs(default)))
+
+
+def test_unknown_detection_view_is_rejected():
+    with pytest.raises(ValueError):
+        set_render_options("roi")
@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from artifact_store import ArtifactStore
+from response_formats import build_response, negotiate_format, parse_exclude
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(8)
+JPEG = b"\xff\xd8\xff\xe0" + bytes(8)
+
+
+def payload():
+    return {
+        "full_image": JPEG,
+        "full_Normal_image": PNG,
+        "detections": True,
+        "individual_predictions": [
+            {"image": JPEG + b"0", "crop": JPEG + b"1", "label": "mass", "score": 0.9},
+            {"image": JPEG + b"2", "crop": JPEG + b"3", "label": "calcification", "score": 0.7},
+        ],
+    }
+
+
+def artifact_url(artifact_id):
+    return f"/artifacts/{artifact_id}"
+
+
+def test_negotiate_format():
+    assert negotiate_format() == "json"
+    assert negotiate_format(accept="application/json") == "json"
+    assert negotiate_format(accept="multipart/mixed, application/json") == "multipart"
+    assert negotiate_format("refs", accept="multipart/mixed") == "refs"
+    with pytest.raises(ValueError):
+        negotiate_format("xml")
+
+
+def test_parse_exclude():
+    assert parse_exclude() == set()
+    assert parse_exclude(" full_Normal_image, image,,") == {"full_Normal_image", "image"}
+    with pytest.raises(ValueError, match="labels"):
+        parse_exclude("crop,labels")
+
+
+def test_json_inlines_base64_and_drops_excluded():
+    response = build_response(payload(), exclude={"full_Normal_image", "crop"})
+    content = json.loads(response.body)
+    assert base64.b64decode(content["full_image"]) == JPEG
+    assert "full_Normal_image" not in content
+    first = content["individual_predictions"][0]
+    assert base64.b64decode(first["image"]) == JPEG + b"0" and "crop" not in first
+    assert first["label"] == "mass" and first["score"] == 0.9
+
+
+def test_refs_point_to_the_store():
+    store = ArtifactStore()
+    response = build_response(payload(), "refs", store=store, artifact_url=artifact_url)
+    content = json.loads(response.body)
+    artifact_id = content["full_Normal_image"].removeprefix("/artifacts/")
+    assert store.get(artifact_id) == ("image/png", PNG)
+    artifact_id = content["individual_predictions"][1]["crop"].removeprefix("/artifacts/")
+    assert store.get(artifact_id) == ("image/jpeg", JPEG + b"3")
+
+
+def test_refs_inline_images_too_large_for_the_store():
+    store = ArtifactStore(max_bytes=len(JPEG))
+    response = build_response(payload(), "refs", store=store, artifact_url=artifact_url)
+    content = json.loads(response.body)
+    assert content["full_image"].startswith("/artifacts/")
+    assert base64.b64decode(content["individual_predictions"][0]["image"]) == JPEG + b"0"
+
+
+def read_multipart(response):
+    async def collect():
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    media_type, boundary = response.media_type.split("; boundary=")
+    assert media_type == "multipart/mixed"
+    body = asyncio.run(collect())
+    assert body.startswith(f"--{boundary}\r\n".encode()) and body.endswith(f"\r\n--{boundary}--\r\n".encode())
+    parts = []
+    for part in body[len(boundary) + 4:-len(boundary) - 8].split(f"\r\n--{boundary}\r\n".encode()):
+        head, content = part.split(b"\r\n\r\n", 1)
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        if "Content-Length" in headers:
+            assert int(headers["Content-Length"]) == len(content)
+        parts.append((headers["Content-ID"].strip("<>"), headers["Content-Type"], content))
+    return parts
+
+
+def test_multipart_references_one_part_per_image():
+    parts = read_multipart(build_response(payload(), "multipart", exclude={"crop"}))
+    name, media_type, metadata = parts[0]
+    assert (name, media_type) == ("metadata", "application/json")
+    metadata = json.loads(metadata)
+    assert metadata["full_image"] == "cid:full_image"
+    assert metadata["individual_predictions"][1] == {
+        "image": "cid:prediction-1-image", "label": "calcification", "score": 0.7}
+
+    images = {name: (media_type, content) for name, media_type, content in parts[1:]}
+    assert images == {
+        "full_image": ("image/jpeg", JPEG),
+        "full_Normal_image": ("image/png", PNG),
+        "prediction-0-image": ("image/jpeg", JPEG + b"0"),
+        "prediction-1-image": ("image/jpeg", JPEG + b"2"),
+    }
+
+
+def test_multipart_of_a_study_prefixes_each_image():
+    study = {"images": [payload(), payload()], "study_id": "s1"}
+    parts = read_multipart(build_response(study, "multipart"))
+    metadata = json.loads(parts[0][2])
+    assert metadata["study_id"] == "s1"
+    assert metadata["images"][1]["individual_predictions"][0]["crop"] == "cid:image-1-prediction-0-crop"
+    assert len(parts) == 1 + 2 * 6
+    assert {name for name, _, _ in parts[1:]} >= {"image-0-full_image", "image-1-prediction-1-image"}
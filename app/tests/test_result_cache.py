@@ -0,0 +1,30 @@
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def test_key_depends_on_extension_and_namespace():
+    cache = ResultCache(namespace="eager|False|voi")
+    other_models = ResultCache(namespace="onnx|True|voi")
+    assert cache.key(b"pixels", ".png") == cache.key(b"pixels", ".png")
+    assert cache.key(b"pixels", ".png") != cache.key(b"pixels", ".dcm")
+    assert cache.key(b"pixels", ".png") != other_models.key(b"pixels", ".png")
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path), disk_max_bytes=3000)
+    for i in range(10):
+        cache.put(f"key{i}", bytes(1000))
+    files = sorted(os.listdir(tmp_path))
+    assert sum(os.path.getsize(tmp_path / name) for name in files) <= 3000
+    assert "key9.pkl" in files and "key0.pkl" not in files
+
+
+def test_expired_files_are_purged(tmp_path):
+    cache = ResultCache(ttl=60, disk_dir=str(tmp_path))
+    cache.put("old", "value")
+    stale = time.time() - 120
+    os.utime(tmp_path / "old.pkl", (stale, stale))
+    cache.put("new", "value")
+    assert os.listdir(tmp_path) == ["new.pkl"]
@@ -0,0 +1,25 @@
+import torch
+
+import runtime
+from runtime import ThreadBudget, apply_thread_budget
+
+
+def test_a_late_setting_does_not_stop_the_others(monkeypatch, capsys):
+    import tensorflow as tf
+
+    def already_initialized(threads):
+        raise RuntimeError("interop threads already set")
+
+    applied = {}
+    monkeypatch.setattr(torch, "set_num_interop_threads", already_initialized)
+    monkeypatch.setattr(tf.config.threading, "set_intra_op_parallelism_threads",
+                        lambda threads: applied.setdefault("intra", threads))
+    monkeypatch.setattr(tf.config.threading, "set_inter_op_parallelism_threads",
+                        lambda threads: applied.setdefault("inter", threads))
+    monkeypatch.setattr(runtime, "thread_budget", None)
+    budget = ThreadBudget(cpus=4, workers=1, torch_interop=1, tf_intra_op=3, tf_inter_op=2)
+    apply_thread_budget(budget)
+
+    assert applied == {"intra": 3, "inter": 2}
+    assert "torch interop threads not set to 1" in capsys.readouterr().out
+    assert runtime.thread_budget is budget
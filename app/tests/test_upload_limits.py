@@ -0,0 +1,37 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from upload_limits import read_upload, read_uploads
+
+
+def upload(size, declared=False):
+    return UploadFile(io.BytesIO(bytes(size)), size=size if declared else None)
+
+
+def test_read_upload_stops_past_the_limit():
+    assert asyncio.run(read_upload(upload(100), 100, chunk_size=30)) == bytes(100)
+    for file in (upload(101), upload(101, declared=True)):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(read_upload(file, 100, chunk_size=30))
+        assert error.value.status_code == 413
+
+
+def test_read_uploads_bounds_each_file_and_the_total():
+    contents = asyncio.run(read_uploads([upload(60), upload(60), upload(30)], 60, 150))
+    assert [len(content) for content in contents] == [60, 60, 30]
+
+    with pytest.raises(HTTPException, match="too large together"):
+        asyncio.run(read_uploads([upload(60), upload(60), upload(31)], 60, 150))
+    with pytest.raises(HTTPException, match="File is too large"):
+        asyncio.run(read_uploads([upload(10), upload(61)], 60, 150))
+
+
+def test_read_uploads_stops_reading_once_over_budget():
+    files = [upload(60), upload(60), upload(60)]
+    with pytest.raises(HTTPException):
+        asyncio.run(read_uploads(files, 60, 100))
+    # The third file is never read
+    assert files[2].file.tell() == 0
@@ -0,0 +1,165 @@
+"""
+Train the reduced-dimension classifier (CLASSIFIER_RUNTIME=reduced) and report
+its accuracy and per-ROI latency next to the current scaler + SVM.
+
+Uses the dataset layout and the split of the training notebook
+(used models+training/classification model/training.ipynb): 224x224
+grayscale crops in {test,train,valid}/{benign,malignant}/, merged, then an
+80/20 stratified split with random_state=42. Features are the serving ones
+(extract_deep_features: DenseNet121 then ConvNeXtTiny, flattened).
+
+    python train_reduced_classifier.py --data ClassifBegninMalign+ddsm-2 --save-features features.npz
+    python train_reduced_classifier.py --features features.npz --projection pca --components 256 --classifier logistic
+"""
+import argparse
+import json
+import os
+import pickle
+import time
+
+import cv2
+import joblib
+import numpy as np
+from sklearn.metrics import accuracy_score, balanced_accuracy_score, confusion_matrix, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from reduced_classifier import LIGHT_CLASSIFIERS, PROJECTIONS, ReducedClassifier
+
+
+def load_dataset(data_dir):
+    """RGB 224x224 crops and labels (0 benign, 1 malignant), as load_data in the notebook."""
+    images, labels = [], []
+    for split in ["test", "train", "valid"]:
+        for label in ["benign", "malignant"]:
+            class_dir = os.path.join(data_dir, split, label)
+            # os.listdir order, as in the notebook, so the split picks the same crops
+            for name in os.listdir(class_dir):
+                gray = cv2.imread(os.path.join(class_dir, name), cv2.IMREAD_GRAYSCALE)
+                if gray is None:
+                    continue
+                images.append(cv2.cvtColor(cv2.resize(gray, (224, 224)), cv2.COLOR_GRAY2RGB))
+                labels.append(0 if label == "benign" else 1)
+    return np.array(images), np.array(labels)
+
+
+def extract_features(images, feature_backend, batch_size):
+    from classifier_utils import extract_deep_features, load_feature_extractors, set_feature_backend
+
+    load_feature_extractors()
+    set_feature_backend(feature_backend)
+    batches = []
+    for start in range(0, len(images), batch_size):
+        batches.append(extract_deep_features(images[start:start + batch_size]).astype(np.float32))
+        print(f"Features: {min(start + batch_size, len(images))}/{len(images)}")
+    return np.vstack(batches)
+
+
+def per_roi_latency_ms(predict, features, repeat=50):
+    """Median time of one ROI, and the time per ROI of the whole test set as one batch."""
+    single = []
+    for i in range(repeat):
+        row = features[i % len(features)][None]
+        start = time.perf_counter()
+        predict(row)
+        single.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    predict(features)
+    batched = (time.perf_counter() - start) * 1000 / len(features)
+    return round(float(np.median(single)), 3), round(batched, 4)
+
+
+def evaluate(name, predict, decision, features, labels, size_bytes):
+    predictions = predict(features)
+    single_ms, batched_ms = per_roi_latency_ms(predict, features)
+    return {
+        "model": name,
+        "accuracy": round(accuracy_score(labels, predictions), 4),
+        "balanced_accuracy": round(balanced_accuracy_score(labels, predictions), 4),
+        "roc_auc": round(roc_auc_score(labels, decision(features)), 4),
+        "confusion_matrix": confusion_matrix(labels, predictions).tolist(),
+        "roi_latency_ms": single_ms,
+        "batched_roi_latency_ms": batched_ms,
+        "size_mb": round(size_bytes / 1024 ** 2, 1),
+    }
+
+
+def current_model_report(features, labels):
+    """The serving scaler + SVM on the same test features, or None if models/ does not have them."""
+    import classifier_utils
+    from classifier_utils import load_classifier, load_scaler, predict_labels
+
+    try:
+        svm = load_classifier("svm")
+        load_scaler()
+    except FileNotFoundError as e:
+        print(f"Current model not compared: {e}")
+        return None
+    size = len(pickle.dumps(svm)) + len(pickle.dumps(classifier_utils.scaler))
+    return evaluate(
+        "scaler + SVM (current)",
+        lambda x: predict_labels(svm, x),
+        lambda x: svm.decision_function(classifier_utils.scaler.transform(x)),
+        features, labels, size
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--data", help="Dataset folder in the notebook layout")
+    parser.add_argument("--features", help="Features saved by --save-features, instead of --data")
+    parser.add_argument("--save-features", help="Save the extracted features and labels (.npz)")
+    parser.add_argument("--feature-backend", choices=["keras", "fused"], default="fused")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--projection", choices=PROJECTIONS, default="pca")
+    parser.add_argument("--components", type=int, default=256)
+    parser.add_argument("--classifier", choices=LIGHT_CLASSIFIERS, default="logistic")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join("models", "reduced_classifier.joblib"))
+    parser.add_argument("--report", help="Write the JSON report here")
+    parser.add_argument("--skip-current", action="store_true", help="Do not evaluate the current scaler + SVM")
+    args = parser.parse_args()
+
+    if args.features:
+        saved = np.load(args.features)
+        features, labels = saved["features"], saved["labels"]
+    elif args.data:
+        images, labels = load_dataset(args.data)
+        features = extract_features(images, args.feature_backend, args.batch_size)
+        if args.save_features:
+            np.savez(args.save_features, features=features, labels=labels)
+    else:
+        parser.error("Give --data or --features")
+    print(f"{len(features)} crops, {features.shape[1]} features")
+
+    train_features, test_features, train_labels, test_labels = train_test_split(
+        features, labels, test_size=0.2, stratify=labels, random_state=42
+    )
+    start = time.perf_counter()
+    reduced = ReducedClassifier.fit(train_features, train_labels, args.components, args.projection,
+                                    args.classifier, args.seed)
+    reduced.info["training_seconds"] = round(time.perf_counter() - start, 1)
+    joblib.dump(reduced, args.output)
+    print(f"Saved {args.output}")
+
+    results = []
+    if not args.skip_current:
+        current = current_model_report(test_features, test_labels)
+        if current is not None:
+            results.append(current)
+    results.append(evaluate(
+        f"{args.projection} {args.components} + {args.classifier} (reduced)",
+        reduced.predict, reduced.decision_function, test_features, test_labels, len(pickle.dumps(reduced))
+    ))
+
+    print(f"{'model':>36} {'acc':>6} {'bal acc':>8} {'AUC':>6} {'ROI ms':>8} {'batched':>8} {'MB':>7}")
+    for result in results:
+        print(f"{result['model']:>36} {result['accuracy']:>6.3f} {result['balanced_accuracy']:>8.3f} "
+              f"{result['roc_auc']:>6.3f} {result['roi_latency_ms']:>8.3f} {result['batched_roi_latency_ms']:>8.4f} "
+              f"{result['size_mb']:>7.1f}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"reduced": reduced.info, "test_samples": len(test_features), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
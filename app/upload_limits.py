@@ -0,0 +1,112 @@
+from fastapi import HTTPException, UploadFile
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+class BodyTooLargeError(Exception):
+    """Raised from the receive channel once a request body crosses the limit."""
+
+
+class MaxBodySizeMiddleware:
+    """
+    ASGI middleware rejecting request bodies larger than `max_body_size` with 413.
+    A declared Content-Length is checked before anything is read; otherwise the
+    body is counted as it streams in and the request is aborted as soon as the
+    limit is crossed, so oversize uploads are never buffered whole.
+    `path_limits` overrides the limit for some path prefixes (the longest
+    matching prefix wins).
+    """
+
+    def __init__(self, app, max_body_size: int, path_prefixes=("/",), path_limits=None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_prefixes = tuple(path_prefixes)
+        # Longest prefixes first
+        self.path_limits = sorted((path_limits or {}).items(), key=lambda item: -len(item[0]))
+
+    def _limit_for(self, path: str) -> int:
+        for prefix, limit in self.path_limits:
+            if path.startswith(prefix):
+                return limit
+        return self.max_body_size
+
+    async def _reject(self, send):
+        body = b'{"detail":"Request body is too large."}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            return await self.app(scope, receive, send)
+        max_body_size = self._limit_for(scope["path"])
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_body_size:
+            return await self._reject(send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    exceeded = True
+                    raise BodyTooLargeError()
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app answers to the aborted body is replaced by the 413
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except BodyTooLargeError:
+            pass
+        if exceeded:
+            await self._reject(send)
+
+
+async def read_upload(file: UploadFile, max_size: int, chunk_size: int = UPLOAD_CHUNK_SIZE) -> bytearray:
+    """
+    Read an upload in chunks into a single buffer, failing with 413 as soon as
+    it grows past `max_size` (or up front when its size is already known).
+    """
+    if file.size is not None and file.size > max_size:
+        raise HTTPException(413, "File is too large.")
+
+    buffer = bytearray()
+    while chunk := await file.read(chunk_size):
+        buffer += chunk
+        if len(buffer) > max_size:
+            raise HTTPException(413, "File is too large.")
+    return buffer
+
+
+async def read_uploads(files, max_size: int, max_total: int) -> list:
+    """
+    read_upload for several files, each up to `max_size` bytes and together up
+    to `max_total`: the budget left bounds each read, so a request never holds
+    more than `max_total` bytes of uploads in memory.
+    """
+    contents = []
+    remaining = max_total
+    for file in files:
+        limit = min(max_size, remaining)
+        try:
+            content = await read_upload(file, limit)
+        except HTTPException:
+            if limit < max_size:
+                raise HTTPException(413, "Files are too large together.")
+            raise
+        remaining -= len(content)
+        contents.append(content)
+    return contents